@@ -1,9 +1,25 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from flask_mysqldb import MySQL
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, session
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime, timedelta
 import os
+import time
+import click
 from dotenv import load_dotenv
+from markupsafe import Markup
+from realtime import ChatHub, direct_channel, group_channel, sse_stream
+import migrations
+from cache import MembershipCache, TTLCache
+from db import PooledMySQL, PoolTimeout
+from hashing import HashPoolBusy, PasswordHasher
+from metrics import Instrumentation
+from responses import json_response
+import export
+import archive
+from assets import StaticAssets
+from batching import WriteBatcher
+from broker import MemoryBroker, MySQLBroker
+from ratelimit import AdmissionControl, Overloaded, RateLimited, retry_after_header
+from storage import MySQLStore, SQLiteStore, message_page_query
 
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY') or 'your-secret-key-here'
@@ -15,7 +31,52 @@ app.config['MYSQL_PASSWORD'] = os.getenv('MYSQL_PASSWORD') or 'root'
 app.config['MYSQL_DB'] = os.getenv('MYSQL_DB') or 'messenger_db'
 app.config['MYSQL_CURSORCLASS'] = 'DictCursor'
 
-mysql = MySQL(app)
+# Пул соединений
+app.config['MYSQL_POOL_MIN_SIZE'] = int(os.getenv('MYSQL_POOL_MIN_SIZE') or 2)
+app.config['MYSQL_POOL_MAX_SIZE'] = int(os.getenv('MYSQL_POOL_MAX_SIZE') or 20)
+app.config['MYSQL_POOL_TIMEOUT'] = float(os.getenv('MYSQL_POOL_TIMEOUT') or 5)
+app.config['MYSQL_POOL_RECYCLE'] = int(os.getenv('MYSQL_POOL_RECYCLE') or 3600)
+app.config['MYSQL_POOL_PRE_PING'] = (os.getenv('MYSQL_POOL_PRE_PING') or '1') == '1'
+# Реплики для маршрутов чтения: host[:port] через запятую, пусто - всё читается с primary
+app.config['MYSQL_REPLICA_HOSTS'] = os.getenv('MYSQL_REPLICA_HOSTS') or ''
+app.config['MYSQL_READ_YOUR_WRITES_WINDOW'] = float(os.getenv('MYSQL_READ_YOUR_WRITES_WINDOW') or 5)
+app.config['MYSQL_MULTI_STATEMENTS'] = (os.getenv('MYSQL_MULTI_STATEMENTS') or '0') == '1'
+
+mysql = PooledMySQL(app)
+
+# Хранилище данных для маршрутов: mysql - сервер MySQL через пул выше,
+# sqlite - встроенная база в файле SQLITE_PATH (один узел, тесты и бенчмарки без сервера БД)
+app.config['DATABASE_BACKEND'] = os.getenv('DATABASE_BACKEND') or 'mysql'
+app.config['SQLITE_PATH'] = os.getenv('SQLITE_PATH') or 'messenger.db'
+app.config['SQLITE_CACHE_SIZE_MB'] = int(os.getenv('SQLITE_CACHE_SIZE_MB') or 64)
+# Минимальная длина токена ngram-парсера MySQL (ngram_token_size)
+NGRAM_TOKEN_SIZE = int(os.getenv('NGRAM_TOKEN_SIZE') or 2)
+# Без ngram-парсера (MariaDB) поиск идёт по индексу в памяти, он перечитывается раз в столько секунд
+USER_SEARCH_RELOAD = int(os.getenv('USER_SEARCH_RELOAD') or 300)
+
+if app.config['DATABASE_BACKEND'] == 'sqlite':
+    store = SQLiteStore(app.config['SQLITE_PATH'], cache_size_mb=app.config['SQLITE_CACHE_SIZE_MB'])
+else:
+    store = MySQLStore(mysql, ngram_token_size=NGRAM_TOKEN_SIZE, search_reload=USER_SEARCH_RELOAD)
+
+# Real-time доставка сообщений подписанным сессиям
+hub = ChatHub(queue_size=int(os.getenv('CHAT_STREAM_QUEUE_SIZE') or 100))
+
+# Рассылка событий: memory - один процесс, mysql - несколько воркеров и узлов через таблицу fanout_events
+app.config['CHAT_BROKER'] = os.getenv('CHAT_BROKER') or 'memory'
+app.config['CHAT_BROKER_POLL_MS'] = float(os.getenv('CHAT_BROKER_POLL_MS') or 100)
+app.config['CHAT_BROKER_RETENTION'] = int(os.getenv('CHAT_BROKER_RETENTION') or 60)
+app.config['PRESENCE_TTL'] = int(os.getenv('PRESENCE_TTL') or 30)
+
+if app.config['CHAT_BROKER'] == 'mysql':
+    if not isinstance(store, MySQLStore):
+        raise RuntimeError('CHAT_BROKER=mysql requires DATABASE_BACKEND=mysql')
+    broker = MySQLBroker(hub, mysql.pool,
+                         poll_interval=app.config['CHAT_BROKER_POLL_MS'] / 1000,
+                         retention=app.config['CHAT_BROKER_RETENTION'],
+                         presence_ttl=app.config['PRESENCE_TTL'])
+else:
+    broker = MemoryBroker(hub)
 
 # Flask-Login
 login_manager = LoginManager()
@@ -28,16 +89,111 @@ class User(UserMixin):
         self.username = username
         self.email = email
 
+# Кэш пользователей для Flask-Login, чтобы не ходить в базу на каждый запрос
+user_cache = TTLCache(maxsize=int(os.getenv('USER_CACHE_SIZE') or 10000),
+                      ttl=int(os.getenv('USER_CACHE_TTL') or 300))
+
 @login_manager.user_loader
 def load_user(user_id):
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-    user = cur.fetchone()
-    cur.close()
+    user_id = int(user_id)
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    user = store.get_user(user_id)
     if user:
-        return User(id=user['id'], username=user['username'], email=user['email'])
+        user_obj = User(id=user['id'], username=user['username'], email=user['email'])
+        user_cache.set(user_id, user_obj)
+        return user_obj
     return None
 
+
+# Хэширование паролей в отдельном пуле процессов
+hasher = PasswordHasher(workers=int(os.getenv('PASSWORD_HASH_WORKERS') or 0) or None,
+                        max_pending=int(os.getenv('PASSWORD_HASH_MAX_PENDING') or 64),
+                        method=os.getenv('PASSWORD_HASH_METHOD') or None,
+                        timeout=float(os.getenv('PASSWORD_HASH_TIMEOUT') or 10))
+
+# Кэш участников групп для проверок доступа
+membership_cache = MembershipCache(store.group_member_ids,
+                                   maxsize=int(os.getenv('MEMBERSHIP_CACHE_SIZE') or 10000),
+                                   ttl=int(os.getenv('MEMBERSHIP_CACHE_TTL') or 60))
+
+# Изменения состава группы рассылаются через брокер, и каждый процесс сбрасывает свою копию
+# участников. Любое изменение group_members после commit должно публиковать это событие
+MEMBERSHIP_CHANNEL = 'membership'
+broker.listen(MEMBERSHIP_CHANNEL, lambda event: membership_cache.invalidate(event['group_id']))
+app.before_request(broker.start)
+
+# Метрики запросов, лог медленных SQL-запросов и /metrics
+app.config['SLOW_QUERY_THRESHOLD_MS'] = float(os.getenv('SLOW_QUERY_THRESHOLD_MS') or 200)
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+instrumentation = Instrumentation(app, store)
+
+# Ограничение частоты записей на пользователя и сброс нагрузки при исчерпании пула.
+# RATE_LIMIT_STORAGE - путь к файлу SQLite, чтобы лимиты были общими для воркеров узла
+app.config['RATE_LIMITS'] = os.getenv('RATE_LIMITS', 'send_message=20/10,send_group_message=20/10,'
+                                                     'send_friend_request=10/60,invite_to_group=20/60')
+app.config['RATE_LIMIT_STORAGE'] = os.getenv('RATE_LIMIT_STORAGE')
+app.config['MAX_CONCURRENT_REQUESTS'] = int(os.getenv('MAX_CONCURRENT_REQUESTS') or 0)
+app.config['MAX_POOL_WAITERS'] = int(os.getenv('MAX_POOL_WAITERS') or 0)
+admission = AdmissionControl(app, mysql.pool)
+
+# Статика с отпечатком содержимого в адресе, immutable-кэшем и заранее сжатыми вариантами
+app.config['STATIC_FINGERPRINTS'] = (os.getenv('STATIC_FINGERPRINTS') or '1') == '1'
+app.config['STATIC_COMPRESS_MIN_SIZE'] = int(os.getenv('STATIC_COMPRESS_MIN_SIZE') or 512)
+static_assets = StaticAssets(app)
+
+
+def cache_gauge(cache, field):
+    return lambda: cache.stats()[field]
+
+
+def pool_connections():
+    values = {}
+    for name, pool in mysql.pools().items():
+        stats = pool.stats()
+        values[(name, 'in_use')] = stats['in_use']
+        values[(name, 'idle')] = stats['idle']
+    return values
+
+
+instrumentation.gauge('db_pool_connections', 'Database pool connections by pool and state',
+                      pool_connections, ('pool', 'state'))
+instrumentation.gauge('db_pool_wait_seconds_total', 'Time requests spent waiting for a pooled connection',
+                      lambda: mysql.pool.stats()['wait_time_total'])
+instrumentation.gauge('db_pool_waiting', 'Requests waiting for a pooled connection',
+                      lambda: mysql.pool.stats()['waiting'])
+instrumentation.gauge('rate_limited_requests_total', 'Requests rejected with 429 by the per-user rate limit',
+                      cache_gauge(admission, 'rejected'))
+instrumentation.gauge('shed_requests_total', 'Requests rejected with 503 by the concurrency limits',
+                      cache_gauge(admission, 'shed'))
+instrumentation.gauge('db_pool_timeouts_total', 'Connection checkouts that timed out',
+                      lambda: mysql.pool.stats()['timeouts'])
+instrumentation.gauge('user_cache_hits_total', 'User cache hits', cache_gauge(user_cache, 'hits'))
+instrumentation.gauge('user_cache_misses_total', 'User cache misses', cache_gauge(user_cache, 'misses'))
+instrumentation.gauge('membership_cache_hits_total', 'Group membership cache hits',
+                      cache_gauge(membership_cache, 'hits'))
+instrumentation.gauge('membership_cache_misses_total', 'Group membership cache misses',
+                      cache_gauge(membership_cache, 'misses'))
+instrumentation.gauge('password_hash_pending', 'Password hashing jobs queued or running',
+                      cache_gauge(hasher, 'pending'))
+instrumentation.gauge('password_hash_rejected_total', 'Logins rejected because the hash pool was full',
+                      cache_gauge(hasher, 'rejected'))
+instrumentation.gauge('password_hash_restarts_total', 'Hash pools rebuilt after a worker process died',
+                      cache_gauge(hasher, 'restarts'))
+instrumentation.gauge('chat_stream_subscribers', 'Open real-time chat streams', hub.subscriber_count)
+instrumentation.gauge('chat_stream_resyncs_total', 'Stream queues dropped because the client fell behind',
+                      lambda: hub.resyncs)
+instrumentation.gauge('chat_broker_published_total', 'Events published by this process',
+                      cache_gauge(broker, 'published'))
+instrumentation.gauge('chat_broker_delivered_total', 'Events delivered to local subscribers',
+                      cache_gauge(broker, 'delivered'))
+instrumentation.gauge('message_batches_total', 'Message write batches committed',
+                      lambda: message_batcher.stats()['batches'] if message_batcher else 0)
+instrumentation.gauge('message_batch_messages_total', 'Messages written through batches',
+                      lambda: message_batcher.stats()['messages'] if message_batcher else 0)
+
 # Routes
 @app.route('/')
 def index():
@@ -49,27 +205,72 @@ def index():
 @app.route('/contacts')
 @login_required
 def contacts(chat_type=None, chat_id=None):
-    # Ваш существующий код
-    cur = mysql.connection.cursor()
-    
-    # Получаем список всех чатов
-    cur.execute("""
-        SELECT id, username, 'user' as type FROM users WHERE id != %s
-        UNION
-        SELECT id, name, 'group' as type FROM chat_groups
-        JOIN group_members ON chat_groups.id = group_members.group_id
-        WHERE group_members.user_id = %s
-    """, (current_user.id, current_user.id))
-    
-    chats = cur.fetchall()
-    cur.close()
-    
-    # Если передан chat_type и chat_id, открываем этот чат
+    # Список бесед подгружается страницами через /api/conversations,
+    # здесь нужно только имя чата, открытого по ссылке
     initial_chat = None
     if chat_type and chat_id:
-        initial_chat = {'type': chat_type, 'id': chat_id}
+        name = store.chat_name(chat_type, chat_id)
+        if name:
+            initial_chat = {'type': chat_type, 'id': chat_id, 'name': name}
     
-    return render_template('contacts.html', chats=chats, initial_chat=initial_chat)
+    return render_template('contacts.html', initial_chat=initial_chat)
+
+
+CONVERSATIONS_PAGE_SIZE = 30
+
+
+@app.route('/api/conversations')
+@login_required
+def conversations():
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', CONVERSATIONS_PAGE_SIZE, type=int), 1), 100)
+
+    rows = store.conversations(current_user.id, per_page + 1, (page - 1) * per_page)
+
+    return jsonify({
+        'conversations': rows[:per_page],
+        'page': page,
+        'has_more': len(rows) > per_page,
+    })
+
+
+@app.route('/api/unread')
+@login_required
+def unread_counts():
+    rows = store.unread(current_user.id)
+    return jsonify({'unread': rows, 'total': sum(row['unread_count'] for row in rows)})
+
+
+@app.route('/api/conversations/<string:chat_type>/<int:chat_id>/read', methods=['POST'])
+@login_required
+def mark_read(chat_type, chat_id):
+    if chat_type not in ('user', 'group'):
+        return jsonify({'status': 'error', 'message': 'Некорректный тип беседы'}), 400
+    data = request.get_json(silent=True) or {}
+    message_id = data.get('message_id') or request.form.get('message_id')
+    try:
+        message_id = int(message_id) if message_id else None
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Некорректный message_id'}), 400
+
+    unread = store.mark_read(current_user.id, chat_type, chat_id, message_id)
+    if unread is None:
+        return jsonify({'status': 'error', 'message': 'Беседа не найдена'}), 404
+    return jsonify({'status': 'success', 'unread_count': unread})
+
+
+def group_member_added(group_id, user_id):
+    # После commit: новый участник виден проверкам доступа, а каталог и страницы групп -
+    # с новым числом участников. Отметка в сессии доходит до любого воркера,
+    # поэтому и там пользователь сразу видит группу, в которую вступил
+    global groups_version
+    membership_cache.add(group_id, user_id)
+    group_directory.clear()
+    groups_version += 1
+    session['_groups_changed'] = time.time()
+    publish_event(MEMBERSHIP_CHANNEL, {'type': 'membership', 'group_id': int(group_id)})
+
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -77,19 +278,12 @@ def register():
         email = request.form['email']
         password = request.form['password']
         
-        cur = mysql.connection.cursor()
-        cur.execute("SELECT * FROM users WHERE username = %s OR email = %s", (username, email))
-        existing_user = cur.fetchone()
-        
-        if existing_user:
+        if store.user_exists(username, email):
             flash('Username or email already exists', 'danger')
             return redirect(url_for('register'))
         
-        hashed_password = generate_password_hash(password)
-        cur.execute("INSERT INTO users (username, email, password) VALUES (%s, %s, %s)", 
-                   (username, email, hashed_password))
-        mysql.connection.commit()
-        cur.close()
+        hashed_password = hasher.hash(password)
+        store.create_user(username, email, hashed_password)
         
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('login'))
@@ -102,13 +296,11 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        cur = mysql.connection.cursor()
-        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-        user = cur.fetchone()
-        cur.close()
+        user = store.user_for_login(username)
         
-        if user and check_password_hash(user['password'], password):
+        if user and hasher.check(user['password'], password):
             user_obj = User(id=user['id'], username=user['username'], email=user['email'])
+            user_cache.set(user_obj.id, user_obj)
             login_user(user_obj)
             next_page = request.args.get('next')
             return redirect(next_page or url_for('contacts'))  # Изменено с chat на contacts
@@ -130,94 +322,258 @@ def logout():
 @login_required
 def chat():
     # Получаем список пользователей (исключая текущего)
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT id, username FROM users WHERE id != %s", (current_user.id,))
-    users = cur.fetchall()
+    users = store.other_users(current_user.id)
     
     # Получаем последние сообщения
-    cur.execute("""
-        SELECT m.*, u.username as sender_name 
-        FROM messages m 
-        JOIN users u ON m.sender_id = u.id 
-        WHERE m.receiver_id = %s OR m.sender_id = %s 
-        ORDER BY m.timestamp DESC 
-        LIMIT 20
-    """, (current_user.id, current_user.id))
-    messages = cur.fetchall()
-    cur.close()
+    messages = store.recent_direct_messages(current_user.id, 20)
     
     return render_template('chat.html', users=users, messages=messages)
 
 
 
 # Группы
+GROUPS_PAGE_SIZE = 50
+
+# Каталог групп общий для всех пользователей: страницы кэшируются и сбрасываются
+# при создании группы и вступлении в неё
+group_directory = TTLCache(maxsize=int(os.getenv('GROUP_DIRECTORY_CACHE_SIZE') or 100),
+                           ttl=int(os.getenv('GROUP_DIRECTORY_CACHE_TTL') or 30))
+instrumentation.gauge('group_directory_cache_hits_total', 'Group directory cache hits',
+                      cache_gauge(group_directory, 'hits'))
+instrumentation.gauge('group_directory_cache_misses_total', 'Group directory cache misses',
+                      cache_gauge(group_directory, 'misses'))
+
+# Отрисованные фрагменты страниц групп. Версия данных входит в ключ, поэтому при изменениях
+# фрагменты не сбрасываются: старые ключи просто перестают запрашиваться и вытесняются
+fragment_cache = TTLCache(maxsize=int(os.getenv('FRAGMENT_CACHE_SIZE') or 10000),
+                          ttl=int(os.getenv('FRAGMENT_CACHE_TTL') or 30))
+instrumentation.gauge('fragment_cache_hits_total', 'Rendered fragment cache hits',
+                      cache_gauge(fragment_cache, 'hits'))
+instrumentation.gauge('fragment_cache_misses_total', 'Rendered fragment cache misses',
+                      cache_gauge(fragment_cache, 'misses'))
+instrumentation.gauge('static_compressed_responses_total', 'Static files served from precompressed variants',
+                      cache_gauge(static_assets, 'compressed_hits'))
+
+# Версия данных групп в этом процессе: растёт при создании группы и вступлении.
+# Изменения в других воркерах видны после FRAGMENT_CACHE_TTL, как и в каталоге групп
+groups_version = 0
+
+
+def render_fragment(key, template, **context):
+    html = Markup(render_template(template, **context))
+    fragment_cache.set(key, html)
+    return html
+
+
+def group_directory_page(page):
+    cached = group_directory.get(page)
+    if cached is not None:
+        return cached
+
+    rows = store.group_directory(GROUPS_PAGE_SIZE + 1, (page - 1) * GROUPS_PAGE_SIZE)
+    result = (list(rows[:GROUPS_PAGE_SIZE]), len(rows) > GROUPS_PAGE_SIZE)
+    group_directory.set(page, result)
+    return result
+
+
 @app.route('/groups')
 @login_required
 def groups():
-    cur = mysql.connection.cursor()
-    
-    # 1. Запрос для групп, где пользователь является участником
-    cur.execute("""
-        SELECT g.*, u.username as creator_name 
-        FROM chat_groups g
-        JOIN users u ON g.created_by = u.id
-        JOIN group_members gm ON g.id = gm.group_id
-        WHERE gm.user_id = %s
-    """, (current_user.id,))
-    user_groups = cur.fetchall()
-    
-    # 2. Запрос для всех групп (с указанием, является ли пользователь участником)
-    cur.execute("""
-        SELECT g.*, u.username as creator_name,
-               EXISTS(
-                   SELECT 1 FROM group_members 
-                   WHERE group_id = g.id AND user_id = %s
-               ) as is_member
-        FROM chat_groups g
-        JOIN users u ON g.created_by = u.id
-    """, (current_user.id,))
-    all_groups = cur.fetchall()
-    
-    cur.close()
-    return render_template('groups.html', user_groups=user_groups, all_groups=all_groups)
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    # Списки зависят от пользователя (кнопки "Вступить"/"Открыть"), поэтому он входит в ключ
+    key = ('groups', current_user.id, page, groups_version, session.get('_groups_changed'))
+    lists_html = fragment_cache.get(key)
+    if lists_html is None:
+        all_groups, has_more = group_directory_page(page)
+        user_groups = store.user_groups(current_user.id)
+        member_ids = {group['id'] for group in user_groups}
+        lists_html = render_fragment(key, 'fragments/groups_lists.html', user_groups=user_groups,
+                                     all_groups=all_groups, member_ids=member_ids, page=page,
+                                     has_more=has_more)
+    return render_template('groups.html', lists_html=lists_html)
 
 # Удаляем все маршруты, связанные с friend_requests
 # Оставляем только работу с группами и сообщениями
 
 
 
+MESSAGE_PAGE_SIZE = 100
+
+
+def epoch_ms(value):
+    return int(value.timestamp() * 1000)
+
+
+def compact_message(row):
+    # Только то, что нужно клиенту для отрисовки; время - миллисекунды Unix
+    return {
+        'id': row['id'],
+        'sender_id': row['sender_id'],
+        'sender_name': row['sender_name'],
+        'message': row['message'],
+        'timestamp': epoch_ms(row['timestamp']),
+    }
+
+
+def fetch_message_page(chat_type, chat_id, after_id=None, before_id=None, limit=MESSAGE_PAGE_SIZE):
+    # Keyset-пагинация по (timestamp, id): страница до before_id, после after_id или последняя.
+    # Лишняя строка говорит о том, что в этом направлении есть ещё сообщения
+    rows = store.message_page(chat_type, chat_id, current_user.id, after_id, before_id, limit + 1)
+    has_more = len(rows) > limit
+    rows = [compact_message(row) for row in rows[:limit]]
+    if not after_id:
+        rows.reverse()
+
+    return {
+        'messages': rows,
+        'has_more': has_more,
+        # Курсор для догрузки более старых сообщений
+        'before_id': rows[0]['id'] if rows and has_more and not after_id else None,
+        # Курсор для получения только новых сообщений
+        'after_id': rows[-1]['id'] if rows else after_id,
+    }
+
+
 @app.route('/get_chat_messages/<string:chat_type>/<int:chat_id>')
 @login_required
 def get_chat_messages(chat_type, chat_id):
-    cur = mysql.connection.cursor()
+    after_id = request.args.get('after_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    limit = min(request.args.get('limit', MESSAGE_PAGE_SIZE, type=int), MESSAGE_PAGE_SIZE)
+    if after_id and before_id:
+        return jsonify({'error': 'Укажите только after_id или before_id'}), 400
+    if limit < 1:
+        return jsonify({'error': 'Некорректный limit'}), 400
+
+    if chat_type != 'user' and not membership_cache.is_member(chat_id, current_user.id):
+        return jsonify({'error': 'Вы не в группе'}), 403
+
     try:
-        if chat_type == 'user':
-            cur.execute("""
-                SELECT m.*, u.username as sender_name 
-                FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE (m.sender_id = %s AND m.receiver_id = %s)
-                   OR (m.sender_id = %s AND m.receiver_id = %s)
-                ORDER BY m.timestamp DESC
-                LIMIT 100
-            """, (current_user.id, chat_id, chat_id, current_user.id))
-        else:
-            cur.execute("""
-                SELECT gm.*, u.username as sender_name 
-                FROM group_messages gm
-                JOIN users u ON gm.sender_id = u.id
-                WHERE gm.group_id = %s
-                ORDER BY gm.timestamp DESC
-                LIMIT 100
-            """, (chat_id,))
-        
-        messages = cur.fetchall()
-        return jsonify(messages)
+        # Версия беседы - id её последнего сообщения из conversation_summaries (один поиск по PK).
+        # Если у клиента уже есть этот ответ, отдаём 304 без запроса истории
+        summary = store.conversation_version(current_user.id, 'user' if chat_type == 'user' else 'group', chat_id)
+        newest_id = (summary['last_message_id'] or 0) if summary else 0
+        etag = f"m{newest_id}-a{after_id or 0}-b{before_id or 0}-l{limit}"
+        if request.if_none_match.contains_weak(etag):
+            not_modified = Response(status=304)
+            not_modified.set_etag(etag, weak=True)
+            return not_modified
+
+        page = fetch_message_page(chat_type, chat_id, after_id, before_id, limit)
+        response = json_response(page)
+        response.set_etag(etag, weak=True)
+        if summary:
+            response.last_modified = summary['last_message_at']
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error fetching messages: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        cur.close()
+
+
+@app.route('/export/<string:chat_type>/<int:chat_id>')
+@login_required
+def export_chat(chat_type, chat_id):
+    # Полная выгрузка истории беседы потоком, без загрузки в память
+    fmt = request.args.get('format', 'ndjson')
+    if chat_type not in ('user', 'group') or fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Некорректный тип беседы или формат'}), 400
+    if chat_type == 'group' and not membership_cache.is_member(chat_id, current_user.id):
+        return jsonify({'error': 'Вы не в группе'}), 403
+
+    filename = f"{chat_type}-{chat_id}-{datetime.now():%Y%m%d%H%M%S}.{fmt}"
+    body = export.stream_export(store.export_batches(chat_type, chat_id, current_user.id), chat_type, fmt)
+    return Response(body,
+                    mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+def message_event(message_id, chat_type, chat_id, message):
+    # Формат совпадает со строками get_chat_messages, чтобы клиент рисовал их одинаково
+    event = {
+        'id': message_id,
+        'chat_type': chat_type,
+        'sender_id': current_user.id,
+        'sender_name': current_user.username,
+        'message': message,
+        'timestamp': int(time.time() * 1000),
+    }
+    if chat_type == 'user':
+        event['receiver_id'] = int(chat_id)
+    else:
+        event['group_id'] = int(chat_id)
+    return event
+
+
+def publish_event(channel, event):
+    # Публикация после commit: запись уже сохранена, поэтому сбой брокера только пишется в лог.
+    # Ошибка в ответе заставила бы клиента повторить отправку и создать дубликат; подписчики
+    # без события догрузят сообщение по after_id при следующем запросе истории
+    try:
+        broker.publish(channel, event)
+    except Exception:
+        app.logger.exception("event for %s not published", channel)
+
+
+@app.route('/stream/<string:chat_type>/<int:chat_id>')
+@login_required
+def stream_chat(chat_type, chat_id):
+    if chat_type == 'user':
+        channel = direct_channel(current_user.id, chat_id)
+    else:
+        if not membership_cache.is_member(chat_id, current_user.id):
+            return jsonify({'status': 'error', 'message': 'Вы не в группе'}), 403
+        channel = group_channel(chat_id)
+
+    # Открытый поток - признак присутствия пользователя
+    user_id = current_user.id
+    stream = sse_stream(hub, channel, app.json.dumps,
+                        on_open=lambda: broker.connect(user_id), on_close=lambda: broker.disconnect(user_id))
+    return Response(stream,
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/presence')
+@login_required
+def presence():
+    # ?ids=1,2,3 - кто из перечисленных пользователей сейчас онлайн
+    try:
+        user_ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Некорректный список ids'}), 400
+    return jsonify({'online': broker.online(user_ids[:100])})
+
+
+def save_message(chat_type, chat_id, sender_id, message):
+    # С MESSAGE_WRITE_BATCHING сообщение уходит в общую пачку, иначе пишется своей транзакцией
+    if message_batcher is not None:
+        # Пачку пишет фоновый поток - запись отмечаем сами, чтобы сработал read-your-writes
+        mysql.mark_written()
+        return message_batcher.submit(chat_type, chat_id, sender_id, message)
+    return store.insert_message(chat_type, chat_id, sender_id, message)
+
+
+# Групповая фиксация записей сообщений (выключена по умолчанию)
+app.config['MESSAGE_WRITE_BATCHING'] = (os.getenv('MESSAGE_WRITE_BATCHING') or '0') == '1'
+app.config['MESSAGE_BATCH_WINDOW_MS'] = float(os.getenv('MESSAGE_BATCH_WINDOW_MS') or 5)
+app.config['MESSAGE_BATCH_MAX_SIZE'] = int(os.getenv('MESSAGE_BATCH_MAX_SIZE') or 100)
+
+
+def make_message_batcher(window, max_size):
+    # Батчер пишет через пул MySQL и обновляет сводки бесед в той же транзакции
+    if not isinstance(store, MySQLStore):
+        raise RuntimeError('MESSAGE_WRITE_BATCHING requires DATABASE_BACKEND=mysql')
+    return WriteBatcher(mysql.pool, window=window, max_size=max_size, after_insert=store.update_summaries)
+
+
+message_batcher = None
+if app.config['MESSAGE_WRITE_BATCHING']:
+    message_batcher = make_message_batcher(app.config['MESSAGE_BATCH_WINDOW_MS'] / 1000,
+                                           app.config['MESSAGE_BATCH_MAX_SIZE'])
 
 
 @app.route('/send_message', methods=['POST'])
@@ -232,41 +588,26 @@ def send_message():
         if not all([chat_type, chat_id, message]):
             return jsonify({'status': 'error', 'message': 'Неполные данные'}), 400
 
-        cur = mysql.connection.cursor()
-
         if chat_type == 'user':
             # Проверка существования получателя
-            cur.execute("SELECT 1 FROM users WHERE id = %s", (chat_id,))
-            if not cur.fetchone():
+            if not store.has_user(chat_id):
                 return jsonify({'status': 'error', 'message': 'Пользователь не найден'}), 404
-            
-            cur.execute("""
-                INSERT INTO messages (sender_id, receiver_id, message)
-                VALUES (%s, %s, %s)
-            """, (current_user.id, chat_id, message))
+            channel = direct_channel(current_user.id, chat_id)
         else:
             # Проверка членства в группе
-            cur.execute("""
-                SELECT 1 FROM group_members 
-                WHERE group_id = %s AND user_id = %s
-            """, (chat_id, current_user.id))
-            if not cur.fetchone():
+            if not membership_cache.is_member(chat_id, current_user.id):
                 return jsonify({'status': 'error', 'message': 'Вы не в группе'}), 403
-            
-            cur.execute("""
-                INSERT INTO group_messages (group_id, sender_id, message)
-                VALUES (%s, %s, %s)
-            """, (chat_id, current_user.id, message))
-        
-        mysql.connection.commit()
-        return jsonify({'status': 'success'}), 200
+            channel = group_channel(chat_id)
+
+        message_id = save_message(chat_type, chat_id, current_user.id, message)
+
+        # Рассылаем уже закоммиченное сообщение подписчикам беседы
+        event = message_event(message_id, chat_type, chat_id, message)
+        publish_event(channel, event)
+        return jsonify({'status': 'success', 'data': event}), 200
         
     except Exception as e:
-        mysql.connection.rollback()
         return jsonify({'status': 'error', 'message': str(e)}), 500
-    finally:
-        if 'cur' in locals():
-            cur.close()
 
 @app.route('/create_group', methods=['GET'])
 @login_required
@@ -283,105 +624,44 @@ def create_group():
         flash('Group name is required', 'danger')
         return redirect(url_for('show_create_group'))
     
-    cur = mysql.connection.cursor()
     try:
-        cur.execute("INSERT INTO `chat_groups` (name, description, created_by) VALUES (%s, %s, %s)", 
-                   (name, description, current_user.id))
-        group_id = cur.lastrowid
-        cur.execute("INSERT INTO group_members (group_id, user_id) VALUES (%s, %s)", 
-                   (group_id, current_user.id))
-        mysql.connection.commit()
+        group_id = store.create_group(name, description, current_user.id)
+        group_member_added(group_id, current_user.id)
         flash('Group created successfully!', 'success')
         return redirect(url_for('group_chat', group_id=group_id))
     except Exception as e:
-        mysql.connection.rollback()
         flash(f'Error creating group: {str(e)}', 'danger')
         return redirect(url_for('show_create_group'))
-    finally:
-        cur.close()
 
 # Маршруты для друзей
 @app.route('/send_friend_request/<int:user_id>')
 @login_required
 def send_friend_request(user_id):
-    cur = mysql.connection.cursor()
     try:
-        # Проверяем, не отправили ли уже запрос
-        cur.execute("""
-            SELECT 1 FROM friend_requests 
-            WHERE sender_id = %s AND receiver_id = %s AND status = 'pending'
-        """, (current_user.id, user_id))
-        if cur.fetchone():
+        if store.send_friend_request(current_user.id, current_user.username, user_id):
+            flash('Запрос дружбы отправлен', 'success')
+        else:
             flash('Запрос дружбы уже отправлен', 'warning')
-            return redirect(url_for('contacts'))
-        
-        # Создаем запрос
-        cur.execute("""
-            INSERT INTO friend_requests (sender_id, receiver_id)
-            VALUES (%s, %s)
-        """, (current_user.id, user_id))
-        
-        # Создаем уведомление
-        cur.execute("""
-            INSERT INTO notifications (user_id, content, notification_type, related_id)
-            VALUES (%s, %s, 'friend_request', %s)
-        """, (user_id, f"{current_user.username} хочет добавить вас в друзья", cur.lastrowid))
-        
-        mysql.connection.commit()
-        flash('Запрос дружбы отправлен', 'success')
     except Exception as e:
-        mysql.connection.rollback()
         flash(f'Ошибка: {str(e)}', 'danger')
-    finally:
-        cur.close()
     return redirect(url_for('contacts'))
 
 # Маршруты для групп
 @app.route('/invite_to_group/<int:group_id>/<int:user_id>')
 @login_required
 def invite_to_group(group_id, user_id):
-    cur = mysql.connection.cursor()
+    # Проверяем права (только участники группы могут приглашать)
+    if not membership_cache.is_member(group_id, current_user.id):
+        flash('Вы не можете приглашать в эту группу', 'danger')
+        return redirect(url_for('group_chat', group_id=group_id))
+
     try:
-        # Проверяем права (только участники группы могут приглашать)
-        cur.execute("""
-            SELECT 1 FROM group_members 
-            WHERE group_id = %s AND user_id = %s
-        """, (group_id, current_user.id))
-        if not cur.fetchone():
-            flash('Вы не можете приглашать в эту группу', 'danger')
-            return redirect(url_for('group_chat', group_id=group_id))
-        
-        # Проверяем, не отправили ли уже приглашение
-        cur.execute("""
-            SELECT 1 FROM group_invitations 
-            WHERE group_id = %s AND receiver_id = %s AND status = 'pending'
-        """, (group_id, user_id))
-        if cur.fetchone():
+        if store.invite_to_group(group_id, current_user.id, current_user.username, user_id):
+            flash('Приглашение отправлено', 'success')
+        else:
             flash('Приглашение уже отправлено', 'warning')
-            return redirect(url_for('group_chat', group_id=group_id))
-        
-        # Создаем приглашение
-        cur.execute("""
-            INSERT INTO group_invitations (group_id, sender_id, receiver_id)
-            VALUES (%s, %s, %s)
-        """, (group_id, current_user.id, user_id))
-        
-        # Создаем уведомление
-        cur.execute("SELECT name FROM chat_groups WHERE id = %s", (group_id,))
-        group_name = cur.fetchone()['name']
-        
-        cur.execute("""
-            INSERT INTO notifications (user_id, content, notification_type, related_id)
-            VALUES (%s, %s, 'group_invite', %s)
-        """, (user_id, f"{current_user.username} приглашает вас в группу '{group_name}'", cur.lastrowid))
-        
-        mysql.connection.commit()
-        flash('Приглашение отправлено', 'success')
     except Exception as e:
-        mysql.connection.rollback()
         flash(f'Ошибка: {str(e)}', 'danger')
-    finally:
-        cur.close()
     return redirect(url_for('group_chat', group_id=group_id))
 
 
@@ -393,139 +673,119 @@ def invite_to_group(group_id, user_id):
 @app.route('/handle_request/<string:type>/<int:request_id>/<string:action>')
 @login_required
 def handle_request(type, request_id, action):
-    cur = mysql.connection.cursor()
     try:
-        if type == 'friend':
-            # Обновляем статус запроса дружбы
-            cur.execute("""
-                UPDATE friend_requests 
-                SET status = %s 
-                WHERE id = %s AND receiver_id = %s
-            """, (action, request_id, current_user.id))
-            
-            # Если приняли - добавляем в друзья (ваша логика)
-            if action == 'accepted':
-                # Здесь можно добавить логику добавления в друзья
-                pass
-                
-        elif type == 'group':
-            # Обновляем статус приглашения в группу
-            cur.execute("""
-                UPDATE group_invitations 
-                SET status = %s 
-                WHERE id = %s AND receiver_id = %s
-            """, (action, request_id, current_user.id))
-            
-            # Если приняли - добавляем в группу
-            if action == 'accepted':
-                cur.execute("""
-                    SELECT group_id FROM group_invitations 
-                    WHERE id = %s
-                """, (request_id,))
-                group_id = cur.fetchone()['group_id']
-                
-                cur.execute("""
-                    INSERT INTO group_members (group_id, user_id)
-                    VALUES (%s, %s)
-                """, (group_id, current_user.id))
-        
-        mysql.connection.commit()
+        # Для принятого приглашения в группу - id группы, в которую вступил пользователь
+        joined_group_id = store.answer_request(type, request_id, current_user.id, action)
+        if joined_group_id:
+            group_member_added(joined_group_id, current_user.id)
         flash(f'Запрос {action}', 'success')
     except Exception as e:
-        mysql.connection.rollback()
         flash(f'Ошибка: {str(e)}', 'danger')
-    finally:
-        cur.close()
     return redirect(url_for('notifications'))
 
+SEARCH_PAGE_SIZE = 10
+
+
 @app.route('/search_users')
 @login_required
 def search_users():
-    query = request.args.get('q', '')
-    cur = mysql.connection.cursor()
-    cur.execute("""
-        SELECT id, username FROM users 
-        WHERE username LIKE %s AND id != %s
-        LIMIT 10
-    """, (f"%{query}%", current_user.id))
-    users = cur.fetchall()
-    cur.close()
-    return jsonify(users)
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', SEARCH_PAGE_SIZE, type=int), 1), 50)
+    if not query:
+        return jsonify({'users': [], 'page': page, 'has_more': False})
+
+    users = store.search_users(query, current_user.id, per_page + 1, (page - 1) * per_page)
+    return jsonify({'users': users[:per_page], 'page': page, 'has_more': len(users) > per_page})
 
 @app.route('/join_group/<int:group_id>')
 @login_required
 def join_group(group_id):
-    cur = mysql.connection.cursor()
     try:
-        cur.execute("INSERT INTO group_members (group_id, user_id) VALUES (%s, %s)", 
-                   (group_id, current_user.id))
-        mysql.connection.commit()
+        store.join_group(group_id, current_user.id)
+        group_member_added(group_id, current_user.id)
         flash('You have joined the group!', 'success')
     except Exception as e:
-        mysql.connection.rollback()
         flash(f'Error joining group: {str(e)}', 'danger')
-    finally:
-        cur.close()
     
     return redirect(url_for('groups'))
 
 @app.route('/group_chat/<int:group_id>')
 @login_required
 def group_chat(group_id):
-    cur = mysql.connection.cursor()
-    
     # Проверяем, является ли пользователь участником группы
-    cur.execute("""
-        SELECT 1 FROM group_members 
-        WHERE group_id = %s AND user_id = %s
-    """, (group_id, current_user.id))
-    if not cur.fetchone():
+    if not membership_cache.is_member(group_id, current_user.id):
         flash('You are not a member of this group', 'danger')
         return redirect(url_for('groups'))
-    
-    # Информация о группе (с исправленным названием таблицы)
-    cur.execute("""
-        SELECT g.*, u.username as creator_name 
-        FROM chat_groups g
-        JOIN users u ON g.created_by = u.id
-        WHERE g.id = %s
-    """, (group_id,))
-    group = cur.fetchone()
-    
-    # Участники группы
-    cur.execute("""
-        SELECT u.id, u.username 
-        FROM group_members gm
-        JOIN users u ON gm.user_id = u.id
-        WHERE gm.group_id = %s
-    """, (group_id,))
-    members = cur.fetchall()
-    
-    # Сообщения в группе
-    cur.execute("""
-        SELECT gm.*, u.username as sender_name 
-        FROM group_messages gm
-        JOIN users u ON gm.sender_id = u.id
-        WHERE gm.group_id = %s
-        ORDER BY gm.timestamp DESC
-        LIMIT 50
-    """, (group_id,))
-    messages = cur.fetchall()
-    cur.close()
-    
-    return render_template('group_chat.html', group=group, members=members, messages=messages)
+
+    # Версия списка участников - их множество из membership_cache, уже загруженное проверкой выше.
+    # Если фрагмент есть в кэше, участников из базы не читаем
+    members_key = ('group_members', group_id, membership_cache.members(group_id))
+    members_html = fragment_cache.get(members_key)
+    group, members, messages = store.group_page(group_id, 50, with_members=members_html is None)
+    if members_html is None:
+        members_html = render_fragment(members_key, 'fragments/group_members.html', members=members)
+    # Шаблон показывает сообщения сверху вниз
+    messages = list(reversed(messages))
+
+    return render_template('group_chat.html', group=group, members_html=members_html, messages=messages)
 
 @app.route('/profile')
 @login_required
 def profile():
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM users WHERE id = %s", (current_user.id,))
-    user_data = cur.fetchone()
-    cur.close()
+    user_data = store.get_user(current_user.id)
+
+    # Профиль читается напрямую из базы - заодно обновляем закэшированную копию.
+    # Код, меняющий users, должен вызывать user_cache.invalidate(user_id)
+    if user_data:
+        user_cache.set(user_data['id'], User(id=user_data['id'], username=user_data['username'],
+                                             email=user_data['email']))
     
     return render_template('profile.html', user=user_data)
 
 
+@app.route('/stats/cache')
+@login_required
+def cache_stats():
+    return jsonify({'users': user_cache.stats(), 'group_members': membership_cache.stats(),
+                    'group_directory': group_directory.stats(), 'fragments': fragment_cache.stats(),
+                    'static': static_assets.stats()})
+
+
+@app.route('/stats/db')
+@login_required
+def db_stats():
+    return jsonify({'pool': mysql.pool.stats(), 'replicas': [pool.stats() for pool in mysql.replica_pools]})
+
+
+@app.errorhandler(HashPoolBusy)
+def hash_pool_busy(e):
+    return 'Слишком много входов одновременно, повторите через несколько секунд', 503, {'Retry-After': '2'}
+
+
+@app.errorhandler(RateLimited)
+def rate_limited(e):
+    headers = {'Retry-After': retry_after_header(e.retry_after)}
+    if request.path.startswith('/api/') or request.is_json:
+        return jsonify({'status': 'error', 'message': 'Слишком много запросов, повторите позже'}), 429, headers
+    return 'Слишком много запросов, повторите позже', 429, headers
+
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    if request.path.startswith('/api/') or request.is_json:
+        return jsonify({'status': 'error', 'message': 'Сервер перегружен, повторите позже'}), 503, {'Retry-After': '1'}
+    return 'Сервер перегружен, повторите позже', 503, {'Retry-After': '1'}
+
+
+@app.errorhandler(PoolTimeout)
+def pool_timeout(e):
+    # Все соединения заняты: быстро отказываем, а не копим запросы в очереди
+    if request.path.startswith('/api/') or request.is_json:
+        return jsonify({'status': 'error', 'message': 'Сервер перегружен, повторите позже'}), 503
+    return 'Сервер перегружен, повторите позже', 503
+
+
 @app.route('/send_group_message', methods=['POST'])
 @login_required
 def send_group_message():
@@ -542,27 +802,19 @@ def send_group_message():
         flash('Invalid group', 'danger')
         return redirect(url_for('groups'))
     
-    cur = mysql.connection.cursor()
+    # Проверяем, является ли пользователь участником группы
+    if not membership_cache.is_member(group_id, current_user.id):
+        flash('You are not a member of this group', 'danger')
+        return redirect(url_for('groups'))
+
     try:
-        # Проверяем, является ли пользователь участником группы
-        cur.execute("SELECT 1 FROM group_members WHERE group_id = %s AND user_id = %s", 
-                   (group_id, current_user.id))
-        if not cur.fetchone():
-            flash('You are not a member of this group', 'danger')
-            return redirect(url_for('groups'))
-        
-        cur.execute("""
-            INSERT INTO group_messages (group_id, sender_id, message) 
-            VALUES (%s, %s, %s)
-        """, (group_id, current_user.id, message))
-        mysql.connection.commit()
-        flash('Message sent to group!', 'success')
+        message_id = save_message('group', group_id, current_user.id, message)
     except Exception as e:
-        mysql.connection.rollback()
         flash(f'Error sending message: {str(e)}', 'danger')
-    finally:
-        cur.close()
-    
+    else:
+        publish_event(group_channel(group_id), message_event(message_id, 'group', group_id, message))
+        flash('Message sent to group!', 'success')
+
     return redirect(url_for('group_chat', group_id=group_id))
     
     return redirect(url_for('chat'))
@@ -585,5 +837,76 @@ def create_chat():
 
 
 
+# Миграции схемы и проверка планов горячих запросов
+def require_mysql(command):
+    # Архив, импорт и EXPLAIN есть только у MySQL
+    if not isinstance(store, MySQLStore):
+        raise click.UsageError(f"{command} requires DATABASE_BACKEND=mysql")
+
+
+@app.cli.command('db-upgrade')
+def db_upgrade():
+    if isinstance(store, SQLiteStore):
+        # У встроенной базы одна схема, она создаётся целиком при первом подключении
+        store.create_schema()
+        print(f"SQLite schema is up to date: {app.config['SQLITE_PATH']}")
+        return
+    applied = migrations.upgrade(mysql.connection)
+    print(f"Applied {len(applied)} migration(s)" if applied else "Schema is up to date")
+
+
+@app.cli.command('import-messages')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default=None,
+              help='Формат файла; по умолчанию по расширению')
+@click.option('--batch-size', type=int, default=export.IMPORT_BATCH_SIZE)
+def import_messages_command(path, fmt, batch_size):
+    require_mysql('import-messages')
+    fmt = fmt or ('csv' if path.endswith('.csv') else 'ndjson')
+    with open(path, encoding='utf-8', newline='') as f:
+        imported = export.import_messages(mysql.connection, export.read_rows(f, fmt), batch_size)
+    # Беседы, которых ещё не было в списках пользователей, появятся там
+    cur = mysql.connection.cursor()
+    migrations.backfill_conversation_summaries(cur)
+    mysql.connection.commit()
+    cur.close()
+    print(f"Imported {imported} message(s)")
+
+
+@app.cli.command('archive-messages')
+@click.option('--older-than-days', type=int, default=lambda: int(os.getenv('ARCHIVE_AFTER_DAYS') or 180),
+              help='Archive messages older than this many days')
+@click.option('--segment-size', type=int, default=archive.SEGMENT_SIZE)
+def archive_messages_command(older_than_days, segment_size):
+    require_mysql('archive-messages')
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    archived = archive.archive_messages(mysql.connection, cutoff, segment_size)
+    print(f"Archived {archived} message(s) older than {cutoff:%Y-%m-%d %H:%M:%S}")
+
+
+@app.cli.command('db-check-indexes')
+def db_check_indexes():
+    require_mysql('db-check-indexes')
+    now = datetime.now()
+    hot_queries = [
+        ('direct history', *message_page_query('user', 2, 1, limit=MESSAGE_PAGE_SIZE + 1)),
+        ('direct history page', *message_page_query('user', 2, 1, (now, 1), limit=MESSAGE_PAGE_SIZE + 1)),
+        ('direct history delta', *message_page_query('user', 2, 1, (now, 1), newer=True, limit=MESSAGE_PAGE_SIZE + 1)),
+        ('group history', *message_page_query('group', 1, 1, limit=MESSAGE_PAGE_SIZE + 1)),
+        ('group history page', *message_page_query('group', 1, 1, (now, 1), limit=MESSAGE_PAGE_SIZE + 1)),
+        ('group history delta', *message_page_query('group', 1, 1, (now, 1), newer=True, limit=MESSAGE_PAGE_SIZE + 1)),
+    ]
+    cur = mysql.connection.cursor()
+    try:
+        problems = migrations.explain_problems(cur, hot_queries)
+    finally:
+        cur.close()
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(1)
+    print(f"All {len(hot_queries)} hot queries use an index for sorting")
+
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,190 @@
+import json
+import zlib
+from datetime import datetime
+
+from migrations import conversation_key
+
+# Холодное хранение старой истории: сообщения старше порога переносятся из messages/group_messages
+# в сжатые сегменты message_archive - по SEGMENT_SIZE сообщений одной беседы в строке.
+# Горячие таблицы остаются небольшими, а история читается из архива, только когда клиент
+# листает дальше горячего окна
+
+SEGMENT_SIZE = 500
+SEGMENT_SCAN_BATCH = 20
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def chat_key(chat_type, chat_id, user_id):
+    # Личная беседа адресуется conversation_key пары, группа - своим id
+    return conversation_key(user_id, chat_id) if chat_type == 'user' else int(chat_id)
+
+
+def sort_key(row):
+    return row['timestamp'], row['id']
+
+
+def encode(rows):
+    # Порядок полей: id, sender_id, sender_name, receiver_id (для группы - NULL), message, timestamp
+    payload = [[row['id'], row['sender_id'], row['sender_name'], row.get('receiver_id'), row['message'],
+                row['timestamp'].strftime(TIMESTAMP_FORMAT)] for row in rows]
+    return zlib.compress(json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8'), 6)
+
+
+def decode(payload, chat_type, chat_id):
+    rows = []
+    for message_id, sender_id, sender_name, receiver_id, message, timestamp in json.loads(zlib.decompress(payload)):
+        row = {
+            'id': message_id,
+            'sender_id': sender_id,
+            'sender_name': sender_name,
+            'message': message,
+            'timestamp': datetime.strptime(timestamp, TIMESTAMP_FORMAT),
+        }
+        if chat_type == 'user':
+            row['receiver_id'] = receiver_id
+        else:
+            row['group_id'] = chat_id
+        rows.append(row)
+    return rows
+
+
+def _archive_segment(conn, cur, chat_type, key, cutoff, segment_size):
+    if chat_type == 'user':
+        cur.execute("""
+            SELECT m.id, m.sender_id, u.username AS sender_name, m.receiver_id, m.message, m.timestamp
+            FROM messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE m.conversation_key = %s AND m.timestamp < %s
+            ORDER BY m.timestamp, m.id
+            LIMIT %s
+            FOR UPDATE
+        """, (key, cutoff, segment_size))
+    else:
+        cur.execute("""
+            SELECT m.id, m.sender_id, u.username AS sender_name, m.message, m.timestamp
+            FROM group_messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE m.group_id = %s AND m.timestamp < %s
+            ORDER BY m.timestamp, m.id
+            LIMIT %s
+            FOR UPDATE
+        """, (key, cutoff, segment_size))
+    rows = list(cur.fetchall())
+    if not rows:
+        return 0
+
+    ids = [row['id'] for row in rows]
+    cur.execute("""
+        INSERT INTO message_archive
+            (chat_type, chat_key, first_at, first_id, last_at, last_id, min_id, max_id, message_count, payload)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (chat_type, key, rows[0]['timestamp'], rows[0]['id'], rows[-1]['timestamp'], rows[-1]['id'],
+          min(ids), max(ids), len(rows), encode(rows)))
+    table = 'messages' if chat_type == 'user' else 'group_messages'
+    cur.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+    conn.commit()
+    return len(rows)
+
+
+def archive_messages(conn, cutoff, segment_size=SEGMENT_SIZE, log=print):
+    # Каждый сегмент - отдельная транзакция: вставка сегмента и удаление его строк из горячей
+    # таблицы фиксируются вместе. Прерванный запуск можно просто повторить
+    cur = conn.cursor()
+    archived = 0
+    try:
+        for chat_type, sql in (
+            ('user', "SELECT conversation_key AS chat_key FROM messages WHERE timestamp < %s GROUP BY conversation_key"),
+            ('group', "SELECT group_id AS chat_key FROM group_messages WHERE timestamp < %s GROUP BY group_id"),
+        ):
+            cur.execute(sql, (cutoff,))
+            keys = [row['chat_key'] for row in cur.fetchall()]
+            conn.commit()
+            for key in keys:
+                while True:
+                    moved = _archive_segment(conn, cur, chat_type, key, cutoff, segment_size)
+                    archived += moved
+                    if moved < segment_size:
+                        break
+            log(f"Archived {chat_type} messages from {len(keys)} conversation(s)")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return archived
+
+
+def locate(cur, chat_type, key, message_id):
+    # Время сообщения из архива - для курсора пагинации, когда его уже нет в горячей таблице
+    cur.execute("""
+        SELECT payload FROM message_archive
+        WHERE chat_type = %s AND chat_key = %s AND min_id <= %s AND max_id >= %s
+    """, (chat_type, key, message_id, message_id))
+    for segment in cur.fetchall():
+        for row in decode(segment['payload'], chat_type, key):
+            if row['id'] == message_id:
+                return row['timestamp']
+    return None
+
+
+def _segments(cur, chat_type, key, cursor, newer):
+    # Метаданные сегментов беседы, в которых есть сообщения за курсором, - начиная с ближайших
+    # к нему, порциями по SEGMENT_SCAN_BATCH. Сегмент подходит по дальнему краю, а упорядочен по ближнему
+    op, order = ('>', 'ASC') if newer else ('<', 'DESC')
+    far, near = ('last', 'first') if newer else ('first', 'last')
+    where = "chat_type = %s AND chat_key = %s"
+    params = [chat_type, key]
+    if cursor is not None:
+        where += f" AND ({far}_at, {far}_id) {op} (%s, %s)"
+        params += [cursor[0], cursor[1]]
+
+    position = None
+    while True:
+        page_where, page_params = where, list(params)
+        if position is not None:
+            page_where += f" AND ({near}_at, {near}_id, id) {op} (%s, %s, %s)"
+            page_params += list(position)
+        cur.execute(f"""
+            SELECT id, first_at, first_id, last_at, last_id FROM message_archive
+            WHERE {page_where}
+            ORDER BY {near}_at {order}, {near}_id {order}, id {order}
+            LIMIT %s
+        """, page_params + [SEGMENT_SCAN_BATCH])
+        batch = list(cur.fetchall())
+        yield from batch
+        if len(batch) < SEGMENT_SCAN_BATCH:
+            return
+        last = batch[-1]
+        position = (last[f'{near}_at'], last[f'{near}_id'], last['id'])
+
+
+def read_page(cur, chat_type, chat_id, user_id, cursor=None, newer=False, limit=100):
+    # Страница архивных сообщений за курсором (timestamp, id) в том же порядке, что и горячий запрос:
+    # от курсора вглубь истории, для newer - от курсора к новым. Сегменты обычно не пересекаются,
+    # но архивный прогон после импорта старых сообщений может дать пересечение, поэтому чтение
+    # останавливается, только когда следующий сегмент целиком дальше собранной страницы
+    key = chat_key(chat_type, chat_id, user_id)
+    near = 'first' if newer else 'last'
+    rows = []
+    for segment in _segments(cur, chat_type, key, cursor, newer):
+        if len(rows) >= limit:
+            edge = (segment[f'{near}_at'], segment[f'{near}_id'])
+            bound = sort_key(rows[limit - 1])
+            if (edge > bound) if newer else (edge < bound):
+                break
+        cur.execute("SELECT payload FROM message_archive WHERE id = %s", (segment['id'],))
+        decoded = decode(cur.fetchone()['payload'], chat_type, chat_id)
+        if cursor is not None:
+            decoded = [row for row in decoded if (sort_key(row) > cursor if newer else sort_key(row) < cursor)]
+        rows.extend(decoded)
+        rows.sort(key=sort_key, reverse=not newer)
+    return rows[:limit]
+
+
+def segments_query(chat_type, chat_id, user_id):
+    # Все сегменты беседы по порядку - для полной выгрузки истории
+    return """
+        SELECT payload FROM message_archive
+        WHERE chat_type = %s AND chat_key = %s
+        ORDER BY first_at, first_id, id
+    """, (chat_type, chat_key(chat_type, chat_id, user_id))
@@ -0,0 +1,113 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Статика с отпечатком содержимого. При старте файлы из static/ хэшируются, и
+# url_for('static', filename='js/chat.js') выдаёт адрес вида /static/js/chat.3f2a1b4c5d6e.js.
+# По такому адресу файл отдаётся с immutable-кэшем на год: браузер не перепроверяет его,
+# а новое содержимое получает новый адрес. Текстовые файлы заранее сжимаются gzip и brotli
+# (если установлен пакет brotli) и отдаются из памяти по Accept-Encoding.
+# Обычные адреса без отпечатка по-прежнему работают, но кэшируются как раньше
+
+DIGEST_LENGTH = 12
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+PRECOMPRESSED_EXTENSIONS = ('.gz', '.br')
+
+
+def fingerprinted_name(filename, digest):
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{digest}{ext}"
+
+
+class StaticAssets:
+
+    def __init__(self, app=None):
+        self.folder = None
+        self.manifest = {}
+        self.assets = {}
+        self.compressed_hits = 0
+        self._send_static = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STATIC_FINGERPRINTS', True)
+        app.config.setdefault('STATIC_COMPRESS_MIN_SIZE', 512)
+        if not app.config['STATIC_FINGERPRINTS'] or not app.static_folder:
+            return
+        self.folder = app.static_folder
+        self.build(int(app.config['STATIC_COMPRESS_MIN_SIZE']))
+        app.url_defaults(self.fingerprint_url)
+        self._send_static = app.view_functions['static']
+        app.view_functions['static'] = self.send_static
+
+    def build(self, compress_min_size=512):
+        manifest, assets = {}, {}
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                if name.startswith('.') or name.endswith(PRECOMPRESSED_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, self.folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()[:DIGEST_LENGTH]
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                variants = {}
+                if len(data) >= compress_min_size and mimetype.startswith(COMPRESSIBLE_TYPES):
+                    variants = self._compress(data)
+                hashed = fingerprinted_name(filename, digest)
+                manifest[filename] = hashed
+                assets[hashed] = {'filename': filename, 'digest': digest, 'mimetype': mimetype,
+                                  'variants': variants}
+        self.manifest, self.assets = manifest, assets
+
+    def _compress(self, data):
+        # Сжатие один раз при старте, поэтому уровни максимальные.
+        # Вариант хранится, только если он заметно меньше исходного файла
+        variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['br'] = brotli.compress(data, quality=11)
+        return {encoding: body for encoding, body in variants.items() if len(body) < len(data) * 0.9}
+
+    def fingerprint_url(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.manifest.get(values['filename'], values['filename'])
+
+    def send_static(self, filename):
+        asset = self.assets.get(filename)
+        if asset is None:
+            return self._send_static(filename=filename)
+
+        accepted = request.accept_encodings
+        encoding = next((name for name in ('br', 'gzip') if name in asset['variants'] and accepted[name]), None)
+        if encoding is None:
+            response = send_from_directory(self.folder, asset['filename'], max_age=IMMUTABLE_MAX_AGE)
+        else:
+            self.compressed_hits += 1
+            response = Response(asset['variants'][encoding], mimetype=asset['mimetype'])
+            response.headers['Content-Encoding'] = encoding
+            response.set_etag(f"{asset['digest']}-{encoding}")
+            response.make_conditional(request)
+        if asset['variants']:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+
+    def stats(self):
+        return {
+            'files': len(self.assets),
+            'compressed': sum(1 for asset in self.assets.values() if asset['variants']),
+            'compressed_hits': self.compressed_hits,
+        }
@@ -0,0 +1,155 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from migrations import conversation_key
+
+
+class WriteBatcher:
+    # Групповая фиксация сообщений: записи из параллельных запросов копятся в очереди
+    # не дольше window секунд (или до max_size штук) и пишутся многострочными INSERT
+    # в одной транзакции - один commit/fsync на всю пачку. Каждый вызывающий получает
+    # id своего сообщения.
+    #
+    # id внутри многострочного INSERT считаются от LAST_INSERT_ID(): для "simple insert"
+    # InnoDB выделяет их подряд при любом innodb_autoinc_lock_mode, но нужен
+    # auto_increment_increment = 1.
+
+    def __init__(self, pool, window=0.005, max_size=100, after_insert=None, timeout=10.0):
+        self.pool = pool
+        self.window = window
+        self.max_size = max_size
+        self.after_insert = after_insert
+        self.timeout = timeout
+        self.batches = 0
+        self.messages = 0
+        self.fallbacks = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_thread(self):
+        # Поток запускается лениво, уже в процессе воркера
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='message-batcher', daemon=True)
+                    self._thread.start()
+
+    def submit(self, chat_type, chat_id, sender_id, message):
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((chat_type, int(chat_id), int(sender_id), message, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Отказ по таймауту безопасен, только пока запись не попала в пачку: тогда она
+            # снимается с очереди и не будет записана. Если пачка уже пишется, ждём её исход,
+            # иначе клиент повторил бы отправку уже сохранённого сообщения
+            if future.cancel():
+                raise
+            return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Записи, отменённые по таймауту submit, не пишутся
+            batch = [entry for entry in batch if entry[4].set_running_or_notify_cancel()]
+            if batch:
+                self._flush(batch)
+
+    def _insert(self, cur, chat_type, items):
+        if chat_type == 'user':
+            sql = "INSERT INTO messages (sender_id, receiver_id, conversation_key, message) VALUES "
+            placeholders = "(%s, %s, %s, %s)"
+            params = [value for chat_id, sender_id, message in items
+                      for value in (sender_id, chat_id, conversation_key(sender_id, chat_id), message)]
+        else:
+            sql = "INSERT INTO group_messages (group_id, sender_id, message) VALUES "
+            placeholders = "(%s, %s, %s)"
+            params = [value for item in items for value in item]
+        cur.execute(sql + ', '.join([placeholders] * len(items)), params)
+        first_id = cur.lastrowid
+        return [first_id + i for i in range(len(items))]
+
+    def _write(self, conn, batch):
+        # Пачка в одной транзакции; возвращает пары (future, id сообщения)
+        results = []
+        cur = conn.cursor()
+        try:
+            for chat_type in ('user', 'group'):
+                entries = [entry for entry in batch if entry[0] == chat_type]
+                if not entries:
+                    continue
+                ids = self._insert(cur, chat_type, [entry[1:4] for entry in entries])
+                for entry, message_id in zip(entries, ids):
+                    if self.after_insert:
+                        self.after_insert(cur, *entry[:4], message_id)
+                    results.append((entry[4], message_id))
+        finally:
+            cur.close()
+        conn.commit()
+        return results
+
+    def _flush(self, batch):
+        try:
+            conn = self.pool.acquire()
+        except Exception as e:
+            for *_, future in batch:
+                future.set_exception(e)
+            return
+
+        discard = False
+        results = []
+        try:
+            try:
+                results = self._write(conn, batch)
+            except Exception as e:
+                conn.rollback()
+                if len(batch) == 1:
+                    batch[0][4].set_exception(e)
+                    return
+                # Ошибка одной строки (ограничение, неверные данные) не должна откатывать
+                # соседей: пачка повторяется по одной записи, ошибку получает только виновник
+                self.fallbacks += 1
+                results = []
+                for entry in batch:
+                    try:
+                        results.extend(self._write(conn, [entry]))
+                    except Exception as e:
+                        conn.rollback()
+                        entry[4].set_exception(e)
+        except Exception as e:
+            # Откат не прошёл - соединение сломано; кто ещё ждёт, получает ошибку
+            discard = True
+            for future, message_id in results:
+                future.set_result(message_id)
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.pool.release(conn, discard=discard)
+
+        self.batches += 1
+        self.messages += len(results)
+        for future, message_id in results:
+            future.set_result(message_id)
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'batches': self.batches,
+            'messages': self.messages,
+            'fallbacks': self.fallbacks,
+        }
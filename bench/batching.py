@@ -0,0 +1,60 @@
+# Бенчмарк групповой фиксации: сколько сообщений в секунду записывается
+# с MESSAGE_WRITE_BATCHING и без него при одинаковом числе параллельных отправителей.
+#
+#   python -m bench.batching --threads 32 --messages 200 --window-ms 5
+#
+# Нужны пользователи из bench.datagen.
+
+import argparse
+import random
+import threading
+import time
+
+from bench.runner import load_fixture
+
+
+def messages_per_second(chat, users, threads, per_thread, batcher):
+    chat.message_batcher = batcher
+
+    def sender(index):
+        rnd = random.Random(index)
+        with chat.app.app_context():
+            for i in range(per_thread):
+                sender_id, receiver_id = rnd.sample(users, 2)
+                chat.save_message('user', receiver_id['id'], sender_id['id'], f'batch bench {index}:{i}')
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=sender, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return threads * per_thread / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Message write throughput with and without batching')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--messages', type=int, default=200, help='messages per thread')
+    parser.add_argument('--window-ms', type=float, default=5)
+    parser.add_argument('--max-size', type=int, default=100)
+    args = parser.parse_args()
+
+    import app as chat
+
+    users, _ = load_fixture(chat.app, chat.mysql, 1000)
+    if len(users) < 2:
+        raise SystemExit('No benchmark users found, run python -m bench.datagen first')
+
+    rate = messages_per_second(chat, users, args.threads, args.messages, None)
+    print(f"without batching: {rate:8.1f} messages/s")
+
+    batcher = chat.make_message_batcher(args.window_ms / 1000, args.max_size)
+    rate = messages_per_second(chat, users, args.threads, args.messages, batcher)
+    stats = batcher.stats()
+    print(f"with batching:    {rate:8.1f} messages/s "
+          f"({stats['messages'] / max(stats['batches'], 1):.1f} messages per commit)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+# Генератор синтетических данных для бенчмарков: N пользователей, M групп, K сообщений
+# со степенным (Zipf) распределением активности - несколько "горячих" пользователей,
+# пар и групп получают большую часть трафика.
+#
+#   python -m bench.datagen --reset --users 2000 --groups 100 --messages 200000
+#
+# Хранилище выбирается теми же переменными окружения, что и у приложения: DATABASE_BACKEND
+# и MYSQL_* или SQLITE_PATH.
+
+import argparse
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+
+import migrations
+from hashing import _hash
+from storage import SQLITE_NOW, SQLiteStore
+
+BENCH_PASSWORD = 'bench-password'
+USERNAME_PREFIX = 'bench_'
+BATCH_SIZE = 1000
+
+WORDS = ('привет как дела что нового да нет может завтра сегодня встреча код релиз '
+         'тест баг ок спасибо посмотрю созвон отчёт база запрос индекс').split()
+
+TABLES = ('notifications', 'group_invitations', 'friend_requests', 'conversation_summaries',
+          'message_archive', 'fanout_events', 'user_presence',
+          'group_messages', 'group_members', 'chat_groups', 'messages', 'users')
+
+
+# Аналог migrations.backfill_conversation_summaries для встроенной SQLite
+SQLITE_SUMMARIES_BACKFILL = (
+    f"""
+    INSERT OR IGNORE INTO conversation_summaries
+        (user_id, chat_type, chat_id, last_message_id, last_message_preview, last_message_at)
+    SELECT t.user_id, 'user', t.peer_id, m.id, substr(m.message, 1, {migrations.PREVIEW_LENGTH}), m.timestamp
+    FROM (
+        SELECT user_id, peer_id, MAX(id) AS last_id FROM (
+            SELECT sender_id AS user_id, receiver_id AS peer_id, id FROM messages
+            UNION ALL
+            SELECT receiver_id, sender_id, id FROM messages
+        )
+        GROUP BY user_id, peer_id
+    ) t
+    JOIN messages m ON m.id = t.last_id
+    """,
+    f"""
+    INSERT OR IGNORE INTO conversation_summaries
+        (user_id, chat_type, chat_id, last_message_id, last_message_preview, last_message_at)
+    SELECT gm.user_id, 'group', gm.group_id, m.id, substr(m.message, 1, {migrations.PREVIEW_LENGTH}),
+           COALESCE(m.timestamp, {SQLITE_NOW})
+    FROM group_members gm
+    LEFT JOIN (
+        SELECT group_id, MAX(id) AS last_id FROM group_messages GROUP BY group_id
+    ) t ON t.group_id = gm.group_id
+    LEFT JOIN group_messages m ON m.id = t.last_id
+    """,
+)
+
+
+def zipf_weights(n, skew):
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, n + 1)))
+
+
+def insert_batches(conn, cur, sql, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        cur.executemany(sql, rows[start:start + BATCH_SIZE])
+        conn.commit()
+
+
+def prepare(store):
+    # Схема: миграции на MySQL, на SQLite - create_schema
+    if isinstance(store, SQLiteStore):
+        store.create_schema()
+    else:
+        migrations.upgrade(store.raw_connection())
+
+
+def reset(store):
+    conn = store.raw_connection()
+    cur = conn.cursor()
+    if isinstance(store, SQLiteStore):
+        # В SQLite нет TRUNCATE, а архива и журнала рассылки нет совсем; таблицы перечислены
+        # от зависимых к главным, поэтому внешние ключи не мешают
+        cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        existing = {row['name'] for row in cur.fetchall()}
+        for table in TABLES:
+            if table in existing:
+                cur.execute(f"DELETE FROM {table}")
+    else:
+        cur.execute("SET FOREIGN_KEY_CHECKS = 0")
+        for table in TABLES:
+            cur.execute(f"TRUNCATE TABLE {table}")
+        cur.execute("SET FOREIGN_KEY_CHECKS = 1")
+    conn.commit()
+    cur.close()
+
+
+def generate(store, users, groups, messages, skew=1.1, group_share=0.3, days=30,
+             seed=42, password_method='pbkdf2:sha256:1000', log=print):
+    rnd = random.Random(seed)
+    conn = store.raw_connection()
+    cur = conn.cursor()
+    started = time.monotonic()
+
+    # Пароль у всех одинаковый и дешёвый: бенчмарк меряет чат, а не хэширование
+    pwhash = _hash(BENCH_PASSWORD, password_method)
+    cur.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM users")
+    offset = cur.fetchone()['max_id']
+    insert_batches(conn, cur, "INSERT INTO users (username, email, password) VALUES (%s, %s, %s)", [
+        (f"{USERNAME_PREFIX}{offset + i:07d}", f"{USERNAME_PREFIX}{offset + i}@example.com", pwhash)
+        for i in range(users)
+    ])
+    cur.execute("SELECT id FROM users WHERE id > %s ORDER BY id", (offset,))
+    user_ids = [row['id'] for row in cur.fetchall()]
+    user_weights = zipf_weights(len(user_ids), skew)
+    log(f"users: {len(user_ids)}")
+
+    # Группы: размер тоже распределён неравномерно - много маленьких и несколько больших
+    group_rows = []
+    for i in range(groups):
+        creator = rnd.choices(user_ids, cum_weights=user_weights)[0]
+        group_rows.append((f"Bench group {i}", 'Synthetic benchmark group', creator))
+    cur.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM chat_groups")
+    group_offset = cur.fetchone()['max_id']
+    insert_batches(conn, cur,
+                   "INSERT INTO chat_groups (name, description, created_by) VALUES (%s, %s, %s)",
+                   group_rows)
+    cur.execute("SELECT id, created_by FROM chat_groups WHERE id > %s ORDER BY id", (group_offset,))
+    group_members = {}
+    member_rows = []
+    for group in cur.fetchall():
+        size = min(len(user_ids), int(3 + rnd.paretovariate(1.2) * 3))
+        members = set(rnd.sample(user_ids, size - 1)) | {group['created_by']}
+        group_members[group['id']] = sorted(members)
+        member_rows.extend((group['id'], user_id) for user_id in members)
+    insert_batches(conn, cur, "INSERT INTO group_members (group_id, user_id) VALUES (%s, %s)",
+                   member_rows)
+    # Участников пишем напрямую, минуя _add_group_member, поэтому счётчик считаем сами
+    migrations.backfill_group_member_counts(cur, group_offset)
+    conn.commit()
+    group_ids = list(group_members)
+    group_weights = zipf_weights(len(group_ids), skew) if group_ids else []
+    log(f"groups: {len(group_ids)}, memberships: {len(member_rows)}")
+
+    # Сообщения в порядке времени, чтобы id росли вместе с timestamp
+    direct_rows, group_rows = [], []
+    first_at = datetime.now() - timedelta(days=days)
+    step = timedelta(days=days) / max(messages, 1)
+    for i in range(messages):
+        sent_at = first_at + step * i
+        text = ' '.join(rnd.choices(WORDS, k=rnd.randint(2, 20)))
+        if group_ids and rnd.random() < group_share:
+            group_id = rnd.choices(group_ids, cum_weights=group_weights)[0]
+            sender = rnd.choice(group_members[group_id])
+            group_rows.append((group_id, sender, text, sent_at))
+        else:
+            sender, receiver = rnd.choices(user_ids, cum_weights=user_weights, k=2)
+            if sender == receiver:
+                receiver = rnd.choice(user_ids)
+            direct_rows.append((sender, receiver, migrations.conversation_key(sender, receiver),
+                                text, sent_at))
+    insert_batches(conn, cur, """
+        INSERT INTO messages (sender_id, receiver_id, conversation_key, message, timestamp)
+        VALUES (%s, %s, %s, %s, %s)
+    """, direct_rows)
+    insert_batches(conn, cur, """
+        INSERT INTO group_messages (group_id, sender_id, message, timestamp)
+        VALUES (%s, %s, %s, %s)
+    """, group_rows)
+    log(f"messages: {len(direct_rows)} direct, {len(group_rows)} group")
+
+    if isinstance(store, SQLiteStore):
+        for sql in SQLITE_SUMMARIES_BACKFILL:
+            cur.execute(sql)
+    else:
+        migrations.backfill_conversation_summaries(cur)
+    conn.commit()
+    cur.close()
+    log(f"done in {time.monotonic() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic chat data')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of user/group activity')
+    parser.add_argument('--group-share', type=float, default=0.3, help='fraction of group messages')
+    parser.add_argument('--days', type=int, default=30, help='history length')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='truncate all chat tables first')
+    args = parser.parse_args()
+
+    from app import app, store
+
+    with app.app_context():
+        prepare(store)
+        if args.reset:
+            reset(store)
+        generate(store, args.users, args.groups, args.messages, skew=args.skew,
+                 group_share=args.group_share, days=args.days, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# Бенчмарк хэширования паролей: сколько проверок пароля (логинов) в секунду
+# даёт пул процессов и сколько приходится на одно ядро.
+#
+#   python -m bench.hashing --method scrypt:32768:8:1 --logins 200
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hashing import PasswordHasher, _hash
+
+PASSWORD = 'benchmark-password'
+
+
+def logins_per_second(method, workers, logins):
+    hasher = PasswordHasher(workers=workers, max_pending=logins, method=method)
+    pwhash = _hash(PASSWORD, method)
+    with ThreadPoolExecutor(max_workers=workers * 2) as clients:
+        # Прогрев: поднимаем все процессы пула до замера
+        list(clients.map(lambda _: hasher.check(pwhash, PASSWORD), range(workers)))
+
+        started = time.perf_counter()
+        results = list(clients.map(lambda _: hasher.check(pwhash, PASSWORD), range(logins)))
+        elapsed = time.perf_counter() - started
+    hasher.shutdown()
+    assert all(results)
+    return logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Password hashing throughput')
+    parser.add_argument('--method', default=os.getenv('PASSWORD_HASH_METHOD'),
+                        help='werkzeug hash method, e.g. scrypt:32768:8:1 or pbkdf2:sha256:600000')
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--workers', type=int, nargs='*',
+                        help='pool sizes to measure (default: 1 and the number of CPUs)')
+    args = parser.parse_args()
+
+    workers_list = args.workers or sorted({1, os.cpu_count() or 1})
+    print(f"method: {args.method or 'werkzeug default'}")
+    for workers in workers_list:
+        rate = logins_per_second(args.method, workers, args.logins)
+        print(f"workers={workers:<3} {rate:8.1f} logins/s  {rate / workers:8.1f} logins/s per core")
+
+
+if __name__ == '__main__':
+    main()
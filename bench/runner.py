@@ -0,0 +1,209 @@
+# Нагрузочный прогон горячих маршрутов через Flask test client.
+# Каждый поток - отдельный пользователь из данных bench.datagen со своей сессией.
+#
+#   python -m bench.runner --threads 8 --duration 30 --json bench_output.json
+#
+# Отчёт: пропускная способность и p50/p95/p99 по маршрутам, среднее число SQL-запросов на запрос.
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+from flask import g
+
+from bench.datagen import BENCH_PASSWORD, USERNAME_PREFIX
+
+# Вес действия в смеси нагрузки
+WORKLOAD = {
+    'contacts': 5,
+    'conversations': 5,
+    'get_chat_messages': 40,
+    'send_message': 20,
+    'search_users': 15,
+    'group_chat': 15,
+}
+
+
+class Recorder:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def add(self, route, elapsed, queries, status):
+        with self._lock:
+            self.samples[route].append((elapsed, queries, status))
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def load_fixture(app, store, limit_users):
+    # Пользователи из генератора, их группы и собеседники. SUBSTR вместо LIKE: правила
+    # экранирования "_" в LIKE у MySQL и SQLite разные
+    prefix = (len(USERNAME_PREFIX), USERNAME_PREFIX)
+    with app.app_context():
+        conn = store.raw_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT id, username FROM users WHERE SUBSTR(username, 1, %s) = %s ORDER BY id LIMIT %s",
+                    prefix + (limit_users,))
+        users = list(cur.fetchall())
+        cur.execute("""
+            SELECT cs.user_id, cs.chat_type, cs.chat_id FROM conversation_summaries cs
+            JOIN users u ON u.id = cs.user_id
+            WHERE SUBSTR(u.username, 1, %s) = %s
+        """, prefix)
+        chats = defaultdict(lambda: {'user': [], 'group': []})
+        for row in cur.fetchall():
+            chats[row['user_id']][row['chat_type']].append(row['chat_id'])
+        cur.close()
+        # Закрываем читающую транзакцию: на SQLite она держала бы снимок и не давала сбросить WAL
+        conn.commit()
+    return users, chats
+
+
+class VirtualUser:
+
+    def __init__(self, app, user, chats, all_users, recorder, queries, rnd):
+        self.client = app.test_client()
+        self.user = user
+        self.direct = chats['user'] or [u['id'] for u in rnd.sample(all_users, min(5, len(all_users)))]
+        self.groups = chats['group']
+        self.all_users = all_users
+        self.recorder = recorder
+        self.queries = queries
+        self.rnd = rnd
+
+    def timed(self, route, call):
+        self.queries.count = 0
+        started = time.perf_counter()
+        response = call()
+        elapsed = time.perf_counter() - started
+        self.recorder.add(route, elapsed, self.queries.count, response.status_code)
+        return response
+
+    def login(self):
+        return self.timed('login', lambda: self.client.post('/login', data={
+            'username': self.user['username'],
+            'password': BENCH_PASSWORD,
+        }))
+
+    def chat(self):
+        if self.groups and self.rnd.random() < 0.3:
+            return 'group', self.rnd.choice(self.groups)
+        return 'user', self.rnd.choice(self.direct)
+
+    def step(self):
+        actions = list(WORKLOAD)
+        action = self.rnd.choices(actions, weights=[WORKLOAD[a] for a in actions])[0]
+        if action == 'group_chat' and not self.groups:
+            action = 'get_chat_messages'
+
+        if action == 'contacts':
+            self.timed(action, lambda: self.client.get('/contacts'))
+        elif action == 'conversations':
+            self.timed(action, lambda: self.client.get('/api/conversations'))
+        elif action == 'get_chat_messages':
+            chat_type, chat_id = self.chat()
+            self.timed(action, lambda: self.client.get(f'/get_chat_messages/{chat_type}/{chat_id}'))
+        elif action == 'send_message':
+            chat_type, chat_id = self.chat()
+            self.timed(action, lambda: self.client.post('/send_message', json={
+                'chat_type': chat_type,
+                'chat_id': chat_id,
+                'message': f'bench {self.rnd.random():.6f}',
+            }))
+        elif action == 'search_users':
+            name = self.rnd.choice(self.all_users)['username']
+            start = self.rnd.randint(0, len(name) - 3)
+            query = name[start:start + self.rnd.randint(3, 5)]
+            self.timed(action, lambda: self.client.get('/search_users', query_string={'q': query}))
+        elif action == 'group_chat':
+            group_id = self.rnd.choice(self.groups)
+            self.timed(action, lambda: self.client.get(f'/group_chat/{group_id}'))
+
+
+def run(threads, duration, seed, limit_users=10000):
+    from app import app, store
+
+    queries = threading.local()
+
+    @app.after_request
+    def record_queries(response):
+        queries.count = g.get('db_queries', 0)
+        return response
+
+    users, chats = load_fixture(app, store, limit_users)
+    if not users:
+        raise SystemExit('No benchmark users found, run python -m bench.datagen first')
+
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        rnd = random.Random(seed + index)
+        user = rnd.choice(users)
+        vu = VirtualUser(app, user, chats[user['id']], users, recorder, queries, rnd)
+        vu.login()
+        while time.monotonic() < deadline:
+            vu.step()
+
+    started = time.monotonic()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return recorder, time.monotonic() - started
+
+
+def summarize(recorder, elapsed):
+    report = {}
+    for route, samples in sorted(recorder.samples.items()):
+        latencies = sorted(s[0] * 1000 for s in samples)
+        report[route] = {
+            'requests': len(samples),
+            'errors': sum(1 for s in samples if s[2] >= 500),
+            'rps': len(samples) / elapsed,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'queries_per_request': sum(s[1] for s in samples) / len(samples),
+        }
+    return report
+
+
+def print_report(report, elapsed):
+    total = sum(r['requests'] for r in report.values())
+    print(f"{total} requests in {elapsed:.1f}s, {total / elapsed:.1f} req/s")
+    print(f"{'route':<20}{'reqs':>8}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'q/req':>7}")
+    for route, r in report.items():
+        print(f"{route:<20}{r['requests']:>8}{r['errors']:>8}{r['rps']:>9.1f}"
+              f"{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['queries_per_request']:>7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the chat hot paths')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args()
+
+    recorder, elapsed = run(args.threads, args.duration, args.seed)
+    report = summarize(recorder, elapsed)
+    print_report(report, elapsed)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'elapsed': elapsed, 'threads': args.threads, 'routes': report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
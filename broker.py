@@ -0,0 +1,242 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter
+
+from responses import dumps
+
+logger = logging.getLogger('broker')
+
+
+class MemoryBroker:
+    # Рассылка событий подписчикам хаба в пределах одного процесса. Присутствие -
+    # пользователи с открытым потоком в этом процессе
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.published = 0
+        self.delivered = 0
+        self._lock = threading.Lock()
+        self._connected = Counter()
+        self._listeners = []
+
+    def listen(self, channel, callback):
+        # Служебные события процесса (например, сброс кэшей): callback(event) вызывается
+        # в каждом процессе, даже если в нём нет открытых потоков
+        self._listeners.append((channel, callback))
+
+    def start(self):
+        pass
+
+    def _dispatch(self, channel, event):
+        for listened, callback in self._listeners:
+            if listened == channel:
+                try:
+                    callback(event)
+                except Exception:
+                    logger.exception("broker listener failed for %s", channel)
+        return self.hub.publish(channel, event)
+
+    def publish(self, channel, event):
+        self.published += 1
+        self.delivered += 1
+        return self._dispatch(channel, event)
+
+    def connect(self, user_id):
+        with self._lock:
+            self._connected[int(user_id)] += 1
+
+    def disconnect(self, user_id):
+        with self._lock:
+            self._connected[int(user_id)] -= 1
+            if self._connected[int(user_id)] <= 0:
+                del self._connected[int(user_id)]
+
+    def local_users(self):
+        with self._lock:
+            return list(self._connected)
+
+    def online(self, user_ids):
+        with self._lock:
+            return [user_id for user_id in user_ids if self._connected.get(int(user_id))]
+
+    def stats(self):
+        return {
+            'published': self.published,
+            'delivered': self.delivered,
+            'local_users': len(self.local_users()),
+        }
+
+
+class MySQLBroker(MemoryBroker):
+    # Рассылка между воркерами и узлами без внешних сервисов: событие пишется в fanout_events,
+    # а фоновый поток каждого процесса читает таблицу по возрастанию id и раздаёт события своим
+    # подписчикам. Все процессы видят события в одном порядке - порядке id, поэтому внутри
+    # беседы доставка упорядочена, в том числе для сообщений самого процесса.
+    #
+    # id выдаются при INSERT, а видны после commit, поэтому меньший id может появиться позже
+    # большего. На пропуске поток ждёт до gap_timeout секунд, затем считает строку откаченной.
+    # Нужен auto_increment_increment = 1.
+    #
+    # Присутствие: раз в presence_interval поток отмечает в user_presence пользователей
+    # с открытым потоком в этом процессе; онлайн - отмеченные не раньше presence_ttl секунд назад.
+
+    def __init__(self, hub, pool, poll_interval=0.1, batch_size=500, gap_timeout=2.0,
+                 retention=60, presence_interval=10, presence_ttl=30):
+        super().__init__(hub)
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.gap_timeout = gap_timeout
+        self.retention = retention
+        self.presence_interval = presence_interval
+        self.presence_ttl = presence_ttl
+        self.gaps_skipped = 0
+        self._last_id = None
+        self._gap_since = None
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def start(self):
+        # Вызывается перед запросами: процессу со слушателями нужен поток опроса,
+        # даже если он сам ничего не публикует
+        if self._listeners:
+            self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Поток запускается лениво, уже в процессе воркера
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='fanout-broker', daemon=True)
+                    self._thread.start()
+
+    def _execute(self, sql, params=(), fetch=False):
+        conn = self.pool.acquire()
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute(sql, params)
+                rows = cur.fetchall() if fetch else cur.lastrowid
+            finally:
+                cur.close()
+            conn.commit()
+            return rows
+        finally:
+            self.pool.release(conn)
+
+    def publish(self, channel, event):
+        self._ensure_thread()
+        event_id = self._execute("INSERT INTO fanout_events (channel, payload) VALUES (%s, %s)",
+                                 (channel, dumps(event)))
+        self.published += 1
+        return event_id
+
+    def connect(self, user_id):
+        super().connect(user_id)
+        self._ensure_thread()
+
+    def online(self, user_ids):
+        user_ids = [int(user_id) for user_id in user_ids]
+        if not user_ids:
+            return []
+        rows = self._execute(f"""
+            SELECT user_id FROM user_presence
+            WHERE user_id IN ({', '.join(['%s'] * len(user_ids))})
+              AND last_seen > NOW() - INTERVAL %s SECOND
+        """, (*user_ids, self.presence_ttl), fetch=True)
+        return sorted({row['user_id'] for row in rows} | set(super().online(user_ids)))
+
+    def _run(self):
+        conn = None
+        next_presence = next_cleanup = 0.0
+        while True:
+            try:
+                if conn is None:
+                    conn = self.pool.acquire()
+                now = time.monotonic()
+                if now >= next_presence:
+                    self._touch_presence(conn)
+                    next_presence = now + self.presence_interval
+                if now >= next_cleanup:
+                    self._cleanup(conn)
+                    next_cleanup = now + self.retention
+                delivered = self._poll(conn)
+            except Exception:
+                logger.exception("fanout poll failed")
+                if conn is not None:
+                    self.pool.release(conn, discard=True)
+                    conn = None
+                delivered = 0
+            if delivered < self.batch_size:
+                time.sleep(self.poll_interval)
+
+    def _poll(self, conn):
+        # Когда в процессе нет подписчиков и слушателей, таблицу не читаем; после паузы начинаем с конца
+        if not self.hub.subscriber_count() and not self._listeners:
+            self._last_id = None
+            return 0
+
+        cur = conn.cursor()
+        try:
+            if self._last_id is None:
+                cur.execute("SELECT COALESCE(MAX(id), 0) AS id FROM fanout_events")
+                self._last_id = cur.fetchone()['id']
+            cur.execute("""
+                SELECT id, channel, payload FROM fanout_events
+                WHERE id > %s ORDER BY id LIMIT %s
+            """, (self._last_id, self.batch_size))
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+        # Конец транзакции: иначе следующий SELECT читал бы тот же снимок и не видел новых строк
+        conn.commit()
+
+        delivered = 0
+        for row in rows:
+            if row['id'] != self._last_id + 1:
+                now = time.monotonic()
+                if self._gap_since is None:
+                    self._gap_since = now
+                if now - self._gap_since < self.gap_timeout:
+                    break
+                self.gaps_skipped += 1
+            self._gap_since = None
+            self._last_id = row['id']
+            self._dispatch(row['channel'], json.loads(row['payload']))
+            delivered += 1
+        self.delivered += delivered
+        return delivered
+
+    def _touch_presence(self, conn):
+        users = self.local_users()
+        if not users:
+            return
+        cur = conn.cursor()
+        try:
+            cur.execute(f"""
+                INSERT INTO user_presence (user_id, last_seen)
+                VALUES {', '.join(['(%s, NOW())'] * len(users))}
+                ON DUPLICATE KEY UPDATE last_seen = VALUES(last_seen)
+            """, users)
+        finally:
+            cur.close()
+        conn.commit()
+
+    def _cleanup(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                DELETE FROM fanout_events
+                WHERE created_at < NOW() - INTERVAL %s SECOND
+                LIMIT 10000
+            """, (self.retention,))
+        finally:
+            cur.close()
+        conn.commit()
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({'last_id': self._last_id, 'gaps_skipped': self.gaps_skipped})
+        return stats
@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    # Ограниченный LRU-кэш с временем жизни записей и счётчиками попаданий
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def update(self, key, func):
+        # Меняет значение на месте, только если оно уже есть в кэше и не устарело
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._data[key] = (func(entry[0]), entry[1])
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class MembershipCache:
+    # Множества участников групп; loader(group_id) возвращает id всех участников
+
+    def __init__(self, loader, maxsize=1024, ttl=60):
+        self.loader = loader
+        self._groups = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _load(self, group_id):
+        members = frozenset(int(user_id) for user_id in self.loader(group_id))
+        self._groups.set(group_id, members)
+        return members
+
+    def members(self, group_id):
+        group_id = int(group_id)
+        members = self._groups.get(group_id)
+        if members is None:
+            members = self._load(group_id)
+        return members
+
+    def is_member(self, group_id, user_id):
+        # Отказ не берётся из кэша: пользователь мог вступить через другой воркер, а здесь
+        # ещё старое множество. Поэтому перед отказом участники перечитываются из базы
+        group_id, user_id = int(group_id), int(user_id)
+        members = self._groups.get(group_id)
+        if members is not None and user_id in members:
+            return True
+        return user_id in self._load(group_id)
+
+    def add(self, group_id, user_id):
+        # Вызывать после коммита, иначе откат транзакции оставит в кэше лишнего участника
+        self._groups.update(int(group_id), lambda members: members | {int(user_id)})
+
+    def invalidate(self, group_id):
+        self._groups.invalidate(int(group_id))
+
+    def stats(self):
+        return self._groups.stats()
@@ -0,0 +1,397 @@
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import MySQLdb
+import MySQLdb.cursors
+from MySQLdb.constants import CLIENT
+from flask import g, has_app_context, has_request_context, session
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class InstrumentedCursorMixin:
+    # Считает запросы к серверу и их суммарное время в рамках контекста приложения
+    # (g.db_queries, g.db_time), отмечает запись (g.db_wrote) и сообщает о каждом
+    # запросе слушателям из query_listeners
+    query_listeners = ()
+
+    def _query(self, q):
+        started = time.perf_counter()
+        try:
+            return super()._query(q)
+        finally:
+            elapsed = time.perf_counter() - started
+            statement = q.decode('utf-8', 'replace') if isinstance(q, bytes) else q
+            if has_app_context():
+                g.db_queries = g.get('db_queries', 0) + 1
+                g.db_time = g.get('db_time', 0.0) + elapsed
+                if statement.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+                    g.db_wrote = True
+            for listener in self.query_listeners:
+                listener(statement, elapsed)
+
+
+class ConnectionPool:
+    # Потокобезопасный пул соединений MySQL с проверкой живости и пересозданием старых соединений
+
+    def __init__(self, connect_kwargs, min_size=1, max_size=10, timeout=5.0,
+                 recycle=3600, pre_ping=True):
+        self.connect_kwargs = connect_kwargs
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._created = {}
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._filled = False
+
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+
+    def _connect(self):
+        conn = MySQLdb.connect(**self.connect_kwargs)
+        self._created[id(conn)] = time.monotonic()
+        return conn
+
+    def _close(self, conn):
+        self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except MySQLdb.Error:
+            pass
+
+    def _fill(self):
+        # Минимальное число соединений открываем при первом обращении, а не при импорте
+        with self._cond:
+            if self._filled:
+                return
+            self._filled = True
+            missing = self.min_size - self._size
+            self._size += max(missing, 0)
+        for _ in range(max(missing, 0)):
+            try:
+                conn = self._connect()
+            except MySQLdb.Error:
+                with self._cond:
+                    self._size -= 1
+                continue
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def acquire(self):
+        if not self._filled:
+            self._fill()
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"No free database connection within {self.timeout}s")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_use += 1
+            waited = time.monotonic() - started
+            if waited > 0.001:
+                self.waits += 1
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+
+        try:
+            return self._checkout(conn)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _checkout(self, conn):
+        if conn is None:
+            return self._connect()
+        if time.monotonic() - self._created.get(id(conn), 0) > self.recycle:
+            self._close(conn)
+            return self._connect()
+        if self.pre_ping:
+            try:
+                conn.ping()
+            except MySQLdb.Error:
+                self._close(conn)
+                return self._connect()
+        return conn
+
+    def release(self, conn, discard=False):
+        if not discard:
+            # Незавершённая транзакция не должна достаться следующему запросу
+            try:
+                conn.rollback()
+            except MySQLdb.Error:
+                discard = True
+        if discard:
+            self._close(conn)
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'waits': self.waits,
+                'wait_time_total': round(self.wait_time_total, 6),
+                'wait_time_max': round(self.wait_time_max, 6),
+                'timeouts': self.timeouts,
+            }
+
+
+def parse_hosts(value, default_port):
+    hosts = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(':')
+        hosts.append((host, int(port or default_port)))
+    return hosts
+
+
+class PooledMySQL:
+    # Замена flask_mysqldb.MySQL: mysql.connection выдаёт соединение из пула
+    # на время контекста приложения и возвращает его в пул при teardown.
+    #
+    # mysql.read_connection - соединение с репликой (MYSQL_REPLICA_HOSTS) для маршрутов,
+    # которые только читают. После записи запросы пользователя ещё
+    # MYSQL_READ_YOUR_WRITES_WINDOW секунд идут на primary, чтобы он видел свои изменения.
+
+    def __init__(self, app=None):
+        self.pool = None
+        self.replica_pools = []
+        self.read_your_writes_window = 5
+        self._next_replica = itertools.count()
+        self.query_listeners = []
+        self.streaming_cursorclass = None
+        self.multi_statements = False
+        self.batch_pool = None
+        self.replica_batch_pools = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        config.setdefault('MYSQL_PORT', 3306)
+        config.setdefault('MYSQL_CHARSET', 'utf8mb4')
+        config.setdefault('MYSQL_POOL_MIN_SIZE', 1)
+        config.setdefault('MYSQL_POOL_MAX_SIZE', 10)
+        config.setdefault('MYSQL_POOL_TIMEOUT', 5.0)
+        config.setdefault('MYSQL_POOL_RECYCLE', 3600)
+        config.setdefault('MYSQL_POOL_PRE_PING', True)
+        config.setdefault('MYSQL_REPLICA_HOSTS', '')
+        config.setdefault('MYSQL_READ_YOUR_WRITES_WINDOW', 5)
+        config.setdefault('MYSQL_MULTI_STATEMENTS', False)
+
+        connect_kwargs = {
+            'host': config['MYSQL_HOST'],
+            'user': config['MYSQL_USER'],
+            'passwd': config['MYSQL_PASSWORD'],
+            'db': config['MYSQL_DB'],
+            'port': int(config['MYSQL_PORT']),
+            'charset': config['MYSQL_CHARSET'],
+        }
+        self.multi_statements = bool(config['MYSQL_MULTI_STATEMENTS'])
+        cursorclass = getattr(MySQLdb.cursors, config.get('MYSQL_CURSORCLASS') or 'Cursor')
+        connect_kwargs['cursorclass'] = type('Instrumented' + cursorclass.__name__,
+                                             (InstrumentedCursorMixin, cursorclass),
+                                             {'query_listeners': self.query_listeners})
+        self.streaming_cursorclass = type('InstrumentedSSDictCursor',
+                                          (InstrumentedCursorMixin, MySQLdb.cursors.SSDictCursor),
+                                          {'query_listeners': self.query_listeners})
+
+        pool_options = {
+            'min_size': int(config['MYSQL_POOL_MIN_SIZE']),
+            'max_size': int(config['MYSQL_POOL_MAX_SIZE']),
+            'timeout': float(config['MYSQL_POOL_TIMEOUT']),
+            'recycle': int(config['MYSQL_POOL_RECYCLE']),
+            'pre_ping': bool(config['MYSQL_POOL_PRE_PING']),
+        }
+        self.pool = ConnectionPool(connect_kwargs, **pool_options)
+        replica_hosts = parse_hosts(config['MYSQL_REPLICA_HOSTS'], connect_kwargs['port'])
+        self.replica_pools = [
+            ConnectionPool(dict(connect_kwargs, host=host, port=port), **pool_options)
+            for host, port in replica_hosts
+        ]
+        if self.multi_statements:
+            # С флагом MULTI_STATEMENTS любая SQL-инъекция стала бы выполнением произвольных
+            # запросов, поэтому он есть только у соединений отдельных пулов для execute_batch
+            batch_kwargs = dict(connect_kwargs, client_flag=CLIENT.MULTI_STATEMENTS)
+            batch_options = dict(pool_options, min_size=0)
+            self.batch_pool = ConnectionPool(batch_kwargs, **batch_options)
+            self.replica_batch_pools = [
+                ConnectionPool(dict(batch_kwargs, host=host, port=port), **batch_options)
+                for host, port in replica_hosts
+            ]
+        self.read_your_writes_window = float(config['MYSQL_READ_YOUR_WRITES_WINDOW'])
+        app.after_request(self.remember_write)
+        app.teardown_appcontext(self.teardown)
+
+    def pools(self):
+        named = {'primary': self.pool}
+        named.update((f'replica{i}', pool) for i, pool in enumerate(self.replica_pools))
+        if self.batch_pool is not None:
+            named['primary_batch'] = self.batch_pool
+            named.update((f'replica{i}_batch', pool) for i, pool in enumerate(self.replica_batch_pools))
+        return named
+
+    @property
+    def connection(self):
+        if 'mysql_connection' not in g:
+            g.mysql_connection = self.pool.acquire()
+        return g.mysql_connection
+
+    def reads_from_primary(self):
+        if g.get('db_wrote'):
+            return True
+        return has_request_context() and session.get('_primary_until', 0) > time.time()
+
+    def _acquire_replica(self, pools=None):
+        # Реплики по кругу; недоступная реплика не должна ронять чтение - уходим на primary
+        pools = pools or self.replica_pools
+        for _ in range(len(pools)):
+            pool = pools[next(self._next_replica) % len(pools)]
+            try:
+                return pool, pool.acquire()
+            except (PoolTimeout, MySQLdb.Error):
+                continue
+        return None
+
+    @property
+    def read_connection(self):
+        if not self.replica_pools or self.reads_from_primary():
+            return self.connection
+        if 'mysql_read_connection' not in g:
+            replica = self._acquire_replica()
+            if replica is None:
+                return self.connection
+            g.mysql_read_connection = replica
+        return g.mysql_read_connection[1]
+
+    def execute_batch(self, statements, read_only=False):
+        # Несколько SELECT за один round-trip: statements - список (sql, params),
+        # результат - список fetchall() по каждому. Без MYSQL_MULTI_STATEMENTS
+        # запросы выполняются по очереди на соединении запроса
+        if not self.multi_statements:
+            cur = (self.read_connection if read_only else self.connection).cursor()
+            try:
+                results = []
+                for sql, params in statements:
+                    cur.execute(sql, params)
+                    results.append(cur.fetchall())
+                return results
+            finally:
+                cur.close()
+
+        replica = None
+        if read_only and self.replica_batch_pools and not self.reads_from_primary():
+            replica = self._acquire_replica(self.replica_batch_pools)
+        pool, conn = replica or (self.batch_pool, self.batch_pool.acquire())
+        discard = False
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute(';\n'.join(sql.strip().rstrip(';').rstrip() for sql, _ in statements),
+                            tuple(value for _, params in statements for value in params))
+                results = [cur.fetchall()]
+                while cur.nextset():
+                    results.append(cur.fetchall())
+            finally:
+                cur.close()
+            return results
+        except MySQLdb.Error:
+            # Недочитанные результаты оставили бы соединение рассинхронизированным
+            discard = True
+            raise
+        finally:
+            pool.release(conn, discard=discard)
+
+    def mark_written(self):
+        g.db_wrote = True
+
+    def remember_write(self, response):
+        if self.replica_pools and g.get('db_wrote'):
+            session['_primary_until'] = time.time() + self.read_your_writes_window
+        return response
+
+    @contextmanager
+    def streaming_cursor(self, read_only=False):
+        # Небуферизованный курсор на отдельном соединении из пула: строки читаются с сервера
+        # по мере fetchmany. Пока результат не дочитан, соединением больше пользоваться нельзя,
+        # поэтому оно не связано с контекстом приложения и годится для потоковых ответов.
+        # После своей записи пользователь читает с primary, как и через read_connection
+        if read_only and has_app_context() and self.reads_from_primary():
+            read_only = False
+        replica = self._acquire_replica() if read_only and self.replica_pools else None
+        pool, conn = replica or (self.pool, self.pool.acquire())
+        cur = conn.cursor(self.streaming_cursorclass)
+        try:
+            yield cur
+        except BaseException:
+            # Клиент оборвал загрузку: закрытие курсора дочитывало бы весь результат,
+            # дешевле закрыть само соединение
+            pool.release(conn, discard=True)
+            raise
+        try:
+            cur.close()
+        except MySQLdb.Error:
+            pool.release(conn, discard=True)
+        else:
+            pool.release(conn)
+
+    def read_streaming_cursor(self):
+        # Потоковый ответ входит в курсор, когда контекста запроса уже нет, поэтому реплика
+        # или primary (read-your-writes) выбирается сейчас, при создании контекстного менеджера
+        return self.streaming_cursor(read_only=not (has_app_context() and self.reads_from_primary()))
+
+    def teardown(self, exception):
+        discard = isinstance(exception, MySQLdb.OperationalError)
+        conn = g.pop('mysql_connection', None)
+        if conn is not None:
+            self.pool.release(conn, discard=discard)
+        replica = g.pop('mysql_read_connection', None)
+        if replica is not None:
+            replica[0].release(replica[1], discard=discard)
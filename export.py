@@ -0,0 +1,149 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import archive
+from migrations import conversation_key
+from responses import dumps
+
+# Выгрузка истории переписки (NDJSON/CSV) и обратная загрузка пачками
+
+FETCH_SIZE = 500
+IMPORT_BATCH_SIZE = 1000
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+FIELDS = {
+    'user': ('id', 'sender_id', 'sender_name', 'receiver_id', 'message', 'timestamp'),
+    'group': ('id', 'group_id', 'sender_id', 'sender_name', 'message', 'timestamp'),
+}
+
+
+def export_query(chat_type, chat_id, user_id):
+    if chat_type == 'user':
+        return """
+            SELECT m.id, m.sender_id, u.username AS sender_name, m.receiver_id, m.message, m.timestamp
+            FROM messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE m.conversation_key = %s
+            ORDER BY m.timestamp, m.id
+        """, (conversation_key(user_id, chat_id),)
+    return """
+        SELECT m.id, m.group_id, m.sender_id, u.username AS sender_name, m.message, m.timestamp
+        FROM group_messages m
+        JOIN users u ON m.sender_id = u.id
+        WHERE m.group_id = %s
+        ORDER BY m.timestamp, m.id
+    """, (chat_id,)
+
+
+def _row_values(row, fields):
+    values = dict(row)
+    if isinstance(values.get('timestamp'), datetime):
+        values['timestamp'] = values['timestamp'].strftime(TIMESTAMP_FORMAT)
+    return {field: values.get(field) for field in fields}
+
+
+def _fetch_archived(cur, chat_type, chat_id):
+    # Сегменты архива по одному: в памяти не больше одного распакованного сегмента
+    while True:
+        segment = cur.fetchone()
+        if segment is None:
+            return
+        yield archive.decode(segment['payload'], chat_type, chat_id)
+
+
+def _fetch_hot(cur):
+    while True:
+        rows = cur.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield rows
+
+
+def mysql_batches(streaming_cursor, chat_type, chat_id, user_id):
+    # Строки читаются с сервера порциями через небуферизованный курсор, поэтому память
+    # не зависит от длины истории. Сначала архивные сегменты, затем горячая таблица.
+    # streaming_cursor - контекстный менеджер PooledMySQL.read_streaming_cursor(), созданный
+    # ещё в запросе; соединение берётся из пула только при входе в него
+    with streaming_cursor as cur:
+        cur.execute(*archive.segments_query(chat_type, chat_id, user_id))
+        yield from _fetch_archived(cur, chat_type, chat_id)
+        cur.execute(*export_query(chat_type, chat_id, user_id))
+        yield from _fetch_hot(cur)
+
+
+def stream_export(batches, chat_type, fmt='ndjson'):
+    # Генератор ответа; batches - порции строк беседы по порядку (export_batches хранилища)
+    fields = FIELDS[chat_type]
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields)
+        writer.writeheader()
+        yield buffer.getvalue()
+
+    for rows in batches:
+        if fmt == 'csv':
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(_row_values(row, fields) for row in rows)
+            yield buffer.getvalue()
+        else:
+            yield b''.join(dumps(_row_values(row, fields)) + b'\n' for row in rows)
+
+
+def read_rows(stream, fmt):
+    # Построчное чтение выгрузки; stream - текстовый файл
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _flush(cur, sql, batch):
+    if batch:
+        cur.executemany(sql, batch)
+        batch.clear()
+
+
+def import_messages(conn, rows, batch_size=IMPORT_BATCH_SIZE):
+    # Многострочные INSERT пачками по batch_size, каждая пачка - отдельная транзакция.
+    # id сообщений назначаются заново, время отправки сохраняется
+    direct_sql = """
+        INSERT INTO messages (sender_id, receiver_id, conversation_key, message, timestamp)
+        VALUES (%s, %s, %s, %s, %s)
+    """
+    group_sql = """
+        INSERT INTO group_messages (group_id, sender_id, message, timestamp)
+        VALUES (%s, %s, %s, %s)
+    """
+    cur = conn.cursor()
+    direct, group = [], []
+    imported = 0
+    try:
+        for row in rows:
+            sender_id = int(row['sender_id'])
+            if row.get('group_id'):
+                group.append((int(row['group_id']), sender_id, row['message'], row['timestamp']))
+            else:
+                receiver_id = int(row['receiver_id'])
+                direct.append((sender_id, receiver_id, conversation_key(sender_id, receiver_id),
+                               row['message'], row['timestamp']))
+            imported += 1
+            if len(direct) >= batch_size:
+                _flush(cur, direct_sql, direct)
+                conn.commit()
+            if len(group) >= batch_size:
+                _flush(cur, group_sql, group)
+                conn.commit()
+        _flush(cur, direct_sql, direct)
+        _flush(cur, group_sql, group)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return imported
@@ -0,0 +1,126 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+def _hash(password, method):
+    if method:
+        return generate_password_hash(password, method=method)
+    return generate_password_hash(password)
+
+
+def _check(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+class PasswordHasher:
+    # Хэширование паролей в отдельном пуле процессов ограниченного размера:
+    # шквал логинов не занимает потоки, обслуживающие чат, а лишние запросы сразу получают отказ
+
+    def __init__(self, workers=None, max_pending=64, method=None, timeout=10.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.method = method
+        self.timeout = timeout
+        self.rejected = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _pool(self):
+        # Пул создаётся лениво, уже внутри процесса воркера (после fork у gunicorn)
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # fork из многопоточного воркера копирует чужие захваченные блокировки
+                    # (логирование, пул соединений) и может зависнуть - процессы пула
+                    # запускаются через forkserver, а где его нет - через spawn
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    def _reset(self, executor):
+        # Процесс пула погиб (OOM-kill, падение) - такой пул отклоняет все задания навсегда,
+        # поэтому его выбрасываем, и следующий вызов поднимет новый
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self.restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, fn, *args):
+        executor = self._pool()
+        try:
+            return executor, executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # Пул сломался раньше, это задание ещё не запускалось - повторяем на новом пуле
+            self._reset(executor)
+            executor = self._pool()
+            return executor, executor.submit(fn, *args)
+
+    def _finished(self, future):
+        with self._lock:
+            self._pending -= 1
+            if not future.cancelled() and future.exception() is None:
+                self.completed += 1
+
+    def _run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise HashPoolBusy('Password hashing queue is full')
+            self._pending += 1
+        try:
+            executor, future = self._submit(fn, *args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        # Задание считается в очереди, пока его не закончит процесс пула: после таймаута
+        # уже запущенное хэширование продолжает занимать процесс, и новые запросы это видят
+        future.add_done_callback(self._finished)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            self.timeouts += 1
+            raise HashPoolBusy('Password hashing timed out')
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise HashPoolBusy('Password hashing process died')
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._run(_check, pwhash, password)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'restarts': self.restarts,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
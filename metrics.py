@@ -0,0 +1,184 @@
+import logging
+import threading
+import time
+
+from flask import Response, abort, g, has_request_context, request
+
+logger = logging.getLogger('slow_query')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    labels = key + (('le', _format_value(bound)),)
+                    lines.append(f"{self.name}_bucket{_format_labels(labels)} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {counts[-1]}")
+        return lines
+
+
+class CallbackGauge:
+    # Значение читается в момент выдачи /metrics; fn возвращает число или {метки: число}
+
+    def __init__(self, name, help, fn, labelnames=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = labelnames
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.fn()
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                lines.append(f"{self.name}{_format_labels(tuple(zip(self.labelnames, key)))} {_format_value(v)}")
+        else:
+            lines.append(f"{self.name} {_format_value(value)}")
+        return lines
+
+
+def statement_type(statement):
+    words = statement.split(None, 1)
+    return words[0].upper() if words else ''
+
+
+class Instrumentation:
+    # Метрики запросов и SQL: latency по endpoint, число и время запросов к БД на HTTP-запрос,
+    # лог медленных запросов и /metrics в формате Prometheus
+
+    def __init__(self, app=None, db=None):
+        self.metrics = []
+        self.http_requests = self.add(Counter(
+            'http_requests_total', 'HTTP requests by endpoint, method and status',
+            ('endpoint', 'method', 'status')))
+        self.http_latency = self.add(Histogram(
+            'http_request_duration_seconds', 'HTTP request latency by endpoint',
+            ('endpoint', 'method')))
+        self.db_queries = self.add(Histogram(
+            'db_queries_per_request', 'SQL statements issued per HTTP request',
+            ('endpoint',), buckets=QUERY_COUNT_BUCKETS))
+        self.db_time = self.add(Histogram(
+            'db_time_per_request_seconds', 'Total time spent in SQL per HTTP request',
+            ('endpoint',)))
+        self.query_latency = self.add(Histogram(
+            'db_query_duration_seconds', 'SQL statement latency by endpoint and statement type',
+            ('endpoint', 'statement'), buckets=QUERY_LATENCY_BUCKETS))
+        self.slow_queries = self.add(Counter(
+            'db_slow_queries_total', 'SQL statements slower than SLOW_QUERY_THRESHOLD_MS',
+            ('endpoint',)))
+        self.slow_query_threshold = 0.2
+        if app is not None:
+            self.init_app(app, db)
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, fn, labelnames=()):
+        return self.add(CallbackGauge(name, help, fn, labelnames))
+
+    def init_app(self, app, db=None):
+        app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', 200)
+        app.config.setdefault('METRICS_TOKEN', None)
+        self.slow_query_threshold = float(app.config['SLOW_QUERY_THRESHOLD_MS']) / 1000
+        self.token = app.config['METRICS_TOKEN']
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+        if db is not None:
+            db.query_listeners.append(self.record_query)
+
+    def before_request(self):
+        g.request_started = time.perf_counter()
+
+    def after_request(self, response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'unknown'
+        self.http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        self.http_latency.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        self.db_queries.observe(g.get('db_queries', 0), endpoint=endpoint)
+        self.db_time.observe(g.get('db_time', 0.0), endpoint=endpoint)
+        return response
+
+    def record_query(self, statement, elapsed):
+        endpoint = (request.endpoint or 'unknown') if has_request_context() else 'cli'
+        self.query_latency.observe(elapsed, endpoint=endpoint, statement=statement_type(statement))
+        if elapsed >= self.slow_query_threshold:
+            self.slow_queries.inc(endpoint=endpoint)
+            logger.warning("slow query %.1f ms in %s: %s", elapsed * 1000, endpoint,
+                           ' '.join(statement.split())[:1000])
+
+    def render(self):
+        if self.token and request.headers.get('Authorization') != f"Bearer {self.token}":
+            abort(403)
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,306 @@
+import os
+import time
+
+
+# Версионированные миграции схемы. Применяются командой `flask db-upgrade`,
+# номер последней применённой миграции хранится в таблице schema_migrations.
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+BACKFILL_BATCH_SIZE = 5000
+
+# Длина превью последнего сообщения в conversation_summaries
+PREVIEW_LENGTH = 100
+
+# Канонический ключ личной беседы: (меньший id << 32) | больший id
+CONVERSATION_KEY_SQL = "(LEAST(sender_id, receiver_id) << 32) | GREATEST(sender_id, receiver_id)"
+
+
+def conversation_key(user_a, user_b):
+    low, high = sorted((int(user_a), int(user_b)))
+    return (low << 32) | high
+
+
+def table_exists(cur, table):
+    cur.execute("""
+        SELECT 1 FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = %s
+    """, (table,))
+    return cur.fetchone() is not None
+
+
+def apply_base_schema(cur):
+    with open(SCHEMA_PATH, encoding='utf-8') as f:
+        sql = f.read()
+    for statement in sql.split(';'):
+        lines = [line for line in statement.splitlines() if not line.strip().startswith('--')]
+        if ''.join(lines).strip():
+            cur.execute('\n'.join(lines))
+
+
+def column_exists(cur, table, column):
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cur.fetchone() is not None
+
+
+def index_exists(cur, table, index):
+    cur.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index))
+    return cur.fetchone() is not None
+
+
+def create_index(cur, table, index, columns):
+    if not index_exists(cur, table, index):
+        cur.execute(f"CREATE INDEX {index} ON {table} ({columns})")
+
+
+def add_conversation_key(conn, cur):
+    if not column_exists(cur, 'messages', 'conversation_key'):
+        cur.execute("ALTER TABLE messages ADD COLUMN conversation_key BIGINT UNSIGNED NULL")
+
+    # Заполняем пачками, чтобы не держать долгую блокировку на большой таблице
+    while True:
+        updated = cur.execute(f"""
+            UPDATE messages SET conversation_key = {CONVERSATION_KEY_SQL}
+            WHERE conversation_key IS NULL
+            LIMIT %s
+        """, (BACKFILL_BATCH_SIZE,))
+        conn.commit()
+        if updated < BACKFILL_BATCH_SIZE:
+            break
+
+    cur.execute("ALTER TABLE messages MODIFY conversation_key BIGINT UNSIGNED NOT NULL")
+
+
+def add_conversation_indexes(conn, cur):
+    create_index(cur, 'messages', 'idx_messages_conversation', 'conversation_key, timestamp, id')
+    create_index(cur, 'group_messages', 'idx_group_messages_group', 'group_id, timestamp, id')
+
+
+def add_conversation_summaries(conn, cur):
+    # Денормализованный список бесед пользователя для боковой панели
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            user_id INT NOT NULL,
+            chat_type ENUM('user', 'group') NOT NULL,
+            chat_id INT NOT NULL,
+            last_message_id INT NULL,
+            last_message_preview VARCHAR({PREVIEW_LENGTH}) NULL,
+            last_message_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            unread_count INT UNSIGNED NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, chat_type, chat_id),
+            KEY idx_conversation_summaries_recent (user_id, last_message_at, chat_type, chat_id)
+        )
+    """)
+    backfill_conversation_summaries(cur)
+    conn.commit()
+
+
+def backfill_conversation_summaries(cur):
+    # Личные беседы: последнее сообщение в каждом направлении пары
+    cur.execute(f"""
+        INSERT IGNORE INTO conversation_summaries
+            (user_id, chat_type, chat_id, last_message_id, last_message_preview, last_message_at)
+        SELECT t.user_id, 'user', t.peer_id, m.id, LEFT(m.message, {PREVIEW_LENGTH}), m.timestamp
+        FROM (
+            SELECT user_id, peer_id, MAX(id) AS last_id FROM (
+                SELECT sender_id AS user_id, receiver_id AS peer_id, id FROM messages
+                UNION ALL
+                SELECT receiver_id, sender_id, id FROM messages
+            ) d
+            GROUP BY user_id, peer_id
+        ) t
+        JOIN messages m ON m.id = t.last_id
+    """)
+
+    # Группы: все участники, в том числе групп без сообщений
+    cur.execute(f"""
+        INSERT IGNORE INTO conversation_summaries
+            (user_id, chat_type, chat_id, last_message_id, last_message_preview, last_message_at)
+        SELECT gm.user_id, 'group', gm.group_id, m.id, LEFT(m.message, {PREVIEW_LENGTH}),
+               COALESCE(m.timestamp, CURRENT_TIMESTAMP)
+        FROM group_members gm
+        LEFT JOIN (
+            SELECT group_id, MAX(id) AS last_id FROM group_messages GROUP BY group_id
+        ) t ON t.group_id = gm.group_id
+        LEFT JOIN group_messages m ON m.id = t.last_id
+    """)
+
+
+def ngram_parser_available(cur):
+    # В MariaDB ngram-парсера нет
+    cur.execute("""
+        SELECT 1 FROM information_schema.plugins
+        WHERE plugin_name = 'ngram' AND plugin_status = 'ACTIVE'
+    """)
+    return cur.fetchone() is not None
+
+
+def create_ngram_search_index(cur):
+    # Со стоп-словами InnoDB выбрасывает токены вроде "in", "at", "is", и поиск подстроки
+    # не находит имена с ними. Список стоп-слов берётся при создании индекса, поэтому
+    # отключаем его только для этой сессии
+    cur.execute("SET SESSION innodb_ft_enable_stopword = OFF")
+    try:
+        cur.execute("ALTER TABLE users ADD FULLTEXT INDEX ft_users_username (username) WITH PARSER ngram")
+    finally:
+        cur.execute("SET SESSION innodb_ft_enable_stopword = DEFAULT")
+
+
+def add_username_search_index(conn, cur):
+    # ngram-индекс ищет подстроку в имени без полного сканирования users;
+    # обычный индекс по username нужен для поиска по префиксу.
+    # Без ngram-парсера FULLTEXT-индекс не создаётся: обычный полнотекстовый ищет только
+    # целые слова, и поиск подстроки остаётся на LIKE (storage.MySQLStore.search_users)
+    cur.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = 'users'
+          AND column_name = 'username' AND seq_in_index = 1 AND index_type = 'BTREE'
+    """)
+    if cur.fetchone() is None:
+        cur.execute("CREATE INDEX idx_users_username ON users (username)")
+    if not index_exists(cur, 'users', 'ft_users_username') and ngram_parser_available(cur):
+        create_ngram_search_index(cur)
+
+
+def add_group_member_count(conn, cur):
+    # Число участников хранится в самой группе, чтобы каталог групп не считал его при каждом показе
+    if not column_exists(cur, 'chat_groups', 'member_count'):
+        cur.execute("ALTER TABLE chat_groups ADD COLUMN member_count INT NOT NULL DEFAULT 0")
+    backfill_group_member_counts(cur)
+    conn.commit()
+
+
+def backfill_group_member_counts(cur, after_id=0):
+    # Пересчёт member_count групп с id больше after_id по group_members
+    cur.execute("""
+        UPDATE chat_groups SET member_count = (
+            SELECT COUNT(*) FROM group_members WHERE group_members.group_id = chat_groups.id
+        )
+        WHERE id > %s
+    """, (after_id,))
+
+
+def add_read_watermarks(conn, cur):
+    # last_read_message_id - до какого сообщения пользователь дочитал беседу.
+    # Для уже прочитанных бесед отметка ставится на последнее сообщение
+    if not column_exists(cur, 'conversation_summaries', 'last_read_message_id'):
+        cur.execute("ALTER TABLE conversation_summaries ADD COLUMN last_read_message_id INT NULL AFTER last_message_id")
+    cur.execute("""
+        UPDATE conversation_summaries SET last_read_message_id = last_message_id
+        WHERE unread_count = 0 AND last_read_message_id IS NULL
+    """)
+    conn.commit()
+
+
+def add_fanout_tables(conn, cur):
+    # Журнал событий для рассылки между воркерами (CHAT_BROKER=mysql) и отметки присутствия.
+    # Строки журнала живут недолго и удаляются самим брокером
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS fanout_events (
+            id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+            channel VARCHAR(64) NOT NULL,
+            payload MEDIUMBLOB NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_fanout_events_created (created_at)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_presence (
+            user_id INT NOT NULL PRIMARY KEY,
+            last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+
+def add_message_archive(conn, cur):
+    # Сжатые сегменты старой истории (archive.py). Курсоры пагинации ищут сегменты по краям
+    # (first_*/last_*) и по диапазону id внутри беседы
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS message_archive (
+            id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+            chat_type ENUM('user', 'group') NOT NULL,
+            chat_key BIGINT UNSIGNED NOT NULL,
+            first_at TIMESTAMP NOT NULL,
+            first_id INT NOT NULL,
+            last_at TIMESTAMP NOT NULL,
+            last_id INT NOT NULL,
+            min_id INT NOT NULL,
+            max_id INT NOT NULL,
+            message_count INT NOT NULL,
+            payload MEDIUMBLOB NOT NULL,
+            KEY idx_message_archive_first (chat_type, chat_key, first_at, first_id),
+            KEY idx_message_archive_last (chat_type, chat_key, last_at, last_id),
+            KEY idx_message_archive_ids (chat_type, chat_key, min_id)
+        ) DEFAULT CHARSET = utf8mb4
+    """)
+    conn.commit()
+
+
+MIGRATIONS = [
+    (1, 'messages.conversation_key', add_conversation_key),
+    (2, 'conversation indexes', add_conversation_indexes),
+    (3, 'conversation_summaries', add_conversation_summaries),
+    (4, 'users username search index', add_username_search_index),
+    (5, 'chat_groups.member_count', add_group_member_count),
+    (6, 'conversation_summaries.last_read_message_id', add_read_watermarks),
+    (7, 'fanout_events and user_presence', add_fanout_tables),
+    (8, 'message_archive', add_message_archive),
+]
+
+
+def current_version(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("SELECT MAX(version) AS version FROM schema_migrations")
+    row = cur.fetchone()
+    return row['version'] or 0
+
+
+def upgrade(conn, log=print):
+    # Миграции идемпотентны: DDL в MySQL не откатывается, поэтому повторный запуск
+    # после сбоя должен безопасно доделать начатое
+    cur = conn.cursor()
+    try:
+        if not table_exists(cur, 'users'):
+            log("Creating base schema from schema.sql")
+            apply_base_schema(cur)
+        version = current_version(cur)
+        applied = []
+        for number, name, migrate in MIGRATIONS:
+            if number <= version:
+                continue
+            started = time.monotonic()
+            log(f"Applying migration {number}: {name}")
+            migrate(conn, cur)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (number, name))
+            conn.commit()
+            log(f"  done in {time.monotonic() - started:.2f}s")
+            applied.append(number)
+        return applied
+    finally:
+        cur.close()
+
+
+def explain_problems(cur, queries):
+    # Возвращает описания горячих запросов, которым не хватает индекса для сортировки
+    problems = []
+    for name, sql, params in queries:
+        cur.execute("EXPLAIN " + sql, params)
+        for row in cur.fetchall():
+            extra = row.get('Extra') or ''
+            if 'Using filesort' in extra:
+                problems.append(f"{name}: filesort on table {row['table']}")
+    return problems
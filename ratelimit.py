@@ -0,0 +1,198 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import g, request, session
+
+
+class RateLimited(Exception):
+    # Пользователь исчерпал лимит маршрута; retry_after - через сколько секунд появится токен
+
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limit exceeded, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class Overloaded(Exception):
+    pass
+
+
+def parse_limits(value):
+    # "send_message=20/10,invite_to_group=20/60": endpoint=ёмкость/секунды.
+    # Ёмкость - допустимый всплеск, за указанное время ведро наполняется полностью
+    limits = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        endpoint, _, spec = item.partition('=')
+        capacity, _, period = spec.partition('/')
+        capacity = float(capacity)
+        limits[endpoint.strip()] = (capacity, capacity / float(period or 1))
+    return limits
+
+
+def refill(tokens, updated, now, capacity, rate):
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+class MemoryBuckets:
+    # Token bucket в памяти процесса: у каждого воркера свои лимиты.
+    # Ведро, которое успело наполниться, ничем не отличается от нового, поэтому
+    # раз в prune_every обращений такие вёдра удаляются - память не растёт с числом пользователей
+
+    def __init__(self, prune_every=1000):
+        self.prune_every = prune_every
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._calls = 0
+
+    def take(self, key, capacity, rate, now=None):
+        # Возвращает 0, если токен взят, иначе сколько секунд ждать
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = refill(tokens, updated, now, capacity, rate)
+            if tokens < 1:
+                wait = (1 - tokens) / rate
+            else:
+                tokens -= 1
+                wait = 0
+            # Третье поле - когда ведро снова станет полным
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            self._calls += 1
+            if self._calls % self.prune_every == 0:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now):
+        full = [key for key, bucket in self._buckets.items() if bucket[2] <= now]
+        for key in full:
+            del self._buckets[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._buckets)
+
+
+class SQLiteBuckets:
+    # Token bucket в файле SQLite (WAL): общие лимиты для всех воркеров узла без отдельного сервиса.
+    # Состояние временное, поэтому synchronous=OFF - fsync на каждый запрос не нужен
+
+    def __init__(self, path, stale_after=3600):
+        self.path = path
+        self.stale_after = stale_after
+        self._local = threading.local()
+        self._calls = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, capacity, rate, now=None):
+        now = time.time() if now is None else now
+        conn = self._connection()
+        # BEGIN IMMEDIATE берёт блокировку записи сразу: чтение и обновление ведра атомарны между процессами
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = refill(row[0], row[1], now, capacity, rate) if row else capacity
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens - 1 if wait == 0 else tokens, now))
+            self._calls += 1
+            if self._calls % 1000 == 0:
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - self.stale_after,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+class AdmissionControl:
+    # Пропуск запросов до обращения к БД:
+    #  - token bucket на пользователя и маршрут (RATE_LIMITS) - 429;
+    #  - не больше MAX_CONCURRENT_REQUESTS запросов в обработке и не больше MAX_POOL_WAITERS
+    #    запросов в ожидании соединения из пула - иначе сразу 503, а не очередь до таймаута.
+    # Долгие потоки (SSE, /metrics, статика) в ограничение параллельности не входят
+
+    exempt_endpoints = ('static', 'metrics', 'stream_chat')
+
+    def __init__(self, app=None, pool=None):
+        self.pool = pool
+        self.limits = {}
+        self.buckets = None
+        self.slots = None
+        self.max_pool_waiters = None
+        self.rejected = 0
+        self.shed = 0
+        if app is not None:
+            self.init_app(app, pool)
+
+    def init_app(self, app, pool=None):
+        config = app.config
+        config.setdefault('RATE_LIMITS', '')
+        config.setdefault('RATE_LIMIT_STORAGE', None)
+        config.setdefault('MAX_CONCURRENT_REQUESTS', 0)
+        config.setdefault('MAX_POOL_WAITERS', 0)
+
+        self.pool = pool or self.pool
+        self.limits = parse_limits(config['RATE_LIMITS'])
+        storage = config['RATE_LIMIT_STORAGE']
+        self.buckets = SQLiteBuckets(storage) if storage else MemoryBuckets()
+        if int(config['MAX_CONCURRENT_REQUESTS']):
+            self.slots = threading.BoundedSemaphore(int(config['MAX_CONCURRENT_REQUESTS']))
+        self.max_pool_waiters = int(config['MAX_POOL_WAITERS']) or None
+
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+
+    def before_request(self):
+        endpoint = request.endpoint
+        if endpoint in self.exempt_endpoints:
+            return
+
+        limit = self.limits.get(endpoint)
+        if limit is not None:
+            # id пользователя берём из сессии, не загружая его самого
+            who = session.get('_user_id') or request.remote_addr
+            wait = self.buckets.take(f"{endpoint}:{who}", *limit)
+            if wait:
+                self.rejected += 1
+                raise RateLimited(wait)
+
+        if self.max_pool_waiters is not None and self.pool.stats()['waiting'] >= self.max_pool_waiters:
+            self.shed += 1
+            raise Overloaded("Database pool exhausted")
+        if self.slots is not None:
+            if not self.slots.acquire(blocking=False):
+                self.shed += 1
+                raise Overloaded("Too many concurrent requests")
+            g.admission_slot = True
+
+    def teardown_request(self, exception):
+        if g.pop('admission_slot', None):
+            self.slots.release()
+
+    def stats(self):
+        return {'rejected': self.rejected, 'shed': self.shed}
+
+
+def retry_after_header(seconds):
+    return str(max(1, math.ceil(seconds)))
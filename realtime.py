@@ -0,0 +1,95 @@
+import queue
+import threading
+
+# Вместо пропущенных событий подписчик получает этот маркер и дочитывает историю сам
+RESYNC = {'type': 'resync'}
+
+
+# Каналы: личная переписка адресуется парой id (в каноническом порядке), группа - своим id
+def direct_channel(user_a, user_b):
+    low, high = sorted((int(user_a), int(user_b)))
+    return f"user:{low}:{high}"
+
+
+def group_channel(group_id):
+    return f"group:{int(group_id)}"
+
+
+class ChatHub:
+    # Внутрипроцессный pub/sub: у каждой подписанной сессии своя ограниченная очередь
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.resyncs = 0
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channel):
+        q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(q)
+        return q
+
+    def unsubscribe(self, channel, q):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is None:
+                return
+            subscribers.discard(q)
+            if not subscribers:
+                del self._subscribers[channel]
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # Медленный клиент не должен тормозить отправителя и копить память:
+                # очередь сбрасывается, клиент догружает пропущенное по after_id
+                self._overflow(q)
+        return len(subscribers)
+
+    def _overflow(self, q):
+        self.resyncs += 1
+        try:
+            while True:
+                q.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            q.put_nowait(RESYNC)
+        except queue.Full:
+            pass
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._subscribers.get(channel, ()))
+            return sum(len(s) for s in self._subscribers.values())
+
+
+def sse_stream(hub, channel, dumps, keepalive=15, on_open=None, on_close=None):
+    # Генератор Server-Sent Events; отписывается, когда клиент закрывает соединение.
+    # Подписка - внутри генератора: если клиент ушёл до начала ответа, генератор не запускается,
+    # его finally не выполняется, и отписывать было бы некому
+    if on_open is not None:
+        on_open()
+    q = hub.subscribe(channel)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = q.get(timeout=keepalive)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if event is RESYNC:
+                yield "event: resync\ndata: {}\n\n"
+                continue
+            yield f"id: {event['id']}\ndata: {dumps(event)}\n\n"
+    finally:
+        hub.unsubscribe(channel, q)
+        if on_close is not None:
+            on_close()
@@ -0,0 +1,47 @@
+import gzip
+import json
+import os
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE') or 1024)
+
+
+def dumps(payload):
+    # orjson, если установлен, иначе стандартный json без лишних пробелов
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def compress(response, min_size=COMPRESS_MIN_SIZE):
+    # brotli или gzip в зависимости от Accept-Encoding, только для достаточно больших ответов
+    response.vary.add('Accept-Encoding')
+    if response.direct_passthrough or response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(data, quality=4))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(data, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def json_response(payload, status=200, min_size=COMPRESS_MIN_SIZE):
+    return compress(Response(dumps(payload), status=status, mimetype='application/json'), min_size)
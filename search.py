@@ -0,0 +1,61 @@
+import threading
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    # Индекс подстрок имён пользователей в памяти процесса, для MySQL без ngram-парсера (MariaDB):
+    # для каждой тройки символов - множество id, в чьих именах она встречается. Запрос пересекает
+    # множества своих троек и проверяет только кандидатов, а не сканирует всю таблицу users.
+    # Регистр не учитывается, как в collation users.username; запросы короче тройки сюда не попадают
+
+    MIN_QUERY_LENGTH = 3
+
+    def __init__(self):
+        self.last_id = 0
+        self.loaded = False
+        self._names = {}
+        self._grams = {}
+        self._lock = threading.Lock()
+
+    def _add(self, names, grams, user_id, username):
+        names[user_id] = username
+        for gram in trigrams(username.casefold()):
+            grams.setdefault(gram, set()).add(user_id)
+
+    def load(self, rows):
+        # Полная перестройка: строится отдельно и подменяет старый индекс целиком
+        names, grams = {}, {}
+        for row in rows:
+            self._add(names, grams, int(row['id']), row['username'])
+        with self._lock:
+            self._names, self._grams = names, grams
+            self.last_id = max(names, default=0)
+            self.loaded = True
+
+    def add(self, rows):
+        with self._lock:
+            for row in rows:
+                user_id = int(row['id'])
+                self._add(self._names, self._grams, user_id, row['username'])
+                self.last_id = max(self.last_id, user_id)
+
+    def search(self, query, exclude_id, limit, offset):
+        # Сначала имена, начинающиеся с запроса, затем остальные вхождения; порядок стабильный
+        needle = query.casefold()
+        with self._lock:
+            postings = sorted((self._grams.get(gram, ()) for gram in trigrams(needle)), key=len)
+            if not postings or not postings[0]:
+                return []
+            candidates = set(postings[0]).intersection(*postings[1:])
+            matches = [(user_id, self._names[user_id]) for user_id in candidates
+                       if user_id != exclude_id and needle in self._names[user_id].casefold()]
+        matches.sort(key=lambda match: (not match[1].casefold().startswith(needle),
+                                        match[1].casefold(), match[0]))
+        return [{'id': user_id, 'username': username}
+                for user_id, username in matches[offset:offset + limit]]
+
+    def __len__(self):
+        return len(self._names)
@@ -0,0 +1,506 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const currentUserId = parseInt(document.body.dataset.currentUserId || '0');
+    const messageInput = document.getElementById('message-text');
+    const sendButton = document.getElementById('send-button');
+    let currentChat = null;
+    let chatStream = null;
+
+    // Функция активации формы
+    function activateChatForm(active = true) {
+        messageInput.disabled = !active;
+        sendButton.disabled = !active;
+        if (active) {
+            messageInput.focus();
+        }
+    }
+
+    // Состояние бесед: загруженные сообщения, их DOM-узлы, курсоры keyset-пагинации и позиция
+    // прокрутки. Последние CHAT_CACHE_SIZE бесед держатся в памяти, чтобы при возврате
+    // не запрашивать историю заново
+    const CHAT_CACHE_SIZE = 20;
+    // В DOM одновременно не больше WINDOW_SIZE сообщений, окно сдвигается на WINDOW_STEP
+    const WINDOW_SIZE = 200;
+    const WINDOW_STEP = 50;
+    const chatCache = new Map();
+    const container = document.getElementById('chat-messages');
+
+    function chatState(chatType, chatId) {
+        const key = `${chatType}:${chatId}`;
+        let state = chatCache.get(key);
+        if (state) {
+            chatCache.delete(key);
+        } else {
+            state = {
+                messages: [], ids: new Set(), nodes: new Map(),
+                start: 0, end: 0, beforeCursor: null, afterCursor: null,
+                loading: null, loaded: false, loadingOlder: false,
+                scrollTop: null, atBottom: true,
+            };
+        }
+        // Map помнит порядок вставки: недавно открытые - в конце, вытесняется самая старая
+        chatCache.set(key, state);
+        if (chatCache.size > CHAT_CACHE_SIZE) chatCache.delete(chatCache.keys().next().value);
+        return state;
+    }
+
+    function isCurrent(state) {
+        return currentChat !== null && currentChat.state === state;
+    }
+
+    // Узел сообщения строится один раз и переиспользуется при сдвиге окна и возврате в беседу
+    function messageNode(state, msg) {
+        let node = state.nodes.get(msg.id);
+        if (node) return node;
+        node = document.createElement('div');
+        node.className = `message ${msg.sender_id === currentUserId ? 'sent' : 'received'}`;
+        const content = document.createElement('div');
+        content.className = 'message-content';
+        content.textContent = msg.message;
+        const time = document.createElement('div');
+        time.className = 'message-time';
+        time.textContent = new Date(msg.timestamp).toLocaleTimeString();
+        content.appendChild(time);
+        node.appendChild(content);
+        state.nodes.set(msg.id, node);
+        return node;
+    }
+
+    function fragmentOf(state, messages) {
+        const fragment = document.createDocumentFragment();
+        messages.forEach(msg => fragment.appendChild(messageNode(state, msg)));
+        return fragment;
+    }
+
+    function removeNodes(state, messages) {
+        messages.forEach(msg => state.nodes.get(msg.id).remove());
+    }
+
+    // Лишние узлы сверху: позиция прокрутки сохраняется
+    function trimStart(state) {
+        const extra = state.end - state.start - WINDOW_SIZE;
+        if (extra <= 0) return;
+        const previousHeight = container.scrollHeight;
+        removeNodes(state, state.messages.slice(state.start, state.start + extra));
+        state.start += extra;
+        container.scrollTop -= previousHeight - container.scrollHeight;
+    }
+
+    function trimEnd(state) {
+        const extra = state.end - state.start - WINDOW_SIZE;
+        if (extra <= 0) return;
+        removeNodes(state, state.messages.slice(state.end - extra, state.end));
+        state.end -= extra;
+    }
+
+    // Отрисовка окна беседы целиком - одна вставка фрагмента
+    function renderChat(state) {
+        if (state.messages.length === 0) {
+            container.innerHTML = '<div class="no-messages">Нет сообщений</div>';
+            return;
+        }
+        if (state.atBottom) {
+            state.end = state.messages.length;
+            state.start = Math.max(0, state.end - WINDOW_SIZE);
+        }
+        container.replaceChildren(fragmentOf(state, state.messages.slice(state.start, state.end)));
+        container.scrollTop = state.atBottom ? container.scrollHeight : state.scrollTop;
+    }
+
+    function saveScroll(state) {
+        state.scrollTop = container.scrollTop;
+        state.atBottom = state.end === state.messages.length &&
+            container.scrollTop + container.clientHeight >= container.scrollHeight - 10;
+    }
+
+    // Новые сообщения - в конец. В DOM добавляются только они и только если окно
+    // показывает конец ленты, иначе появятся при прокрутке вниз
+    function addNewer(state, messages, render = true) {
+        const fresh = messages.filter(msg => !state.ids.has(msg.id));
+        if (fresh.length === 0) return;
+        const atEnd = state.end === state.messages.length;
+        fresh.forEach(msg => {
+            state.ids.add(msg.id);
+            if (state.afterCursor === null || msg.id > state.afterCursor) state.afterCursor = msg.id;
+        });
+        state.messages.push(...fresh);
+        if (!render || !isCurrent(state) || !atEnd) return;
+
+        const placeholder = container.querySelector('.no-messages');
+        if (placeholder) placeholder.remove();
+        container.appendChild(fragmentOf(state, fresh));
+        state.end = state.messages.length;
+        trimStart(state);
+        container.scrollTop = container.scrollHeight;
+    }
+
+    // Более старая страница с сервера - в начало ленты
+    function addOlder(state, messages) {
+        const fresh = messages.filter(msg => !state.ids.has(msg.id));
+        fresh.forEach(msg => state.ids.add(msg.id));
+        state.messages.unshift(...fresh);
+        state.start += fresh.length;
+        state.end += fresh.length;
+    }
+
+    // Сдвиг окна по уже загруженным сообщениям; false - выше в памяти ничего нет
+    function showOlder(state) {
+        if (state.start === 0) return false;
+        const count = Math.min(WINDOW_STEP, state.start);
+        const previousHeight = container.scrollHeight;
+        container.prepend(fragmentOf(state, state.messages.slice(state.start - count, state.start)));
+        container.scrollTop += container.scrollHeight - previousHeight;
+        state.start -= count;
+        trimEnd(state);
+        return true;
+    }
+
+    function showNewer(state) {
+        if (state.end === state.messages.length) return;
+        const count = Math.min(WINDOW_STEP, state.messages.length - state.end);
+        container.appendChild(fragmentOf(state, state.messages.slice(state.end, state.end + count)));
+        state.end += count;
+        trimStart(state);
+    }
+
+    function fetchPage(chat, params = {}) {
+        const query = new URLSearchParams(params).toString();
+        return fetch(`/get_chat_messages/${chat.type}/${chat.id}${query ? '?' + query : ''}`)
+            .then(response => {
+                if (!response.ok) throw new Error('Network response was not ok');
+                return response.json();
+            });
+    }
+
+    // Догрузка только тех сообщений, которых у клиента ещё нет
+    function syncNewer(chat) {
+        const state = chat.state;
+        if (state.afterCursor === null) {
+            return fetchPage(chat).then(page => {
+                if (state.beforeCursor === null) state.beforeCursor = page.before_id;
+                addNewer(state, page.messages);
+                if (isCurrent(state) && state.messages.length === 0) renderChat(state);
+            });
+        }
+        return fetchPage(chat, { after_id: state.afterCursor }).then(page => {
+            addNewer(state, page.messages);
+            if (page.has_more) return syncNewer(chat);
+        });
+    }
+
+    function loadOlder() {
+        const chat = currentChat;
+        const state = chat && chat.state;
+        if (!state || state.beforeCursor === null || state.loadingOlder) return;
+        state.loadingOlder = true;
+        fetchPage(chat, { before_id: state.beforeCursor }).then(page => {
+            addOlder(state, page.messages);
+            state.beforeCursor = page.before_id;
+            if (isCurrent(state)) showOlder(state);
+        }).catch(error => console.error('Error loading messages:', error))
+          .finally(() => { state.loadingOlder = false; });
+    }
+
+    // Прокрутка обрабатывается не чаще раза за кадр
+    let scrollScheduled = false;
+    container.addEventListener('scroll', function() {
+        if (scrollScheduled) return;
+        scrollScheduled = true;
+        requestAnimationFrame(() => {
+            scrollScheduled = false;
+            const state = currentChat && currentChat.state;
+            if (!state || !state.loaded) return;
+            if (container.scrollTop < 100) {
+                if (!showOlder(state)) loadOlder();
+            } else if (container.scrollTop + container.clientHeight >= container.scrollHeight - 100) {
+                showNewer(state);
+            }
+        });
+    });
+
+    // Подписка на новые сообщения открытого чата (Server-Sent Events)
+    function openStream(chat) {
+        if (chatStream) chatStream.close();
+        chatStream = new EventSource(`/stream/${chat.type}/${chat.id}`);
+        // При каждом подключении забираем то, что пришло между загрузкой страницы
+        // (или разрывом потока) и подпиской
+        chatStream.onopen = function() {
+            syncNewer(chat).catch(error => console.error('Error syncing messages:', error));
+        };
+        chatStream.onmessage = function(e) {
+            addNewer(chat.state, [JSON.parse(e.data)]);
+            scheduleMarkRead(chat);
+        };
+        // Клиент отстал и сервер сбросил его очередь: догружаем пропущенное по after_id
+        chatStream.addEventListener('resync', function() {
+            syncNewer(chat).catch(error => console.error('Error syncing messages:', error));
+        });
+    }
+
+    function showLoadError(error) {
+        console.error('Error loading messages:', error);
+        container.innerHTML = `
+            <div class="alert alert-danger">
+                Ошибка загрузки: ${error.message}
+            </div>
+        `;
+    }
+
+    // Функция загрузки чата
+    function loadChat(chatType, chatId, chatName) {
+        if (currentChat) saveScroll(currentChat.state);
+        const state = chatState(chatType, chatId);
+        const chat = { type: chatType, id: chatId, name: chatName, state: state };
+        currentChat = chat;
+        
+        // Обновляем интерфейс
+        const header = document.createElement('h5');
+        header.textContent = chatName;
+        document.getElementById('chat-header').replaceChildren(header);
+        document.getElementById('chat-type').value = chatType;
+        document.getElementById('chat-id').value = chatId;
+        
+        // Активируем форму
+        activateChatForm(true);
+
+        if (state.loaded) {
+            // Беседа уже в памяти: рисуем сразу, пропущенное за время закрытого потока
+            // догрузится по after_id при подключении
+            renderChat(state);
+            markRead(chat);
+            openStream(chat);
+            return;
+        }
+
+        // Загрузка последней страницы сообщений
+        container.replaceChildren();
+        if (!state.loading) {
+            state.loading = fetchPage(chat).then(page => {
+                state.beforeCursor = page.before_id;
+                addNewer(state, page.messages, false);
+                state.loaded = true;
+            });
+        }
+        state.loading.then(() => {
+            if (chat !== currentChat) return;
+            renderChat(state);
+            markRead(chat);
+
+            // Дальше новые сообщения приходят через поток, без перезагрузки истории
+            openStream(chat);
+        }).catch(error => {
+            state.loading = null;
+            if (chat === currentChat) showLoadError(error);
+        });
+    }
+
+    // Боковая панель: беседы подгружаются страницами по мере прокрутки
+    const chatsList = document.getElementById('chats-list');
+    let conversationsPage = 0;
+    let conversationsHasMore = true;
+    let loadingConversations = false;
+
+    function findChatItem(chatType, chatId) {
+        return chatsList.querySelector(`.chat-item[data-chat-type="${chatType}"][data-chat-id="${chatId}"]`);
+    }
+
+    function updateChatItem(item, preview, unread) {
+        item.querySelector('.last-message').textContent = preview || '';
+        const badge = item.querySelector('.unread-count');
+        badge.textContent = unread || '';
+        badge.classList.toggle('d-none', !unread);
+    }
+
+    // Открытая беседа считается прочитанной до конца: сервер двигает отметку прочтения
+    let markReadTimer = null;
+
+    function markRead(chat) {
+        if (!chat) return;
+        fetch(`/api/conversations/${chat.type}/${chat.id}/read`, { method: 'POST' })
+            .then(response => response.ok ? response.json() : null)
+            .then(data => {
+                const item = findChatItem(chat.type, chat.id);
+                if (data && item) updateChatItem(item, item.querySelector('.last-message').textContent, data.unread_count);
+            })
+            .catch(error => console.error('Error marking chat read:', error));
+    }
+
+    function scheduleMarkRead(chat) {
+        clearTimeout(markReadTimer);
+        markReadTimer = setTimeout(() => markRead(chat), 1000);
+    }
+
+    // Счётчики непрочитанного для всех бесед одним запросом
+    function refreshUnread() {
+        fetch('/api/unread')
+            .then(response => {
+                if (!response.ok) throw new Error('Network response was not ok');
+                return response.json();
+            })
+            .then(data => {
+                const counts = new Map(data.unread.map(c => [`${c.chat_type}:${c.chat_id}`, c.unread_count]));
+                chatsList.querySelectorAll('.chat-item').forEach(item => {
+                    const unread = counts.get(`${item.dataset.chatType}:${item.dataset.chatId}`) || 0;
+                    updateChatItem(item, item.querySelector('.last-message').textContent, unread);
+                });
+            })
+            .catch(error => console.error('Error loading unread counts:', error));
+    }
+
+    function chatItem(chat) {
+        const item = document.createElement('li');
+        item.className = 'list-group-item list-group-item-action chat-item';
+        item.dataset.chatType = chat.chat_type;
+        item.dataset.chatId = chat.chat_id;
+        item.innerHTML = `
+            <div class="d-flex align-items-center">
+                <img src="https://via.placeholder.com/50" class="rounded-circle me-3" alt="">
+                <div class="flex-grow-1 overflow-hidden">
+                    <h6 class="mb-0"></h6>
+                    <small class="text-muted last-message"></small>
+                </div>
+                <span class="badge rounded-pill bg-primary unread-count"></span>
+            </div>
+        `;
+        item.querySelector('h6').textContent = chat.name;
+        updateChatItem(item, chat.last_message_preview, chat.unread_count);
+        if (currentChat && currentChat.type === chat.chat_type && String(currentChat.id) === String(chat.chat_id)) {
+            item.classList.add('active');
+        }
+        return item;
+    }
+
+    function loadConversations() {
+        if (!conversationsHasMore || loadingConversations) return;
+        loadingConversations = true;
+        fetch(`/api/conversations?page=${conversationsPage + 1}`)
+            .then(response => {
+                if (!response.ok) throw new Error('Network response was not ok');
+                return response.json();
+            })
+            .then(data => {
+                conversationsPage = data.page;
+                conversationsHasMore = data.has_more;
+                data.conversations.forEach(chat => {
+                    if (!findChatItem(chat.chat_type, chat.chat_id)) chatsList.appendChild(chatItem(chat));
+                });
+            })
+            .catch(error => console.error('Error loading conversations:', error))
+            .finally(() => { loadingConversations = false; });
+    }
+
+    document.getElementById('chats-scroll').addEventListener('scroll', function() {
+        if (this.scrollTop + this.clientHeight >= this.scrollHeight - 50) loadConversations();
+    });
+
+    function selectChat(chatType, chatId, chatName) {
+        document.querySelectorAll('.chat-item').forEach(i => i.classList.remove('active'));
+        const item = findChatItem(chatType, chatId);
+        if (item) item.classList.add('active');
+        loadChat(chatType, chatId, chatName);
+    }
+
+    // Обработчик клика по чату
+    chatsList.addEventListener('click', function(e) {
+        const item = e.target.closest('.chat-item');
+        if (!item) return;
+        selectChat(item.dataset.chatType, item.dataset.chatId, item.querySelector('h6').textContent);
+    });
+
+    // После отправки беседа поднимается в начало списка
+    function touchConversation(chat, msg) {
+        let item = findChatItem(chat.type, chat.id);
+        if (!item) {
+            item = chatItem({ chat_type: chat.type, chat_id: chat.id, name: chat.name });
+            item.classList.add('active');
+        }
+        updateChatItem(item, msg.message, 0);
+        chatsList.prepend(item);
+    }
+
+    // Поиск пользователей, чтобы начать новую беседу
+    const searchInput = document.getElementById('user-search');
+    const searchResults = document.getElementById('search-results');
+    let searchTimer = null;
+
+    searchInput.addEventListener('input', function() {
+        clearTimeout(searchTimer);
+        const query = this.value.trim();
+        if (!query) {
+            searchResults.innerHTML = '';
+            searchResults.classList.add('d-none');
+            return;
+        }
+        searchTimer = setTimeout(() => {
+            fetch(`/search_users?q=${encodeURIComponent(query)}`)
+                .then(response => response.json())
+                .then(data => {
+                    const users = data.users;
+                    searchResults.innerHTML = '';
+                    users.forEach(user => {
+                        const item = document.createElement('li');
+                        item.className = 'list-group-item list-group-item-action search-item';
+                        item.textContent = user.username;
+                        item.addEventListener('click', () => {
+                            searchInput.value = '';
+                            searchResults.classList.add('d-none');
+                            selectChat('user', String(user.id), user.username);
+                        });
+                        searchResults.appendChild(item);
+                    });
+                    searchResults.classList.toggle('d-none', users.length === 0);
+                })
+                .catch(error => console.error('Error searching users:', error));
+        }, 250);
+    });
+
+    // Обработчик отправки сообщения
+    document.getElementById('message-form').addEventListener('submit', function(e) {
+        e.preventDefault();
+        
+        const chat = currentChat;
+        if (!chat || messageInput.disabled) return;
+        
+        const message = messageInput.value.trim();
+        if (!message) return;
+        
+        // Временно деактивируем форму
+        activateChatForm(false);
+        
+        fetch('/send_message', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                chat_type: chat.type,
+                chat_id: chat.id,
+                message: message
+            })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'success') {
+                messageInput.value = '';
+                addNewer(chat.state, [data.data]);
+                touchConversation(chat, data.data);
+                activateChatForm(true);
+            } else {
+                activateChatForm(true);
+                alert('Ошибка: ' + (data.message || 'неизвестная ошибка'));
+            }
+        })
+        .catch(error => {
+            activateChatForm(true);
+            console.error('Ошибка:', error);
+        });
+    });
+
+    loadConversations();
+    setInterval(refreshUnread, 30000);
+
+    // Загрузка начального чата, если он указан
+    const initialChat = chatsList.dataset;
+    if (initialChat.initialChatType && initialChat.initialChatId) {
+        loadChat(initialChat.initialChatType, initialChat.initialChatId, initialChat.initialChatName);
+    }
+});
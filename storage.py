@@ -0,0 +1,1143 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import g, has_app_context
+
+import archive
+import export
+from migrations import PREVIEW_LENGTH, conversation_key
+from search import TrigramIndex
+
+logger = logging.getLogger('storage')
+
+# Слой доступа к данным: маршруты вызывают методы хранилища, а не пишут SQL сами.
+# MySQLStore - основной вариант поверх PooledMySQL (реплики, архив, пачки записей),
+# SQLiteStore - встроенная база в файле для одного узла, тестов и бенчмарков без сервера БД.
+# Строки - словари с теми же ключами, время - datetime
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def message_page_query(chat_type, chat_id, user_id, cursor=None, newer=False, limit=100):
+    # Запрос страницы истории; cursor - пара (timestamp, id) граничного сообщения.
+    # Фильтр и сортировка целиком покрываются индексами (conversation_key|group_id, timestamp, id).
+    # placeholder - %s для MySQL, ? для SQLite, текст запроса в остальном общий
+    if chat_type == 'user':
+        table = 'messages'
+        where = "m.conversation_key = %s"
+        params = [conversation_key(user_id, chat_id)]
+    else:
+        table = 'group_messages'
+        where = "m.group_id = %s"
+        params = [chat_id]
+
+    if cursor:
+        op = '>' if newer else '<'
+        where += f" AND (m.timestamp {op} %s OR (m.timestamp = %s AND m.id {op} %s))"
+        params += [cursor[0], cursor[0], cursor[1]]
+
+    order = 'ASC' if newer else 'DESC'
+    sql = f"""
+        SELECT m.id, m.sender_id, u.username as sender_name, m.message, m.timestamp
+        FROM {table} m
+        JOIN users u ON m.sender_id = u.id
+        WHERE {where}
+        ORDER BY m.timestamp {order}, m.id {order}
+        LIMIT %s
+    """
+    return sql, params + [limit]
+
+
+def message_cursor_query(chat_type, chat_id, user_id, message_id):
+    # Время граничного сообщения для курсора. Ищется только в этой беседе: id сообщения
+    # из чужого чата - неизвестный курсор, а не граница страницы
+    if chat_type == 'user':
+        return ("SELECT timestamp FROM messages WHERE id = %s AND conversation_key = %s",
+                (message_id, conversation_key(user_id, chat_id)))
+    return "SELECT timestamp FROM group_messages WHERE id = %s AND group_id = %s", (message_id, chat_id)
+
+
+class MySQLStore:
+    # Чтения идут через mysql.read_connection (реплики), записи и проверки перед записью -
+    # через mysql.connection; каждая запись - отдельная транзакция
+
+    def __init__(self, mysql, ngram_token_size=2, search_reload=300):
+        self.mysql = mysql
+        # Минимальная длина токена ngram-парсера MySQL (ngram_token_size)
+        self.ngram_token_size = ngram_token_size
+        self._ngram_index = None
+        # Без ngram-индекса подстроки ищутся в памяти процесса; раз в search_reload секунд
+        # индекс перечитывается целиком
+        self.username_index = TrigramIndex()
+        self.search_reload = search_reload
+        self._username_index_loaded_at = None
+
+    @property
+    def query_listeners(self):
+        return self.mysql.query_listeners
+
+    def _fetch(self, sql, params=(), one=False, primary=False):
+        conn = self.mysql.connection if primary else self.mysql.read_connection
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, params)
+            return cur.fetchone() if one else list(cur.fetchall())
+        finally:
+            cur.close()
+
+    def raw_connection(self):
+        # Соединение MySQLdb с primary для служебного кода вне маршрутов (генератор данных бенчмарков)
+        return self.mysql.connection
+
+    @contextmanager
+    def transaction(self):
+        conn = self.mysql.connection
+        cur = conn.cursor()
+        try:
+            yield cur
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    # Пользователи
+
+    def get_user(self, user_id):
+        return self._fetch("SELECT id, username, email, created_at FROM users WHERE id = %s",
+                           (user_id,), one=True)
+
+    def has_user(self, user_id):
+        return self._fetch("SELECT 1 FROM users WHERE id = %s", (user_id,), one=True, primary=True) is not None
+
+    def user_for_login(self, username):
+        return self._fetch("SELECT id, username, email, password FROM users WHERE username = %s",
+                           (username,), one=True, primary=True)
+
+    def user_exists(self, username, email):
+        return self._fetch("SELECT 1 FROM users WHERE username = %s OR email = %s",
+                           (username, email), one=True, primary=True) is not None
+
+    def create_user(self, username, email, password_hash):
+        with self.transaction() as cur:
+            cur.execute("INSERT INTO users (username, email, password) VALUES (%s, %s, %s)",
+                        (username, email, password_hash))
+            user_id = cur.lastrowid
+        if self.username_index.loaded:
+            self.username_index.add([{'id': user_id, 'username': username}])
+        return user_id
+
+    def other_users(self, user_id):
+        return self._fetch("SELECT id, username FROM users WHERE id != %s", (user_id,), primary=True)
+
+    def has_ngram_index(self):
+        # Миграция 4 создаёт ft_users_username только с ngram-парсером, поэтому наличие индекса
+        # означает поиск подстроки через MATCH. Проверяется один раз на процесс
+        if self._ngram_index is None:
+            self._ngram_index = self._fetch("""
+                SELECT 1 AS found FROM information_schema.statistics
+                WHERE table_schema = DATABASE() AND table_name = 'users' AND index_name = 'ft_users_username'
+                LIMIT 1
+            """, one=True) is not None
+            if not self._ngram_index:
+                logger.warning("no ngram FULLTEXT index on users.username (MariaDB?): "
+                               "username search uses an in-process trigram index")
+        return self._ngram_index
+
+    def _username_index(self):
+        # Пользователи, зарегистрированные через другие воркеры, догружаются по id перед каждым
+        # поиском (диапазон по первичному ключу, обычно пустой). Полная перезагрузка подбирает
+        # строки, закоммиченные не в порядке id
+        index = self.username_index
+        now = time.monotonic()
+        if self._username_index_loaded_at is None or now - self._username_index_loaded_at > self.search_reload:
+            index.load(self._fetch("SELECT id, username FROM users"))
+            self._username_index_loaded_at = now
+        else:
+            index.add(self._fetch("SELECT id, username FROM users WHERE id > %s ORDER BY id", (index.last_id,)))
+        return index
+
+    def search_users(self, query, exclude_id, limit, offset):
+        prefix = escape_like(query) + '%'
+        ngram = self.has_ngram_index()
+        if len(query) < (self.ngram_token_size if ngram else TrigramIndex.MIN_QUERY_LENGTH):
+            # Слишком короткий запрос для индекса подстрок - только совпадения по префиксу
+            return self._fetch("""
+                SELECT id, username FROM users
+                WHERE username LIKE %s AND id != %s
+                ORDER BY username, id
+                LIMIT %s OFFSET %s
+            """, (prefix, exclude_id, limit, offset))
+        if not ngram:
+            return self._username_index().search(query, exclude_id, limit, offset)
+        # Сначала имена, начинающиеся с запроса, затем остальные вхождения
+        phrase = '"' + query.replace('"', ' ') + '"'
+        return self._fetch("""
+            SELECT id, username FROM users
+            WHERE MATCH(username) AGAINST (%s IN BOOLEAN MODE) AND id != %s
+            ORDER BY username LIKE %s DESC, username, id
+            LIMIT %s OFFSET %s
+        """, (phrase, exclude_id, prefix, limit, offset))
+
+    def chat_name(self, chat_type, chat_id):
+        if chat_type == 'user':
+            row = self._fetch("SELECT username AS name FROM users WHERE id = %s", (chat_id,), one=True)
+        else:
+            row = self._fetch("SELECT name FROM chat_groups WHERE id = %s", (chat_id,), one=True)
+        return row['name'] if row else None
+
+    # Беседы и отметки прочтения
+
+    def conversations(self, user_id, limit, offset):
+        return self._fetch("""
+            SELECT cs.chat_type, cs.chat_id, COALESCE(u.username, g.name) AS name,
+                   cs.last_message_id, cs.last_message_preview, cs.last_message_at, cs.unread_count
+            FROM conversation_summaries cs
+            LEFT JOIN users u ON cs.chat_type = 'user' AND u.id = cs.chat_id
+            LEFT JOIN chat_groups g ON cs.chat_type = 'group' AND g.id = cs.chat_id
+            WHERE cs.user_id = %s
+            ORDER BY cs.last_message_at DESC, cs.chat_type DESC, cs.chat_id DESC
+            LIMIT %s OFFSET %s
+        """, (user_id, limit, offset))
+
+    def conversation_version(self, user_id, chat_type, chat_id):
+        return self._fetch("""
+            SELECT last_message_id, last_message_at FROM conversation_summaries
+            WHERE user_id = %s AND chat_type = %s AND chat_id = %s
+        """, (user_id, chat_type, chat_id), one=True)
+
+    def unread(self, user_id):
+        # Один запрос по первичному ключу (user_id, ...): стоимость зависит от числа бесед, не сообщений
+        return self._fetch("""
+            SELECT chat_type, chat_id, unread_count, last_read_message_id FROM conversation_summaries
+            WHERE user_id = %s AND unread_count > 0
+        """, (user_id,))
+
+    def update_direct_summaries(self, cur, sender_id, receiver_id, message_id, message):
+        # У отправителя беседа поднимается наверх прочитанной, у получателя растёт счётчик
+        preview = message[:PREVIEW_LENGTH]
+        rows = [(sender_id, receiver_id, message_id, message_id, preview, 0)]
+        if int(receiver_id) != int(sender_id):
+            rows.append((receiver_id, sender_id, message_id, None, preview, 1))
+        cur.executemany("""
+            INSERT INTO conversation_summaries
+                (user_id, chat_type, chat_id, last_message_id, last_read_message_id,
+                 last_message_preview, last_message_at, unread_count)
+            VALUES (%s, 'user', %s, %s, %s, %s, NOW(), %s)
+            ON DUPLICATE KEY UPDATE
+                last_message_id = VALUES(last_message_id),
+                last_read_message_id = IF(VALUES(unread_count) = 0, VALUES(last_read_message_id), last_read_message_id),
+                last_message_preview = VALUES(last_message_preview),
+                last_message_at = VALUES(last_message_at),
+                unread_count = IF(VALUES(unread_count) = 0, 0, unread_count + 1)
+        """, rows)
+
+    def update_group_summaries(self, cur, group_id, sender_id, message_id, message):
+        cur.execute("""
+            INSERT INTO conversation_summaries
+                (user_id, chat_type, chat_id, last_message_id, last_read_message_id,
+                 last_message_preview, last_message_at, unread_count)
+            SELECT user_id, 'group', group_id, %s, IF(user_id = %s, %s, NULL), %s, NOW(), IF(user_id = %s, 0, 1)
+            FROM group_members
+            WHERE group_id = %s
+            ON DUPLICATE KEY UPDATE
+                last_message_id = VALUES(last_message_id),
+                last_read_message_id = IF(VALUES(unread_count) = 0, VALUES(last_read_message_id), last_read_message_id),
+                last_message_preview = VALUES(last_message_preview),
+                last_message_at = VALUES(last_message_at),
+                unread_count = IF(VALUES(unread_count) = 0, 0, unread_count + 1)
+        """, (message_id, sender_id, message_id, message[:PREVIEW_LENGTH], sender_id, group_id))
+
+    def update_summaries(self, cur, chat_type, chat_id, sender_id, message, message_id):
+        # Вызывается и из WriteBatcher (after_insert) внутри транзакции пачки
+        if chat_type == 'user':
+            self.update_direct_summaries(cur, sender_id, chat_id, message_id, message)
+        else:
+            self.update_group_summaries(cur, chat_id, sender_id, message_id, message)
+
+    def count_unread_after(self, cur, chat_type, chat_id, user_id, message_id):
+        # Чужие сообщения после отметки - диапазон по индексу беседы (.., timestamp, id), а не вся история
+        if chat_type == 'user':
+            table, condition, key = 'messages', 'conversation_key = %s', conversation_key(user_id, chat_id)
+        else:
+            table, condition, key = 'group_messages', 'group_id = %s', chat_id
+        cur.execute(f"""
+            SELECT COUNT(*) AS unread FROM {table}
+            WHERE {condition} AND sender_id != %s AND id > %s
+              AND timestamp >= (SELECT timestamp FROM {table} WHERE id = %s AND {condition})
+        """, (key, user_id, message_id, message_id, key))
+        return cur.fetchone()['unread']
+
+    def mark_read(self, user_id, chat_type, chat_id, message_id=None):
+        # Отметка прочтения только растёт. Без message_id беседа читается до конца.
+        # Строка блокируется, чтобы параллельная отправка не потеряла прибавку к счётчику
+        with self.transaction() as cur:
+            cur.execute("""
+                SELECT last_message_id, last_read_message_id, unread_count FROM conversation_summaries
+                WHERE user_id = %s AND chat_type = %s AND chat_id = %s
+                FOR UPDATE
+            """, (user_id, chat_type, chat_id))
+            summary = cur.fetchone()
+            if summary is None:
+                return None
+
+            last_id = summary['last_message_id'] or 0
+            read_id = min(message_id or last_id, last_id)
+            if read_id <= (summary['last_read_message_id'] or 0):
+                return summary['unread_count']
+
+            unread = 0 if read_id == last_id else self.count_unread_after(cur, chat_type, chat_id, user_id, read_id)
+            cur.execute("""
+                UPDATE conversation_summaries SET last_read_message_id = %s, unread_count = %s
+                WHERE user_id = %s AND chat_type = %s AND chat_id = %s
+            """, (read_id, unread, user_id, chat_type, chat_id))
+            return unread
+
+    # Сообщения
+
+    def insert_message(self, chat_type, chat_id, sender_id, message):
+        # INSERT сообщения и обновление списков бесед в одной транзакции
+        with self.transaction() as cur:
+            if chat_type == 'user':
+                cur.execute("""
+                    INSERT INTO messages (sender_id, receiver_id, conversation_key, message)
+                    VALUES (%s, %s, %s, %s)
+                """, (sender_id, chat_id, conversation_key(sender_id, chat_id), message))
+            else:
+                cur.execute("""
+                    INSERT INTO group_messages (group_id, sender_id, message)
+                    VALUES (%s, %s, %s)
+                """, (chat_id, sender_id, message))
+            message_id = cur.lastrowid
+            self.update_summaries(cur, chat_type, chat_id, sender_id, message, message_id)
+            return message_id
+
+    def message_page(self, chat_type, chat_id, user_id, after_id=None, before_id=None, limit=100):
+        # До limit строк за курсором: после after_id - по возрастанию (timestamp, id),
+        # иначе - по убыванию. Неизвестный курсор - ValueError
+        cur = self.mysql.read_connection.cursor()
+        try:
+            cursor = None
+            cursor_archived = False
+            cursor_id = after_id or before_id
+            if cursor_id:
+                cur.execute(*message_cursor_query(chat_type, chat_id, user_id, cursor_id))
+                row = cur.fetchone()
+                if row:
+                    cursor = (row['timestamp'], cursor_id)
+                else:
+                    timestamp = archive.locate(cur, chat_type, archive.chat_key(chat_type, chat_id, user_id),
+                                               cursor_id)
+                    if timestamp is None:
+                        raise ValueError('Неизвестный курсор')
+                    cursor = (timestamp, cursor_id)
+                    cursor_archived = True
+
+            newer = bool(after_id)
+            cur.execute(*message_page_query(chat_type, chat_id, user_id, cursor, newer=newer, limit=limit))
+            rows = list(cur.fetchall())
+            # Архив старше горячих таблиц: в него идём, только когда горячее окно закончилось,
+            # а за новыми сообщениями - только если курсор сам уже в архиве
+            if (cursor_archived if newer else len(rows) < limit):
+                archived = archive.read_page(cur, chat_type, chat_id, user_id, cursor, newer,
+                                             limit if newer else limit - len(rows))
+                rows = archived + rows if newer else rows + archived
+                rows.sort(key=archive.sort_key, reverse=not newer)
+            return rows
+        finally:
+            cur.close()
+
+    def recent_direct_messages(self, user_id, limit):
+        return self._fetch("""
+            SELECT m.*, u.username as sender_name
+            FROM messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE m.receiver_id = %s OR m.sender_id = %s
+            ORDER BY m.timestamp DESC
+            LIMIT %s
+        """, (user_id, user_id, limit), primary=True)
+
+    def export_batches(self, chat_type, chat_id, user_id):
+        return export.mysql_batches(self.mysql.read_streaming_cursor(), chat_type, chat_id, user_id)
+
+    # Группы и участники
+
+    def group_directory(self, limit, offset):
+        return self._fetch("""
+            SELECT g.id, g.name, g.description, g.created_at, g.member_count,
+                   u.username AS creator_name
+            FROM chat_groups g
+            JOIN users u ON g.created_by = u.id
+            ORDER BY g.id DESC
+            LIMIT %s OFFSET %s
+        """, (limit, offset))
+
+    def user_groups(self, user_id):
+        # Группы пользователя - по индексу group_members.user_id, без подзапроса на каждую группу каталога
+        return self._fetch("""
+            SELECT g.id, g.name, g.description, g.created_at, g.member_count,
+                   u.username AS creator_name
+            FROM group_members gm
+            JOIN chat_groups g ON g.id = gm.group_id
+            JOIN users u ON g.created_by = u.id
+            WHERE gm.user_id = %s
+            ORDER BY g.name
+        """, (user_id,))
+
+    def group_member_ids(self, group_id):
+        rows = self._fetch("SELECT user_id FROM group_members WHERE group_id = %s", (group_id,), primary=True)
+        return [row['user_id'] for row in rows]
+
+    def group_page(self, group_id, limit, with_members=True):
+        # Информация о группе, последние сообщения (новые первыми) и участники - одним round-trip.
+        # Без with_members участники не запрашиваются (список уже есть в кэше фрагментов)
+        statements = [
+            ("""
+                SELECT g.*, u.username as creator_name
+                FROM chat_groups g
+                JOIN users u ON g.created_by = u.id
+                WHERE g.id = %s
+            """, (group_id,)),
+            ("""
+                SELECT gm.*, u.username as sender_name
+                FROM group_messages gm
+                JOIN users u ON gm.sender_id = u.id
+                WHERE gm.group_id = %s
+                ORDER BY gm.timestamp DESC, gm.id DESC
+                LIMIT %s
+            """, (group_id, limit)),
+        ]
+        if with_members:
+            statements.append(("""
+                SELECT u.id, u.username
+                FROM group_members gm
+                JOIN users u ON gm.user_id = u.id
+                WHERE gm.group_id = %s
+            """, (group_id,)))
+        results = self.mysql.execute_batch(statements, read_only=True)
+        group, messages = results[0], results[1]
+        members = list(results[2]) if with_members else None
+        return (group[0] if group else None), members, list(messages)
+
+    def _add_group_member(self, cur, group_id, user_id):
+        cur.execute("INSERT INTO group_members (group_id, user_id) VALUES (%s, %s)", (group_id, user_id))
+        cur.execute("UPDATE chat_groups SET member_count = member_count + 1 WHERE id = %s", (group_id,))
+        # Группа появляется в списке бесед сразу после вступления
+        cur.execute("""
+            INSERT IGNORE INTO conversation_summaries (user_id, chat_type, chat_id)
+            VALUES (%s, 'group', %s)
+        """, (user_id, group_id))
+
+    def create_group(self, name, description, created_by):
+        with self.transaction() as cur:
+            cur.execute("INSERT INTO `chat_groups` (name, description, created_by) VALUES (%s, %s, %s)",
+                        (name, description, created_by))
+            group_id = cur.lastrowid
+            self._add_group_member(cur, group_id, created_by)
+            return group_id
+
+    def join_group(self, group_id, user_id):
+        with self.transaction() as cur:
+            self._add_group_member(cur, group_id, user_id)
+
+    # Запросы дружбы и приглашения
+
+    def send_friend_request(self, sender_id, sender_name, receiver_id):
+        # False, если такой запрос уже ждёт ответа
+        with self.transaction() as cur:
+            cur.execute("""
+                SELECT 1 FROM friend_requests
+                WHERE sender_id = %s AND receiver_id = %s AND status = 'pending'
+            """, (sender_id, receiver_id))
+            if cur.fetchone():
+                return False
+            cur.execute("""
+                INSERT INTO friend_requests (sender_id, receiver_id)
+                VALUES (%s, %s)
+            """, (sender_id, receiver_id))
+            cur.execute("""
+                INSERT INTO notifications (user_id, content, notification_type, related_id)
+                VALUES (%s, %s, 'friend_request', %s)
+            """, (receiver_id, f"{sender_name} хочет добавить вас в друзья", cur.lastrowid))
+            return True
+
+    def invite_to_group(self, group_id, sender_id, sender_name, receiver_id):
+        with self.transaction() as cur:
+            cur.execute("""
+                SELECT 1 FROM group_invitations
+                WHERE group_id = %s AND receiver_id = %s AND status = 'pending'
+            """, (group_id, receiver_id))
+            if cur.fetchone():
+                return False
+            cur.execute("""
+                INSERT INTO group_invitations (group_id, sender_id, receiver_id)
+                VALUES (%s, %s, %s)
+            """, (group_id, sender_id, receiver_id))
+            invitation_id = cur.lastrowid
+            cur.execute("SELECT name FROM chat_groups WHERE id = %s", (group_id,))
+            group_name = cur.fetchone()['name']
+            cur.execute("""
+                INSERT INTO notifications (user_id, content, notification_type, related_id)
+                VALUES (%s, %s, 'group_invite', %s)
+            """, (receiver_id, f"{sender_name} приглашает вас в группу '{group_name}'", invitation_id))
+            return True
+
+    def answer_request(self, request_type, request_id, user_id, action):
+        # Возвращает id группы, в которую пользователь вступил, иначе None
+        with self.transaction() as cur:
+            if request_type == 'friend':
+                cur.execute("""
+                    UPDATE friend_requests
+                    SET status = %s
+                    WHERE id = %s AND receiver_id = %s
+                """, (action, request_id, user_id))
+            elif request_type == 'group':
+                cur.execute("""
+                    UPDATE group_invitations
+                    SET status = %s
+                    WHERE id = %s AND receiver_id = %s
+                """, (action, request_id, user_id))
+                if action == 'accepted':
+                    # Чужое приглашение не даёт права вступить в группу
+                    cur.execute("SELECT group_id FROM group_invitations WHERE id = %s AND receiver_id = %s",
+                                (request_id, user_id))
+                    invitation = cur.fetchone()
+                    if invitation is None:
+                        return None
+                    self._add_group_member(cur, invitation['group_id'], user_id)
+                    return invitation['group_id']
+        return None
+
+
+# Встроенная SQLite. Время хранится строкой в локальном часовом поясе, как TIMESTAMP в MySQL
+SQLITE_NOW = "datetime('now', 'localtime')"
+SQLITE_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+SQLITE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT ({SQLITE_NOW})
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    sender_id INTEGER NOT NULL REFERENCES users (id),
+    receiver_id INTEGER NOT NULL REFERENCES users (id),
+    conversation_key INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    timestamp TIMESTAMP NOT NULL DEFAULT ({SQLITE_NOW})
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_key, timestamp, id);
+
+CREATE TABLE IF NOT EXISTS chat_groups (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    created_by INTEGER NOT NULL REFERENCES users (id),
+    created_at TIMESTAMP NOT NULL DEFAULT ({SQLITE_NOW}),
+    member_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS group_members (
+    group_id INTEGER NOT NULL REFERENCES chat_groups (id),
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    joined_at TIMESTAMP NOT NULL DEFAULT ({SQLITE_NOW}),
+    PRIMARY KEY (group_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members (user_id);
+
+CREATE TABLE IF NOT EXISTS group_messages (
+    id INTEGER PRIMARY KEY,
+    group_id INTEGER NOT NULL REFERENCES chat_groups (id),
+    sender_id INTEGER NOT NULL REFERENCES users (id),
+    message TEXT NOT NULL,
+    timestamp TIMESTAMP NOT NULL DEFAULT ({SQLITE_NOW})
+);
+CREATE INDEX IF NOT EXISTS idx_group_messages_group ON group_messages (group_id, timestamp, id);
+
+CREATE TABLE IF NOT EXISTS friend_requests (
+    id INTEGER PRIMARY KEY,
+    sender_id INTEGER NOT NULL REFERENCES users (id),
+    receiver_id INTEGER NOT NULL REFERENCES users (id),
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at TIMESTAMP NOT NULL DEFAULT ({SQLITE_NOW})
+);
+CREATE INDEX IF NOT EXISTS idx_friend_requests_pair ON friend_requests (sender_id, receiver_id, status);
+
+CREATE TABLE IF NOT EXISTS group_invitations (
+    id INTEGER PRIMARY KEY,
+    group_id INTEGER NOT NULL REFERENCES chat_groups (id),
+    sender_id INTEGER NOT NULL REFERENCES users (id),
+    receiver_id INTEGER NOT NULL REFERENCES users (id),
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at TIMESTAMP NOT NULL DEFAULT ({SQLITE_NOW})
+);
+CREATE INDEX IF NOT EXISTS idx_group_invitations_receiver ON group_invitations (group_id, receiver_id, status);
+
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    content TEXT NOT NULL,
+    notification_type TEXT NOT NULL,
+    related_id INTEGER,
+    is_read INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT ({SQLITE_NOW})
+);
+
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    user_id INTEGER NOT NULL,
+    chat_type TEXT NOT NULL CHECK (chat_type IN ('user', 'group')),
+    chat_id INTEGER NOT NULL,
+    last_message_id INTEGER,
+    last_read_message_id INTEGER,
+    last_message_preview TEXT,
+    last_message_at TIMESTAMP NOT NULL DEFAULT ({SQLITE_NOW}),
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, chat_type, chat_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_conversation_summaries_recent
+    ON conversation_summaries (user_id, last_message_at, chat_type, chat_id);
+"""
+
+# Поиск подстрок в именах: FTS5 с токенизатором trigram (SQLite 3.34+) поверх users.
+# Таблица только индексирует users (content=users) и обновляется триггерами
+SQLITE_SEARCH_SCHEMA = (
+    """
+    CREATE VIRTUAL TABLE users_search USING fts5(
+        username, content = 'users', content_rowid = 'id', tokenize = 'trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER users_search_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_search (rowid, username) VALUES (new.id, new.username);
+    END
+    """,
+    """
+    CREATE TRIGGER users_search_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_search (users_search, rowid, username) VALUES ('delete', old.id, old.username);
+    END
+    """,
+    """
+    CREATE TRIGGER users_search_update AFTER UPDATE OF username ON users BEGIN
+        INSERT INTO users_search (users_search, rowid, username) VALUES ('delete', old.id, old.username);
+        INSERT INTO users_search (rowid, username) VALUES (new.id, new.username);
+    END
+    """,
+    # Уже зарегистрированные пользователи, если индекс добавляется к существующей базе
+    "INSERT INTO users_search (users_search) VALUES ('rebuild')",
+)
+
+# Обмен datetime <-> TEXT для колонок TIMESTAMP (detect_types=PARSE_DECLTYPES)
+sqlite3.register_adapter(datetime, lambda value: value.strftime(SQLITE_TIMESTAMP_FORMAT))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+
+
+def dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def sqlite_sql(sql):
+    return sql.replace('%s', '?')
+
+
+class SQLiteCursor:
+    # Курсор в стиле MySQLdb: параметры %s, строки-словари. Как и в MySQLdb, первый запрос
+    # открывает транзакцию, которую завершает commit()/rollback() соединения
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lastrowid = None
+        self._cur = None
+
+    def _begin(self):
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+
+    def execute(self, sql, params=()):
+        self._begin()
+        self._cur = self.conn.execute(sqlite_sql(sql), params)
+        self.lastrowid = self._cur.lastrowid
+        return self._cur.rowcount
+
+    def executemany(self, sql, rows):
+        self._begin()
+        self._cur = self.conn.executemany(sqlite_sql(sql), rows)
+        return self._cur.rowcount
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def close(self):
+        pass
+
+
+class SQLiteConnection:
+    # Соединение SQLiteStore под интерфейс соединения MySQLdb для кода, написанного под MySQL
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return SQLiteCursor(self.conn)
+
+    def commit(self):
+        if self.conn.in_transaction:
+            self.conn.execute("COMMIT")
+
+    def rollback(self):
+        if self.conn.in_transaction:
+            self.conn.execute("ROLLBACK")
+
+
+class SQLiteStore:
+    # Встроенная база в одном файле: запросы выполняются в процессе, без сети.
+    # WAL - читатели не ждут писателя; synchronous=NORMAL - fsync только на checkpoint
+    # (после сбоя ОС теряются последние транзакции, но файл не портится).
+    # Соединение своё у каждого потока; подготовленные запросы кэшируются соединением
+    # (cached_statements), поэтому текст SQL внутри методов постоянный, а значения - параметры.
+    # Записи - BEGIN IMMEDIATE: блокировка берётся сразу, и чтение-изменение внутри транзакции
+    # (счётчики, отметки прочтения) не нужно защищать SELECT ... FOR UPDATE
+
+    STATEMENT_CACHE_SIZE = 256
+
+    def __init__(self, path, busy_timeout=5.0, cache_size_mb=64, mmap_size_mb=256):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.pragmas = (
+            "PRAGMA journal_mode = WAL",
+            "PRAGMA synchronous = NORMAL",
+            "PRAGMA foreign_keys = ON",
+            f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}",
+            f"PRAGMA cache_size = -{int(cache_size_mb * 1024)}",
+            f"PRAGMA mmap_size = {int(mmap_size_mb * 1024 * 1024)}",
+            "PRAGMA temp_store = MEMORY",
+        )
+        self.query_listeners = []
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._search_index = False
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                   detect_types=sqlite3.PARSE_DECLTYPES,
+                                   cached_statements=self.STATEMENT_CACHE_SIZE)
+            conn.row_factory = dict_row
+            for pragma in self.pragmas:
+                conn.execute(pragma)
+            if not self._schema_ready:
+                with self._schema_lock:
+                    if not self._schema_ready:
+                        conn.executescript(SQLITE_SCHEMA)
+                        self._search_index = self._create_search_index(conn)
+                        self._schema_ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create_schema(self):
+        conn = self._connection()
+        conn.executescript(SQLITE_SCHEMA)
+        self._search_index = self._create_search_index(conn)
+
+    def _create_search_index(self, conn):
+        # Проверка и создание в одной транзакции: воркеры узла стартуют одновременно
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_search'").fetchone() is None:
+                for statement in SQLITE_SEARCH_SCHEMA:
+                    conn.execute(statement)
+            conn.execute("COMMIT")
+            return True
+        except sqlite3.OperationalError:
+            # SQLite без FTS5 или без токенизатора trigram
+            conn.execute("ROLLBACK")
+            logger.warning("SQLite %s has no FTS5 trigram tokenizer: username search scans users with LIKE",
+                           sqlite3.sqlite_version)
+            return False
+
+    def _execute(self, conn, sql, params=(), fetch=None):
+        # Тот же учёт, что у курсоров PooledMySQL: g.db_queries, g.db_time и query_listeners
+        started = time.perf_counter()
+        try:
+            cur = conn.execute(sqlite_sql(sql), params)
+            if fetch == 'one':
+                return cur.fetchone()
+            if fetch == 'all':
+                return cur.fetchall()
+            return cur
+        finally:
+            elapsed = time.perf_counter() - started
+            if has_app_context():
+                g.db_queries = g.get('db_queries', 0) + 1
+                g.db_time = g.get('db_time', 0.0) + elapsed
+            for listener in self.query_listeners:
+                listener(sql, elapsed)
+
+    def _fetch(self, sql, params=(), one=False):
+        return self._execute(self._connection(), sql, params, 'one' if one else 'all')
+
+    def raw_connection(self):
+        # Соединение в стиле MySQLdb для служебного кода вне маршрутов (генератор данных бенчмарков)
+        return SQLiteConnection(self._connection())
+
+    @contextmanager
+    def transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # Пользователи
+
+    def get_user(self, user_id):
+        return self._fetch("SELECT id, username, email, created_at FROM users WHERE id = ?", (user_id,), one=True)
+
+    def has_user(self, user_id):
+        return self._fetch("SELECT 1 FROM users WHERE id = ?", (user_id,), one=True) is not None
+
+    def user_for_login(self, username):
+        return self._fetch("SELECT id, username, email, password FROM users WHERE username = ?",
+                           (username,), one=True)
+
+    def user_exists(self, username, email):
+        return self._fetch("SELECT 1 FROM users WHERE username = ? OR email = ?",
+                           (username, email), one=True) is not None
+
+    def create_user(self, username, email, password_hash):
+        with self.transaction() as conn:
+            return self._execute(conn, "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
+                                 (username, email, password_hash)).lastrowid
+
+    def other_users(self, user_id):
+        return self._fetch("SELECT id, username FROM users WHERE id != ?", (user_id,))
+
+    def search_users(self, query, exclude_id, limit, offset):
+        # Короткие запросы - по префиксу (индекс UNIQUE username), остальные - через users_search.
+        # Токенизатор trigram находит только подстроки от трёх символов
+        prefix = escape_like(query) + '%'
+        if len(query) < 3:
+            return self._fetch("""
+                SELECT id, username FROM users
+                WHERE username LIKE ? ESCAPE '\\' AND id != ?
+                ORDER BY username, id
+                LIMIT ? OFFSET ?
+            """, (prefix, exclude_id, limit, offset))
+        if self._search_index:
+            # Сначала имена, начинающиеся с запроса, затем остальные вхождения
+            phrase = '"' + query.replace('"', '""') + '"'
+            return self._fetch("""
+                SELECT u.id, u.username FROM users_search s
+                JOIN users u ON u.id = s.rowid
+                WHERE users_search MATCH ? AND u.id != ?
+                ORDER BY u.username LIKE ? ESCAPE '\\' DESC, u.username, u.id
+                LIMIT ? OFFSET ?
+            """, (phrase, exclude_id, prefix, limit, offset))
+        # Без FTS5 - LIKE по всей таблице
+        return self._fetch("""
+            SELECT id, username FROM users
+            WHERE username LIKE ? ESCAPE '\\' AND id != ?
+            ORDER BY username LIKE ? ESCAPE '\\' DESC, username, id
+            LIMIT ? OFFSET ?
+        """, ('%' + escape_like(query) + '%', exclude_id, prefix, limit, offset))
+
+    def chat_name(self, chat_type, chat_id):
+        if chat_type == 'user':
+            row = self._fetch("SELECT username AS name FROM users WHERE id = ?", (chat_id,), one=True)
+        else:
+            row = self._fetch("SELECT name FROM chat_groups WHERE id = ?", (chat_id,), one=True)
+        return row['name'] if row else None
+
+    # Беседы и отметки прочтения
+
+    def conversations(self, user_id, limit, offset):
+        return self._fetch("""
+            SELECT cs.chat_type, cs.chat_id, COALESCE(u.username, g.name) AS name,
+                   cs.last_message_id, cs.last_message_preview, cs.last_message_at, cs.unread_count
+            FROM conversation_summaries cs
+            LEFT JOIN users u ON cs.chat_type = 'user' AND u.id = cs.chat_id
+            LEFT JOIN chat_groups g ON cs.chat_type = 'group' AND g.id = cs.chat_id
+            WHERE cs.user_id = ?
+            ORDER BY cs.last_message_at DESC, cs.chat_type DESC, cs.chat_id DESC
+            LIMIT ? OFFSET ?
+        """, (user_id, limit, offset))
+
+    def conversation_version(self, user_id, chat_type, chat_id):
+        return self._fetch("""
+            SELECT last_message_id, last_message_at FROM conversation_summaries
+            WHERE user_id = ? AND chat_type = ? AND chat_id = ?
+        """, (user_id, chat_type, chat_id), one=True)
+
+    def unread(self, user_id):
+        return self._fetch("""
+            SELECT chat_type, chat_id, unread_count, last_read_message_id FROM conversation_summaries
+            WHERE user_id = ? AND unread_count > 0
+        """, (user_id,))
+
+    def _update_summaries(self, conn, chat_type, chat_id, sender_id, message, message_id):
+        # У отправителя беседа поднимается наверх прочитанной, у остальных растёт счётчик
+        preview = message[:PREVIEW_LENGTH]
+        upsert = """
+            ON CONFLICT (user_id, chat_type, chat_id) DO UPDATE SET
+                last_message_id = excluded.last_message_id,
+                last_read_message_id = CASE WHEN excluded.unread_count = 0
+                    THEN excluded.last_read_message_id ELSE conversation_summaries.last_read_message_id END,
+                last_message_preview = excluded.last_message_preview,
+                last_message_at = excluded.last_message_at,
+                unread_count = CASE WHEN excluded.unread_count = 0
+                    THEN 0 ELSE conversation_summaries.unread_count + 1 END
+        """
+        if chat_type == 'user':
+            rows = [(sender_id, chat_id, message_id, message_id, preview, 0)]
+            if int(chat_id) != int(sender_id):
+                rows.append((chat_id, sender_id, message_id, None, preview, 1))
+            for row in rows:
+                self._execute(conn, f"""
+                    INSERT INTO conversation_summaries
+                        (user_id, chat_type, chat_id, last_message_id, last_read_message_id,
+                         last_message_preview, last_message_at, unread_count)
+                    VALUES (?, 'user', ?, ?, ?, ?, {SQLITE_NOW}, ?)
+                    {upsert}
+                """, row)
+        else:
+            # WHERE обязателен: без него SQLite не отличит ON CONFLICT от условия соединения
+            self._execute(conn, f"""
+                INSERT INTO conversation_summaries
+                    (user_id, chat_type, chat_id, last_message_id, last_read_message_id,
+                     last_message_preview, last_message_at, unread_count)
+                SELECT user_id, 'group', group_id, ?, CASE WHEN user_id = ? THEN ? END, ?, {SQLITE_NOW},
+                       CASE WHEN user_id = ? THEN 0 ELSE 1 END
+                FROM group_members
+                WHERE group_id = ?
+                {upsert}
+            """, (message_id, sender_id, message_id, preview, sender_id, chat_id))
+
+    def mark_read(self, user_id, chat_type, chat_id, message_id=None):
+        with self.transaction() as conn:
+            summary = self._execute(conn, """
+                SELECT last_message_id, last_read_message_id, unread_count FROM conversation_summaries
+                WHERE user_id = ? AND chat_type = ? AND chat_id = ?
+            """, (user_id, chat_type, chat_id), 'one')
+            if summary is None:
+                return None
+
+            last_id = summary['last_message_id'] or 0
+            read_id = min(message_id or last_id, last_id)
+            if read_id <= (summary['last_read_message_id'] or 0):
+                return summary['unread_count']
+
+            unread = 0
+            if read_id != last_id:
+                if chat_type == 'user':
+                    table, condition, key = 'messages', 'conversation_key = ?', conversation_key(user_id, chat_id)
+                else:
+                    table, condition, key = 'group_messages', 'group_id = ?', chat_id
+                unread = self._execute(conn, f"""
+                    SELECT COUNT(*) AS unread FROM {table}
+                    WHERE {condition} AND sender_id != ? AND id > ?
+                      AND timestamp >= (SELECT timestamp FROM {table} WHERE id = ? AND {condition})
+                """, (key, user_id, read_id, read_id, key), 'one')['unread']
+            self._execute(conn, """
+                UPDATE conversation_summaries SET last_read_message_id = ?, unread_count = ?
+                WHERE user_id = ? AND chat_type = ? AND chat_id = ?
+            """, (read_id, unread, user_id, chat_type, chat_id))
+            return unread
+
+    # Сообщения
+
+    def insert_message(self, chat_type, chat_id, sender_id, message):
+        with self.transaction() as conn:
+            if chat_type == 'user':
+                message_id = self._execute(conn, """
+                    INSERT INTO messages (sender_id, receiver_id, conversation_key, message)
+                    VALUES (?, ?, ?, ?)
+                """, (sender_id, chat_id, conversation_key(sender_id, chat_id), message)).lastrowid
+            else:
+                message_id = self._execute(conn, """
+                    INSERT INTO group_messages (group_id, sender_id, message)
+                    VALUES (?, ?, ?)
+                """, (chat_id, sender_id, message)).lastrowid
+            self._update_summaries(conn, chat_type, chat_id, sender_id, message, message_id)
+            return message_id
+
+    def message_page(self, chat_type, chat_id, user_id, after_id=None, before_id=None, limit=100):
+        cursor = None
+        cursor_id = after_id or before_id
+        if cursor_id:
+            row = self._fetch(*message_cursor_query(chat_type, chat_id, user_id, cursor_id), one=True)
+            if row is None:
+                raise ValueError('Неизвестный курсор')
+            cursor = (row['timestamp'], cursor_id)
+        return self._fetch(*message_page_query(chat_type, chat_id, user_id, cursor,
+                                               newer=bool(after_id), limit=limit))
+
+    def recent_direct_messages(self, user_id, limit):
+        return self._fetch("""
+            SELECT m.*, u.username as sender_name
+            FROM messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE m.receiver_id = ? OR m.sender_id = ?
+            ORDER BY m.timestamp DESC
+            LIMIT ?
+        """, (user_id, user_id, limit))
+
+    def export_batches(self, chat_type, chat_id, user_id):
+        # Отдельное соединение: курсор читается по мере отправки ответа, уже вне контекста запроса
+        sql, params = export.export_query(chat_type, chat_id, user_id)
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.row_factory = dict_row
+        try:
+            cur = conn.execute(sqlite_sql(sql), params)
+            while True:
+                rows = cur.fetchmany(export.FETCH_SIZE)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            conn.close()
+
+    # Группы и участники
+
+    def group_directory(self, limit, offset):
+        return self._fetch("""
+            SELECT g.id, g.name, g.description, g.created_at, g.member_count,
+                   u.username AS creator_name
+            FROM chat_groups g
+            JOIN users u ON g.created_by = u.id
+            ORDER BY g.id DESC
+            LIMIT ? OFFSET ?
+        """, (limit, offset))
+
+    def user_groups(self, user_id):
+        return self._fetch("""
+            SELECT g.id, g.name, g.description, g.created_at, g.member_count,
+                   u.username AS creator_name
+            FROM group_members gm
+            JOIN chat_groups g ON g.id = gm.group_id
+            JOIN users u ON g.created_by = u.id
+            WHERE gm.user_id = ?
+            ORDER BY g.name
+        """, (user_id,))
+
+    def group_member_ids(self, group_id):
+        return [row['user_id'] for row in
+                self._fetch("SELECT user_id FROM group_members WHERE group_id = ?", (group_id,))]
+
+    def group_page(self, group_id, limit, with_members=True):
+        # Несколько запросов в процессе дешевле, чем один round-trip до сервера
+        group = self._fetch("""
+            SELECT g.*, u.username as creator_name
+            FROM chat_groups g
+            JOIN users u ON g.created_by = u.id
+            WHERE g.id = ?
+        """, (group_id,), one=True)
+        members = None
+        if with_members:
+            members = self._fetch("""
+                SELECT u.id, u.username
+                FROM group_members gm
+                JOIN users u ON gm.user_id = u.id
+                WHERE gm.group_id = ?
+            """, (group_id,))
+        messages = self._fetch("""
+            SELECT gm.*, u.username as sender_name
+            FROM group_messages gm
+            JOIN users u ON gm.sender_id = u.id
+            WHERE gm.group_id = ?
+            ORDER BY gm.timestamp DESC, gm.id DESC
+            LIMIT ?
+        """, (group_id, limit))
+        return group, members, messages
+
+    def _add_group_member(self, conn, group_id, user_id):
+        self._execute(conn, "INSERT INTO group_members (group_id, user_id) VALUES (?, ?)", (group_id, user_id))
+        self._execute(conn, "UPDATE chat_groups SET member_count = member_count + 1 WHERE id = ?", (group_id,))
+        self._execute(conn, """
+            INSERT OR IGNORE INTO conversation_summaries (user_id, chat_type, chat_id)
+            VALUES (?, 'group', ?)
+        """, (user_id, group_id))
+
+    def create_group(self, name, description, created_by):
+        with self.transaction() as conn:
+            group_id = self._execute(conn, "INSERT INTO chat_groups (name, description, created_by) VALUES (?, ?, ?)",
+                                     (name, description, created_by)).lastrowid
+            self._add_group_member(conn, group_id, created_by)
+            return group_id
+
+    def join_group(self, group_id, user_id):
+        with self.transaction() as conn:
+            self._add_group_member(conn, group_id, user_id)
+
+    # Запросы дружбы и приглашения
+
+    def send_friend_request(self, sender_id, sender_name, receiver_id):
+        with self.transaction() as conn:
+            if self._execute(conn, """
+                SELECT 1 FROM friend_requests
+                WHERE sender_id = ? AND receiver_id = ? AND status = 'pending'
+            """, (sender_id, receiver_id), 'one'):
+                return False
+            request_id = self._execute(conn, "INSERT INTO friend_requests (sender_id, receiver_id) VALUES (?, ?)",
+                                       (sender_id, receiver_id)).lastrowid
+            self._execute(conn, """
+                INSERT INTO notifications (user_id, content, notification_type, related_id)
+                VALUES (?, ?, 'friend_request', ?)
+            """, (receiver_id, f"{sender_name} хочет добавить вас в друзья", request_id))
+            return True
+
+    def invite_to_group(self, group_id, sender_id, sender_name, receiver_id):
+        with self.transaction() as conn:
+            if self._execute(conn, """
+                SELECT 1 FROM group_invitations
+                WHERE group_id = ? AND receiver_id = ? AND status = 'pending'
+            """, (group_id, receiver_id), 'one'):
+                return False
+            invitation_id = self._execute(conn, """
+                INSERT INTO group_invitations (group_id, sender_id, receiver_id)
+                VALUES (?, ?, ?)
+            """, (group_id, sender_id, receiver_id)).lastrowid
+            group_name = self._execute(conn, "SELECT name FROM chat_groups WHERE id = ?", (group_id,), 'one')['name']
+            self._execute(conn, """
+                INSERT INTO notifications (user_id, content, notification_type, related_id)
+                VALUES (?, ?, 'group_invite', ?)
+            """, (receiver_id, f"{sender_name} приглашает вас в группу '{group_name}'", invitation_id))
+            return True
+
+    def answer_request(self, request_type, request_id, user_id, action):
+        with self.transaction() as conn:
+            if request_type == 'friend':
+                self._execute(conn, "UPDATE friend_requests SET status = ? WHERE id = ? AND receiver_id = ?",
+                              (action, request_id, user_id))
+            elif request_type == 'group':
+                self._execute(conn, "UPDATE group_invitations SET status = ? WHERE id = ? AND receiver_id = ?",
+                              (action, request_id, user_id))
+                if action == 'accepted':
+                    # Чужое приглашение не даёт права вступить в группу
+                    invitation = self._execute(conn, """
+                        SELECT group_id FROM group_invitations WHERE id = ? AND receiver_id = ?
+                    """, (request_id, user_id), 'one')
+                    if invitation is None:
+                        return None
+                    self._add_group_member(conn, invitation['group_id'], user_id)
+                    return invitation['group_id']
+        return None
@@ -0,0 +1,66 @@
+import itertools
+import os
+import sys
+
+import pytest
+
+# Модули приложения лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Clock:
+    # Подменяет time.monotonic/time.time: тесты двигают время вручную
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('time.monotonic', clock)
+    monkeypatch.setattr('time.time', clock)
+    return clock
+
+
+@pytest.fixture(scope='session')
+def chat(tmp_path_factory):
+    # Приложение на встроенной SQLite. Модулю app нужен установленный mysqlclient,
+    # хотя сервер MySQL не используется
+    pytest.importorskip('MySQLdb')
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('DATABASE_BACKEND', 'sqlite')
+        patch.setenv('SQLITE_PATH', str(tmp_path_factory.mktemp('db') / 'chat.db'))
+        patch.setenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+        patch.setenv('PASSWORD_HASH_WORKERS', '1')
+        patch.setenv('RATE_LIMITS', '')
+        import app as chat
+    chat.app.testing = True
+    yield chat
+    chat.hasher.shutdown()
+
+
+_user_numbers = itertools.count(1)
+
+
+@pytest.fixture
+def login(chat):
+    # login('alice') - зарегистрированный и вошедший пользователь; у клиента есть user_id.
+    # База общая на сессию, поэтому имена уникальны
+    def login(name='user'):
+        username = f"{name}{next(_user_numbers)}"
+        client = chat.app.test_client()
+        client.post('/register', data={'username': username, 'email': f'{username}@example.com',
+                                       'password': 'password'})
+        response = client.post('/login', data={'username': username, 'password': 'password'})
+        assert response.status_code == 302
+        client.user_id = chat.store.user_for_login(username)['id']
+        client.username = username
+        return client
+    return login
@@ -0,0 +1,167 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import archive
+from migrations import conversation_key
+from storage import SQLITE_SCHEMA, MySQLStore, dict_row, sqlite_sql
+
+# Архив написан под MySQL (курсоры MySQLdb, %s); здесь те же запросы выполняются на SQLite,
+# синтаксис которой (row values, LIMIT) совпадает для этих запросов
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE message_archive (
+    id INTEGER PRIMARY KEY,
+    chat_type TEXT NOT NULL,
+    chat_key INTEGER NOT NULL,
+    first_at TIMESTAMP NOT NULL,
+    first_id INTEGER NOT NULL,
+    last_at TIMESTAMP NOT NULL,
+    last_id INTEGER NOT NULL,
+    min_id INTEGER NOT NULL,
+    max_id INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    payload BLOB NOT NULL
+);
+"""
+
+START = datetime(2026, 1, 1, 12, 0, 0)
+
+
+class SQLiteCursor:
+    # Курсор в стиле MySQLdb поверх sqlite3: параметры %s и строки-словари
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._cur = None
+
+    def execute(self, sql, params=()):
+        self._cur = self.conn.execute(sqlite_sql(sql), params)
+        return self._cur.rowcount
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def close(self):
+        pass
+
+
+class SQLiteMySQL:
+    # Вместо PooledMySQL для MySQLStore: чтения и записи идут в одно соединение
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    @property
+    def read_connection(self):
+        return self
+
+    connection = read_connection
+
+    def cursor(self):
+        return SQLiteCursor(self.conn)
+
+
+def message(message_id, sender_id=1, receiver_id=2):
+    return {
+        'id': message_id,
+        'sender_id': sender_id,
+        'sender_name': 'alice' if sender_id == 1 else 'bob',
+        'receiver_id': receiver_id,
+        'message': f'message {message_id}',
+        'timestamp': START + timedelta(minutes=message_id),
+    }
+
+
+def archive_segment(conn, chat_type, key, rows):
+    ids = [row['id'] for row in rows]
+    conn.execute("""
+        INSERT INTO message_archive
+            (chat_type, chat_key, first_at, first_id, last_at, last_id, min_id, max_id, message_count, payload)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (chat_type, key, rows[0]['timestamp'], rows[0]['id'], rows[-1]['timestamp'], rows[-1]['id'],
+          min(ids), max(ids), len(rows), archive.encode(rows)))
+
+
+@pytest.fixture
+def conn():
+    # Беседа alice (1) и bob (2) из 10 сообщений: 1-6 в двух архивных сегментах, 7-10 в messages
+    conn = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.row_factory = dict_row
+    conn.executescript(SQLITE_SCHEMA + ARCHIVE_SCHEMA)
+    conn.execute("INSERT INTO users (id, username, email, password) VALUES (1, 'alice', 'a@x', ''), (2, 'bob', 'b@x', '')")
+    key = conversation_key(1, 2)
+    archive_segment(conn, 'user', key, [message(i) for i in (1, 2, 3)])
+    archive_segment(conn, 'user', key, [message(i) for i in (4, 5, 6)])
+    for i in range(7, 11):
+        row = message(i)
+        conn.execute("""
+            INSERT INTO messages (id, sender_id, receiver_id, conversation_key, message, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (i, row['sender_id'], row['receiver_id'], key, row['message'], row['timestamp']))
+    return conn
+
+
+def ids(rows):
+    return [row['id'] for row in rows]
+
+
+def test_encode_decode_round_trip():
+    rows = [message(1), message(2, sender_id=2, receiver_id=1)]
+    assert archive.decode(archive.encode(rows), 'user', 2) == rows
+
+    group_rows = archive.decode(archive.encode([dict(message(3), receiver_id=None)]), 'group', 7)
+    assert group_rows[0]['group_id'] == 7
+    assert 'receiver_id' not in group_rows[0]
+    assert group_rows[0]['timestamp'] == START + timedelta(minutes=3)
+
+
+def test_read_page_walks_segments_from_the_cursor(conn):
+    cur = SQLiteCursor(conn)
+    assert ids(archive.read_page(cur, 'user', 2, 1, limit=4)) == [6, 5, 4, 3]
+    cursor = (START + timedelta(minutes=4), 4)
+    assert ids(archive.read_page(cur, 'user', 2, 1, cursor, limit=10)) == [3, 2, 1]
+    cursor = (START + timedelta(minutes=2), 2)
+    assert ids(archive.read_page(cur, 'user', 2, 1, cursor, newer=True, limit=3)) == [3, 4, 5]
+
+
+def test_locate_finds_archived_message(conn):
+    cur = SQLiteCursor(conn)
+    key = conversation_key(1, 2)
+    assert archive.locate(cur, 'user', key, 5) == START + timedelta(minutes=5)
+    assert archive.locate(cur, 'user', key, 42) is None
+
+
+def test_message_page_falls_through_to_archive(conn):
+    store = MySQLStore(SQLiteMySQL(conn))
+    # Горячее окно короче страницы - остаток из архива
+    assert ids(store.message_page('user', 2, 1, limit=6)) == [10, 9, 8, 7, 6, 5]
+    assert ids(store.message_page('user', 2, 1, before_id=7, limit=3)) == [6, 5, 4]
+    # Курсор, который сам уже в архиве
+    assert ids(store.message_page('user', 2, 1, before_id=5, limit=10)) == [4, 3, 2, 1]
+    assert ids(store.message_page('user', 2, 1, after_id=5, limit=10)) == [6, 7, 8, 9, 10]
+
+
+def test_message_page_skips_archive_after_hot_cursor(conn, monkeypatch):
+    # Новее горячего курсора в архиве ничего нет, поэтому архив не читается
+    def read_page(*args, **kwargs):
+        raise AssertionError('archive must not be read')
+
+    monkeypatch.setattr(archive, 'read_page', read_page)
+    store = MySQLStore(SQLiteMySQL(conn))
+    assert ids(store.message_page('user', 2, 1, after_id=8, limit=10)) == [9, 10]
+
+
+def test_message_page_rejects_unknown_cursor(conn):
+    store = MySQLStore(SQLiteMySQL(conn))
+    with pytest.raises(ValueError):
+        store.message_page('user', 2, 1, before_id=42, limit=10)
+    # Сообщения 5 (архив) и 8 (горячее) есть, но в беседе alice и bob, а не alice и carol
+    with pytest.raises(ValueError):
+        store.message_page('user', 3, 1, before_id=8, limit=10)
+    with pytest.raises(ValueError):
+        store.message_page('user', 3, 1, after_id=5, limit=10)
@@ -0,0 +1,24 @@
+from broker import MemoryBroker
+from realtime import ChatHub
+
+
+def test_listeners_get_events_of_their_channel():
+    broker = MemoryBroker(ChatHub())
+    received = []
+    broker.listen('membership', received.append)
+    broker.publish('membership', {'group_id': 1})
+    broker.publish('group:1', {'id': 5})
+    assert received == [{'group_id': 1}]
+
+
+def test_failing_listener_does_not_break_delivery():
+    hub = ChatHub()
+    broker = MemoryBroker(hub)
+    q = hub.subscribe('membership')
+
+    def fail(event):
+        raise RuntimeError('listener failed')
+
+    broker.listen('membership', fail)
+    assert broker.publish('membership', {'group_id': 1}) == 1
+    assert q.get_nowait() == {'group_id': 1}
@@ -0,0 +1,112 @@
+from cache import MembershipCache, TTLCache
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set('a', 1)
+    clock.advance(59)
+    assert cache.get('a') == 1
+    clock.advance(2)
+    assert cache.get('a') is None
+    assert cache.get('a', 'default') == 'default'
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_update_changes_only_live_entries(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set('a', 1)
+    cache.update('a', lambda value: value + 1)
+    cache.update('missing', lambda value: value + 1)
+    assert cache.get('a') == 2
+    assert cache.get('missing') is None
+
+    # Обновление не продлевает жизнь записи
+    clock.advance(61)
+    cache.update('a', lambda value: value + 1)
+    assert cache.get('a') is None
+
+
+def test_invalidate_and_clear(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.invalidate('a')
+    cache.invalidate('missing')
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    cache.clear()
+    assert cache.get('b') is None
+
+
+def test_stats_count_hits_and_misses(clock):
+    cache = TTLCache(maxsize=5, ttl=60)
+    cache.set('a', 1)
+    cache.get('a')
+    cache.get('a')
+    cache.get('b')
+    assert cache.stats() == {'size': 1, 'maxsize': 5, 'hits': 2, 'misses': 1}
+
+
+class Loader:
+    # Участники групп "в базе"; считает обращения
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.calls = 0
+
+    def __call__(self, group_id):
+        self.calls += 1
+        return list(self.groups.get(group_id, ()))
+
+
+def test_members_are_loaded_once_per_ttl(clock):
+    loader = Loader({1: [10, 11]})
+    cache = MembershipCache(loader, ttl=60)
+    assert cache.members(1) == {10, 11}
+    assert cache.is_member('1', '10')
+    assert loader.calls == 1
+    clock.advance(61)
+    assert cache.members(1) == {10, 11}
+    assert loader.calls == 2
+
+
+def test_denial_is_rechecked_against_the_database(clock):
+    # Пользователь вступил через другой воркер: кэш этого процесса ещё без него
+    loader = Loader({1: [10]})
+    cache = MembershipCache(loader, ttl=60)
+    assert not cache.is_member(1, 20)
+    loader.groups[1].append(20)
+    assert cache.is_member(1, 20)
+    assert cache.is_member(1, 20)
+    assert loader.calls == 2
+
+
+def test_add_updates_cached_members(clock):
+    loader = Loader({1: [10]})
+    cache = MembershipCache(loader, ttl=60)
+    cache.members(1)
+    cache.add(1, 20)
+    assert cache.is_member(1, 20)
+    assert loader.calls == 1
+    # Группы, которой нет в кэше, add не создаёт
+    cache.add(2, 20)
+    assert loader.calls == 1
+
+
+def test_invalidate_drops_a_stale_member(clock):
+    loader = Loader({1: [10, 20]})
+    cache = MembershipCache(loader, ttl=60)
+    assert cache.is_member(1, 20)
+    loader.groups[1].remove(20)
+    cache.invalidate(1)
+    assert not cache.is_member(1, 20)
@@ -0,0 +1,21 @@
+from bench import datagen
+from storage import SQLiteStore
+
+
+def test_generate_and_reset_on_sqlite(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'bench.db'))
+    datagen.prepare(store)
+    datagen.generate(store, users=30, groups=5, messages=300, log=lambda message: None)
+
+    groups = store.group_directory(limit=10, offset=0)
+    assert len(groups) == 5
+    for group in groups:
+        assert group['member_count'] == len(store.group_member_ids(group['id'])) > 0
+
+    user = store.user_for_login(f"{datagen.USERNAME_PREFIX}0000000")
+    assert store.conversations(user['id'], limit=100, offset=0)
+    assert len(store.search_users('ench_', exclude_id=0, limit=50, offset=0)) == 30
+
+    datagen.reset(store)
+    assert store.group_directory(limit=10, offset=0) == []
+    assert store.search_users('ench_', exclude_id=0, limit=50, offset=0) == []
@@ -0,0 +1,69 @@
+import pytest
+from flask import Flask
+
+pytest.importorskip('MySQLdb')
+
+from db import PooledMySQL  # noqa: E402
+
+
+class Pool:
+    # Пул без сервера: соединение - имя пула, курсор ничего не выполняет
+
+    def __init__(self, name):
+        self.name = name
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+        return self
+
+    def release(self, conn, discard=False):
+        pass
+
+    def cursor(self, cursorclass=None):
+        return self
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def mysql():
+    mysql = PooledMySQL()
+    mysql.pool = Pool('primary')
+    mysql.replica_pools = [Pool('replica')]
+    return mysql
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    return app
+
+
+def used_pool(streaming_cursor):
+    with streaming_cursor as cur:
+        return cur.name
+
+
+def test_streamed_reads_go_to_replica(app, mysql):
+    with app.test_request_context():
+        streaming_cursor = mysql.read_streaming_cursor()
+    assert used_pool(streaming_cursor) == 'replica'
+
+
+def test_streamed_reads_after_own_write_go_to_primary(app, mysql):
+    with app.test_request_context():
+        mysql.mark_written()
+        streaming_cursor = mysql.read_streaming_cursor()
+        assert used_pool(mysql.streaming_cursor(read_only=True)) == 'primary'
+    # Курсор открывается уже после запроса, как в потоковом ответе
+    assert used_pool(streaming_cursor) == 'primary'
+
+
+def test_streamed_reads_within_read_your_writes_window_go_to_primary(app, mysql):
+    with app.test_request_context() as ctx:
+        ctx.session['_primary_until'] = float('inf')
+        streaming_cursor = mysql.read_streaming_cursor()
+    assert used_pool(streaming_cursor) == 'primary'
@@ -0,0 +1,63 @@
+import os
+import signal
+import time
+
+import pytest
+
+from hashing import HashPoolBusy, PasswordHasher
+
+METHOD = 'pbkdf2:sha256:1000'
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(workers=1, method=METHOD)
+    yield hasher
+    hasher.shutdown()
+
+
+def kill_workers(hasher):
+    executor = hasher._executor
+    for pid in list(executor._processes):
+        os.kill(pid, signal.SIGKILL)
+    # Ждём, пока пул заметит гибель процесса
+    deadline = time.monotonic() + 10
+    while not executor._broken:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_hash_and_check(hasher):
+    pwhash = hasher.hash('secret')
+    assert hasher.check(pwhash, 'secret')
+    assert not hasher.check(pwhash, 'wrong')
+    assert hasher.stats()['completed'] == 3
+    assert hasher.stats()['pending'] == 0
+
+
+def test_queue_limit_rejects(hasher):
+    hasher.max_pending = 0
+    with pytest.raises(HashPoolBusy):
+        hasher.hash('secret')
+    assert hasher.stats()['rejected'] == 1
+
+
+def test_pool_is_rebuilt_after_worker_dies(hasher):
+    pwhash = hasher.hash('secret')
+    kill_workers(hasher)
+    assert hasher.check(pwhash, 'secret')
+    assert hasher.check(pwhash, 'secret')
+    stats = hasher.stats()
+    assert stats['restarts'] == 1
+    assert stats['pending'] == 0
+
+
+def test_job_lost_with_worker_gets_busy(hasher):
+    pwhash = hasher.hash('secret')
+    # Процесс пула погибает посреди задания: этот запрос получает 503, следующий проходит
+    with pytest.raises(HashPoolBusy):
+        hasher._run(os._exit, 1)
+    assert hasher.check(pwhash, 'secret')
+    stats = hasher.stats()
+    assert stats['restarts'] == 1
+    assert stats['pending'] == 0
@@ -0,0 +1,81 @@
+def send(client, receiver, count):
+    ids = []
+    for i in range(count):
+        response = client.post('/send_message', json={'chat_type': 'user', 'chat_id': receiver.user_id,
+                                                       'message': f'message {i}'})
+        assert response.status_code == 200
+        ids.append(response.json['data']['id'])
+    return ids
+
+
+def history(client, peer, **args):
+    return client.get(f'/get_chat_messages/user/{peer.user_id}', query_string=args)
+
+
+def test_pages_walk_history_in_both_directions(login):
+    alice, bob = login('alice'), login('bob')
+    ids = send(alice, bob, 5)
+
+    page = history(bob, alice, limit=2).json
+    assert [m['id'] for m in page['messages']] == ids[3:]
+    assert page['has_more'] and page['before_id'] == ids[3]
+
+    older = history(bob, alice, limit=2, before_id=page['before_id']).json
+    assert [m['id'] for m in older['messages']] == ids[1:3]
+
+    oldest = history(bob, alice, limit=2, before_id=older['before_id']).json
+    assert [m['id'] for m in oldest['messages']] == ids[:1]
+    assert not oldest['has_more'] and oldest['before_id'] is None
+
+    newer = history(bob, alice, after_id=ids[2]).json
+    assert [m['id'] for m in newer['messages']] == ids[3:]
+    assert newer['after_id'] == ids[-1]
+    assert history(bob, alice, after_id=ids[-1]).json['messages'] == []
+
+
+def test_both_cursors_are_rejected(login):
+    alice, bob = login('alice'), login('bob')
+    ids = send(alice, bob, 2)
+    response = history(bob, alice, after_id=ids[0], before_id=ids[1])
+    assert response.status_code == 400
+
+
+def test_unknown_cursor_is_rejected(login):
+    alice, bob = login('alice'), login('bob')
+    send(alice, bob, 1)
+    assert history(bob, alice, before_id=10 ** 9).status_code == 400
+    assert history(bob, alice, after_id=10 ** 9).status_code == 400
+
+
+def test_cursor_from_another_chat_is_rejected(login):
+    alice, bob, carol = login('alice'), login('bob'), login('carol')
+    foreign_id, = send(alice, carol, 1)
+    send(alice, bob, 1)
+    assert history(bob, alice, before_id=foreign_id).status_code == 400
+    assert history(bob, alice, after_id=foreign_id).status_code == 400
+
+
+def test_invalid_limit_is_rejected(login):
+    alice, bob = login('alice'), login('bob')
+    assert history(bob, alice, limit=0).status_code == 400
+
+
+def test_unchanged_history_returns_304(login):
+    alice, bob = login('alice'), login('bob')
+    send(alice, bob, 1)
+    response = history(bob, alice)
+    etag = response.headers['ETag']
+    cached = bob.get(f'/get_chat_messages/user/{alice.user_id}', headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+
+    send(alice, bob, 1)
+    assert bob.get(f'/get_chat_messages/user/{alice.user_id}',
+                   headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_group_history_requires_membership(login):
+    alice, bob = login('alice'), login('bob')
+    alice.post('/create_group', data={'name': 'group', 'description': ''})
+    group_id = alice.get('/api/conversations').json['conversations'][0]['chat_id']
+    assert alice.get(f'/get_chat_messages/group/{group_id}').status_code == 200
+    assert bob.get(f'/get_chat_messages/group/{group_id}').status_code == 403
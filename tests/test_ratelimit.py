@@ -0,0 +1,53 @@
+import pytest
+
+from ratelimit import MemoryBuckets, SQLiteBuckets, parse_limits, refill
+
+
+def test_parse_limits():
+    assert parse_limits('send_message=20/10, invite_to_group=5/60,') == {
+        'send_message': (20.0, 2.0),
+        'invite_to_group': (5.0, 5 / 60),
+    }
+    assert parse_limits('') == {}
+    assert parse_limits(None) == {}
+    # Без периода ведро наполняется за секунду
+    assert parse_limits('search_users=3') == {'search_users': (3.0, 3.0)}
+
+
+def test_refill_is_capped_by_capacity():
+    assert refill(0, 100, 101, capacity=10, rate=2) == 2
+    assert refill(5, 100, 200, capacity=10, rate=2) == 10
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def buckets(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBuckets()
+    return SQLiteBuckets(str(tmp_path / 'buckets.db'))
+
+
+def test_bucket_allows_burst_then_waits_for_refill(buckets):
+    for _ in range(3):
+        assert buckets.take('send:1', 3, 1, now=100) == 0
+    assert buckets.take('send:1', 3, 1, now=100) == pytest.approx(1.0)
+    # Отказ не тратит токен: через полсекунды ждать ещё полсекунды
+    assert buckets.take('send:1', 3, 1, now=100.5) == pytest.approx(0.5)
+    assert buckets.take('send:1', 3, 1, now=101) == 0
+    # У другого ключа своё ведро
+    assert buckets.take('send:2', 3, 1, now=101) == 0
+
+
+def test_memory_buckets_drop_refilled_entries():
+    buckets = MemoryBuckets(prune_every=10)
+    for user_id in range(9):
+        buckets.take(f'send:{user_id}', 2, 1, now=0)
+    buckets.take('send:busy', 2, 1, now=0)
+    buckets.take('send:busy', 2, 1, now=0)
+    assert len(buckets) == 10
+
+    for _ in range(9):
+        buckets.take('send:late', 2, 1, now=1.5)
+    # Полные вёдра удалены; опустошённое наполнится только к 2.0
+    assert len(buckets) == 2
+    assert buckets.take('send:busy', 2, 1, now=1.5) == 0
+    assert buckets.take('send:busy', 2, 1, now=1.5) == pytest.approx(0.5)
@@ -0,0 +1,29 @@
+import json
+
+from realtime import ChatHub, sse_stream
+
+
+def test_stream_not_started_holds_nothing():
+    # Клиент ушёл до первого next(): ни подписки, ни отметки присутствия
+    hub = ChatHub()
+    opened = []
+    stream = sse_stream(hub, 'user:1:2', json.dumps, on_open=lambda: opened.append(1))
+    stream.close()
+    assert hub.subscriber_count() == 0
+    assert opened == []
+
+
+def test_stream_unsubscribes_on_close():
+    hub = ChatHub()
+    events = []
+    stream = sse_stream(hub, 'user:1:2', json.dumps,
+                        on_open=lambda: events.append('open'), on_close=lambda: events.append('close'))
+    assert next(stream).startswith('retry:')
+    assert hub.subscriber_count('user:1:2') == 1
+
+    hub.publish('user:1:2', {'id': 7, 'message': 'hi'})
+    assert next(stream) == 'id: 7\ndata: {"id": 7, "message": "hi"}\n\n'
+
+    stream.close()
+    assert hub.subscriber_count() == 0
+    assert events == ['open', 'close']
@@ -0,0 +1,44 @@
+from search import TrigramIndex
+
+
+def rows(*names, start=1):
+    return [{'id': user_id, 'username': name} for user_id, name in enumerate(names, start)]
+
+
+def names(results):
+    return [user['username'] for user in results]
+
+
+def test_substrings_prefix_first_case_insensitive():
+    index = TrigramIndex()
+    index.load(rows('jimbob', 'Bobby', 'bob', 'alice'))
+    assert names(index.search('bob', exclude_id=0, limit=10, offset=0)) == ['bob', 'Bobby', 'jimbob']
+    assert names(index.search('BOB', exclude_id=0, limit=1, offset=2)) == ['jimbob']
+    assert index.search('xyz', exclude_id=0, limit=10, offset=0) == []
+
+
+def test_candidates_are_checked_against_the_whole_query():
+    # Обе тройки "abc" и "bcd" есть в имени, но подстроки "abcd" нет
+    index = TrigramIndex()
+    index.load(rows('abcxbcd', 'xabcdx'))
+    assert names(index.search('abcd', exclude_id=0, limit=10, offset=0)) == ['xabcdx']
+
+
+def test_exclude_id_and_incremental_add():
+    index = TrigramIndex()
+    index.load(rows('alice', 'malice'))
+    assert index.last_id == 2
+    assert names(index.search('lic', exclude_id=1, limit=10, offset=0)) == ['malice']
+
+    index.add(rows('alicia', start=3))
+    assert index.last_id == 3
+    assert len(index) == 3
+    assert names(index.search('ali', exclude_id=0, limit=10, offset=0)) == ['alice', 'alicia', 'malice']
+
+
+def test_load_replaces_index():
+    index = TrigramIndex()
+    index.load(rows('alice', 'bob'))
+    index.load(rows('carol'))
+    assert index.search('ali', exclude_id=0, limit=10, offset=0) == []
+    assert names(index.search('car', exclude_id=0, limit=10, offset=0)) == ['carol']
@@ -0,0 +1,147 @@
+import pytest
+
+import export
+from storage import SQLiteStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteStore(str(tmp_path / 'chat.db'))
+
+
+@pytest.fixture
+def users(store):
+    return [store.create_user(name, f'{name}@example.com', 'hash') for name in ('alice', 'bob', 'carol')]
+
+
+def test_database_runs_in_wal_mode(store):
+    assert store._fetch("PRAGMA journal_mode", one=True)['journal_mode'] == 'wal'
+
+
+def test_users(store, users):
+    alice, bob, _ = users
+    assert store.user_for_login('alice')['id'] == alice
+    assert store.user_for_login('nobody') is None
+    assert store.get_user(bob)['username'] == 'bob'
+    assert store.has_user(bob) and not store.has_user(999)
+    assert store.user_exists('alice', 'other@example.com')
+    assert store.user_exists('other', 'bob@example.com')
+    assert not store.user_exists('other', 'other@example.com')
+    assert [user['username'] for user in store.other_users(alice)] == ['bob', 'carol']
+
+
+@pytest.mark.parametrize('search_index', [True, False], ids=['fts5', 'like'])
+def test_search_users_matches_substrings_prefix_first(store, search_index):
+    for name in ('bob', 'jimbob', 'bobby', 'al_ice', 'alice'):
+        store.create_user(name, f'{name}@example.com', 'hash')
+    assert store._search_index
+    store._search_index = search_index
+
+    def search(query, limit=10, offset=0):
+        return [user['username'] for user in store.search_users(query, exclude_id=0, limit=limit, offset=offset)]
+
+    assert search('bob') == ['bob', 'bobby', 'jimbob']
+    assert search('BOB', limit=2, offset=1) == ['bobby', 'jimbob']
+    # Запрос короче тройки символов ищется только по префиксу
+    assert search('bo') == ['bob', 'bobby']
+    # Символы LIKE в запросе ищутся буквально
+    assert search('_ic') == ['al_ice']
+    assert search('%') == []
+    assert search('b%b') == []
+
+
+def test_messages_pages_and_summaries(store, users):
+    alice, bob, carol = users
+    ids = [store.insert_message('user', bob, alice, f'message {i}') for i in range(5)]
+
+    newest = store.message_page('user', bob, alice, limit=2)
+    assert [row['id'] for row in newest] == ids[:-3:-1]
+    older = store.message_page('user', bob, alice, before_id=ids[3], limit=10)
+    assert [row['id'] for row in older] == ids[2::-1]
+    newer = store.message_page('user', alice, bob, after_id=ids[1], limit=10)
+    assert [row['id'] for row in newer] == ids[2:]
+    assert newer[0]['sender_name'] == 'alice'
+    with pytest.raises(ValueError):
+        store.message_page('user', bob, alice, before_id=999, limit=10)
+    # Курсор из чужой беседы - тоже неизвестный
+    with pytest.raises(ValueError):
+        store.message_page('user', carol, alice, before_id=ids[3], limit=10)
+    group_id = store.create_group('team', '', alice)
+    with pytest.raises(ValueError):
+        store.message_page('group', group_id, alice, before_id=ids[3], limit=10)
+
+    conversation, = store.conversations(bob, limit=10, offset=0)
+    assert (conversation['chat_type'], conversation['chat_id'], conversation['name']) == ('user', alice, 'alice')
+    assert conversation['last_message_id'] == ids[-1]
+    assert conversation['last_message_preview'] == 'message 4'
+    assert conversation['unread_count'] == 5
+    # Свои сообщения не считаются непрочитанными
+    assert store.conversations(alice, limit=10, offset=0)[0]['unread_count'] == 0
+    assert store.conversation_version(bob, 'user', alice)['last_message_id'] == ids[-1]
+
+
+def test_mark_read_only_moves_forward(store, users):
+    alice, bob, _ = users
+    ids = [store.insert_message('user', bob, alice, f'message {i}') for i in range(4)]
+    assert store.mark_read(bob, 'user', alice, ids[1]) == 2
+    assert store.unread(bob) == [{'chat_type': 'user', 'chat_id': alice, 'unread_count': 2,
+                                  'last_read_message_id': ids[1]}]
+    assert store.mark_read(bob, 'user', alice, ids[0]) == 2
+    assert store.mark_read(bob, 'user', alice) == 0
+    assert store.unread(bob) == []
+    assert store.mark_read(bob, 'user', 999) is None
+
+
+def test_groups(store, users):
+    alice, bob, carol = users
+    group_id = store.create_group('team', 'description', alice)
+    store.join_group(group_id, bob)
+    assert sorted(store.group_member_ids(group_id)) == [alice, bob]
+    assert [group['name'] for group in store.user_groups(bob)] == ['team']
+    directory, = store.group_directory(limit=10, offset=0)
+    assert (directory['member_count'], directory['creator_name']) == (2, 'alice')
+
+    message_id = store.insert_message('group', group_id, bob, 'hello')
+    group, members, messages = store.group_page(group_id, 50)
+    assert group['name'] == 'team'
+    assert sorted(member['username'] for member in members) == ['alice', 'bob']
+    assert [row['id'] for row in messages] == [message_id]
+    # Без участников список не читается
+    assert store.group_page(group_id, 50, with_members=False)[1] is None
+
+    summaries = {row['chat_id']: row for row in store.unread(alice)}
+    assert summaries[group_id]['unread_count'] == 1
+    assert store.unread(carol) == []
+
+
+def test_requests(store, users):
+    alice, bob, carol = users
+    assert store.send_friend_request(alice, 'alice', bob)
+    assert not store.send_friend_request(alice, 'alice', bob)
+
+    group_id = store.create_group('team', '', alice)
+    assert store.invite_to_group(group_id, alice, 'alice', carol)
+    assert not store.invite_to_group(group_id, alice, 'alice', carol)
+    invitation = store._fetch("SELECT id FROM group_invitations WHERE receiver_id = ?", (carol,), one=True)
+    # Ответить может только получатель
+    store.answer_request('group', invitation['id'], bob, 'accepted')
+    assert bob not in store.group_member_ids(group_id)
+    assert store.answer_request('group', invitation['id'], carol, 'accepted') == group_id
+    assert carol in store.group_member_ids(group_id)
+
+    request = store._fetch("SELECT id FROM friend_requests WHERE receiver_id = ?", (bob,), one=True)
+    assert store.answer_request('friend', request['id'], bob, 'accepted') is None
+    assert store._fetch("SELECT status FROM friend_requests WHERE id = ?", (request['id'],), one=True)['status'] == 'accepted'
+
+
+def test_export_batches(store, users):
+    alice, bob, _ = users
+    for i in range(3):
+        store.insert_message('user', bob, alice, f'message {i}')
+    lines = b''.join(export.stream_export(store.export_batches('user', bob, alice), 'user')).splitlines()
+    assert len(lines) == 3
+    assert b'"message 0"' in lines[0] and b'"sender_name":"alice"' in lines[0]
+
+    csv_text = ''.join(export.stream_export(store.export_batches('user', bob, alice), 'user', 'csv'))
+    assert csv_text.splitlines()[0] == 'id,sender_id,sender_name,receiver_id,message,timestamp'
+    assert len(csv_text.splitlines()) == 4